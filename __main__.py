@@ -19,6 +19,7 @@ Copyright (C) 2015 Robert Walker
 """
 
 import logging
+import pyliteco.log
 import pyliteco.watchdog
 import pyliteco.version
 import sys
@@ -26,14 +27,7 @@ import sys
 
 if __name__ == '__main__':
     
-    formatter_string = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    formatter = logging.Formatter(formatter_string)
-    logging.basicConfig(filename = 'pyliteco.log', format = formatter_string)    
-    root = logging.getLogger()
-    root.setLevel(logging.NOTSET)
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setFormatter(formatter)
-    root.addHandler(ch)
+    pyliteco.log.start(filename = 'pyliteco.log', stream = sys.stdout, level = logging.NOTSET)
     
     logger = logging.getLogger(__name__)
     logger.info('Starting up as app. v{}'.format(pyliteco.version.VERSION))
@@ -42,5 +36,8 @@ if __name__ == '__main__':
     
     parser = argparse.ArgumentParser("Start the pyliteco program")
     parser.add_argument('-c', dest = 'config_file_entered', default = None, metavar = 'Config file')
+    parser.add_argument('-m', dest = 'multi_room', action = 'store_true', help = 'Run every room listed in the config file')
+    parser.add_argument('-a', dest = 'async_mode', action = 'store_true', help = 'Poll the rooms from an asyncio event loop')
     thread = pyliteco.watchdog.Watchdog_Thread(**vars(parser.parse_args()))
-    thread.start()
\ No newline at end of file
+    thread.start()
+    pyliteco.log.stop()
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""End to end benchmark: how long after the echo box changes state does
+the indicator change, and what does it cost to get there.
+
+Runs pyliteco against local stand-ins for the echo box and config server
+(benchmarks.echo_stub) with an instrumented dummy indicator
+(benchmarks.instrumented), flips the state of the stand-ins through a
+script and saves the latency percentiles, CPU per room and indicator
+calls per change of state as JSON. Run from the top of the repository:
+
+    python3 -m benchmarks.e2e_latency --transitions 20 -o results.json
+    python3 -m benchmarks.e2e_latency --mode async --rooms 20
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import benchmarks.echo_stub
+import benchmarks.instrumented
+import pyliteco.lights
+import pyliteco.version
+
+
+logger = logging.getLogger(__name__)
+
+
+SCRIPT = ('active', 'paused', 'active', 'complete', 'inactive')
+"""States the echo boxes are flipped through, over and over, starting
+from inactive. Each one shows differently to the one before."""
+START_TIMEOUT = 30
+"""Seconds to wait for every indicator to show the first state."""
+
+
+def percentile(values, percent):
+
+    """Get a percentile of some values, by nearest rank.
+
+    Arguments:
+        values (list): Values, sorted.
+        percent (float): Percentile wanted, e.g. 99.
+
+    Returns:
+        The value, or None if there are no values.
+    """
+
+    if not values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarise(values):
+
+    """Get the percentiles and friends of some latencies.
+
+    Arguments:
+        values (list): Latencies in seconds.
+
+    Returns:
+        Dict of count, mean, p50, p90, p99 and max.
+    """
+
+    values = sorted(values)
+    return {'count': len(values),
+            'mean': sum(values) / len(values) if values else None,
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': values[-1] if values else None}
+
+
+def make_thread(mode, config_file):
+
+    """Make the pyliteco thread to benchmark.
+
+    Arguments:
+        mode (string): 'thread' for Main_Thread, 'rooms' for Supervisor_Thread
+            or 'async' for Async_Supervisor_Thread.
+        config_file (string): Local config file.
+
+    Returns:
+        The thread, not started.
+    """
+
+    kwargs = {'config_file_entered': config_file}
+    if mode == 'thread':
+        import pyliteco.pyliteco
+        return pyliteco.pyliteco.Main_Thread(kwargs = kwargs)
+    elif mode == 'rooms':
+        import pyliteco.rooms
+        return pyliteco.rooms.Supervisor_Thread(kwargs = kwargs)
+    import pyliteco.aio
+    return pyliteco.aio.Async_Supervisor_Thread(kwargs = kwargs)
+
+
+def write_config(directory, stubs, mode, poll_intervals = None):
+
+    """Write the local config pointing pyliteco at the stand-ins.
+
+    Arguments:
+        directory (string): Where to write it.
+        stubs (list): Echo_Stub for each room. The first is also the config server.
+        mode (string): As make_thread.
+        poll_intervals (dict): "poll_intervals" for the config, None for the defaults.
+
+    Returns:
+        Path of the config file.
+    """
+
+    config = {'user': 'user', 'pass': 'pass', 'logging': 'WARNING',
+              'indicator': benchmarks.instrumented.DEVICE_NAME,
+              'server': stubs[0].url + benchmarks.echo_stub.CONFIG_PATH,
+              'schedule_refresh': 0}
+    if poll_intervals is not None:
+        config['poll_intervals'] = poll_intervals
+    if mode != 'thread':
+        config['rooms'] = [{'name': 'room{}'.format(index), 'ip': stub.url,
+                            'indicator_serial': 'room{}'.format(index)}
+                           for index, stub in enumerate(stubs)]
+    path = os.path.join(directory, 'pyliteco.json')
+    with open(path, 'w') as file_:
+        json.dump(config, file_)
+    return path
+
+
+def run(mode = 'thread', rooms = 1, transitions = 20, hold = 2, timeout = 60, poll_intervals = None):
+
+    """Run the benchmark.
+
+    Arguments:
+        mode (string): As make_thread. 'thread' only does one room.
+        rooms (int): Number of echo box / indicator pairs.
+        transitions (int): Number of changes of state to time.
+        hold (float): Seconds between changes of state.
+        timeout (float): Seconds to wait for the indicator before counting
+            a change of state as missed.
+        poll_intervals (dict): "poll_intervals" for the config, None for the defaults.
+
+    Returns:
+        Dict of results.
+    """
+
+    if mode == 'thread':
+        rooms = 1
+    benchmarks.instrumented.register()
+    benchmarks.instrumented.Device.devices.clear()
+    stubs = [benchmarks.echo_stub.Echo_Stub() for _ in range(rooms)]
+    for stub in stubs:
+        stub.start()
+    actions = pyliteco.lights.compile_light_actions(stubs[0].config())
+    serials = [None] if mode == 'thread' else ['room{}'.format(index) for index in range(rooms)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        thread = make_thread(mode, write_config(directory, stubs, mode, poll_intervals))
+        thread.start()
+        try:
+            # Wait for every room to be up and showing inactive
+            start = time.perf_counter()
+            for serial in serials:
+                while serial not in benchmarks.instrumented.Device.devices:
+                    if time.perf_counter() - start > START_TIMEOUT:
+                        raise RuntimeError('Indicator {} never opened.'.format(serial))
+                    time.sleep(0.05)
+                action = actions['inactive']
+                device = benchmarks.instrumented.Device.devices[serial]
+                if device.wait_for_change(action.colours, action.flash, start, START_TIMEOUT) is None:
+                    raise RuntimeError('Indicator {} never showed inactive.'.format(serial))
+            devices = [benchmarks.instrumented.Device.devices[serial] for serial in serials]
+
+            latencies = []
+            missed = 0
+            calls_before = sum(device.hid_calls() for device in devices)
+            stub_cpu_before = sum(stub.cpu_seconds for stub in stubs)
+            cpu_before = time.process_time()
+            wall_before = time.perf_counter()
+            for index in range(transitions):
+                state = SCRIPT[index % len(SCRIPT)]
+                action = actions[state]
+                flipped = time.perf_counter()
+                for stub in stubs:
+                    stub.set_state(state)
+                for device in devices:
+                    change = device.wait_for_change(action.colours, action.flash, flipped,
+                                                    timeout - (time.perf_counter() - flipped))
+                    if change is None:
+                        missed += 1
+                    else:
+                        latencies.append(change.time - flipped)
+                time.sleep(max(hold - (time.perf_counter() - flipped), 0))
+            wall = time.perf_counter() - wall_before
+            cpu = time.process_time() - cpu_before - (sum(stub.cpu_seconds for stub in stubs) - stub_cpu_before)
+            calls = sum(device.hid_calls() for device in devices) - calls_before
+        finally:
+            thread.stop()
+            thread.join(10)
+            for stub in stubs:
+                stub.stop()
+
+    return {'benchmark': 'e2e_latency',
+            'version': pyliteco.version.VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'mode': mode,
+            'rooms': rooms,
+            'transitions': transitions,
+            'hold': hold,
+            'poll_intervals': poll_intervals,
+            'latency': summarise(latencies),
+            'missed': missed,
+            'wall_seconds': wall,
+            'cpu_seconds_per_room': cpu / rooms,
+            'cpu_percent_per_room': 100.0 * cpu / rooms / wall,
+            'hid_calls_per_transition': calls / float(transitions * rooms),
+            'echo_requests': sum(stub.requests for stub in stubs)}
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'Time how long the indicator takes to follow the echo box.')
+    parser.add_argument('--mode', choices = ('thread', 'rooms', 'async'), default = 'thread',
+                        help = 'Main_Thread, Supervisor_Thread or Async_Supervisor_Thread')
+    parser.add_argument('--rooms', type = int, default = 1, help = 'Rooms to run (not for --mode thread)')
+    parser.add_argument('--transitions', type = int, default = 20, help = 'Changes of state to time')
+    parser.add_argument('--hold', type = float, default = 2, help = 'Seconds between changes of state')
+    parser.add_argument('--timeout', type = float, default = 60,
+                        help = 'Seconds before a change of state counts as missed')
+    parser.add_argument('--poll-intervals', dest = 'poll_intervals', type = json.loads, default = None,
+                        help = 'JSON "poll_intervals" for the config, e.g. \'{"active": [0.1, 1]}\'')
+    parser.add_argument('-o', dest = 'output', default = 'e2e_latency.json', help = 'File to save the results to')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level = logging.WARNING)
+    results = run(args.mode, args.rooms, args.transitions, args.hold, args.timeout, args.poll_intervals)
+    with open(args.output, 'w') as file_:
+        json.dump(results, file_, indent = 4)
+    latency = results['latency']
+    print('{} transitions x {} rooms, {} missed'.format(results['transitions'], results['rooms'], results['missed']))
+    if latency['count']:
+        print('latency p50 {:.3f}s p99 {:.3f}s max {:.3f}s'.format(latency['p50'], latency['p99'], latency['max']))
+    print('CPU per room {:.3f}s ({:.2f}%), {:.2f} indicator calls per transition'.format(
+                results['cpu_seconds_per_room'], results['cpu_percent_per_room'],
+                results['hid_calls_per_transition']))
+    print('Saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Local stand-ins for an echo box and the config server, for benchmarks.
+
+The echo box side answers the pages pyliteco asks for with a state that
+the benchmark sets, and the same server answers config server requests
+with the light state config and its own URL as the echo box.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import http.server
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+import pyliteco.config
+import pyliteco.schedule
+
+
+logger = logging.getLogger(__name__)
+
+
+CONFIG_PATH = '/pyliteco.php'
+"""Page the stand-in config server answers on."""
+STATUS_PATH = '/status/monitoring'
+"""Echo box page giving the current capture state."""
+PAUSE_PATH = '/capture/pause'
+"""Echo box page to pause the current capture."""
+RECORD_PATH = '/capture/record'
+"""Echo box page to carry on recording the current capture."""
+STATUS_PAGE = '<monitoring><state>{}</state></monitoring>'
+"""Status page given for the current state."""
+SCHEDULE_PAGE = '<schedule></schedule>'
+"""Schedule page given, with nothing scheduled."""
+
+
+class Echo_Handler(http.server.BaseHTTPRequestHandler):
+
+    """Answers requests for the Echo_Stub it is served by."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        self._answer('GET')
+
+    def do_POST(self):
+
+        self._answer('POST')
+
+    def _answer(self, method):
+
+        start = time.thread_time()
+        try:
+            code, content_type, body = self.server.stub.respond(method, self.path)
+            body = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            self.server.stub.add_cpu(time.thread_time() - start)
+
+    def log_message(self, format, *args):
+
+        logger.debug(format % args)
+
+
+class Echo_Stub(object):
+
+    """Pretend echo box (and config server) on a local port.
+
+    Instance attributes:
+        cpu_seconds (float): CPU time spent answering requests.
+        requests (int): Number of requests answered.
+        state (string): State the echo box reports.
+        url (string): URL of the stand-in, e.g. http://127.0.0.1:51234.
+
+    Methods:
+        add_cpu: Count CPU time spent answering a request.
+        config: Get the config the stand-in config server gives.
+        respond: Work out the answer to a request.
+        set_state: Change the state the echo box reports.
+        start: Start serving.
+        stop: Stop serving.
+    """
+
+    def __init__(self, state = 'inactive', host = '127.0.0.1', port = 0):
+
+        """Constructor.
+
+        Arguments:
+            state (string): State to report to start with.
+            host (string): Address to listen on.
+            port (int): Port to listen on, 0 for any free port.
+
+        Returns:
+            None.
+        """
+
+        self.state = state
+        self.cpu_seconds = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer((host, port), Echo_Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.url = 'http://{}:{}'.format(*self._server.server_address[:2])
+        self._thread = None
+
+    def add_cpu(self, seconds):
+
+        """Count CPU time spent answering a request, so it can be taken off
+        the CPU time of the process being measured.
+
+        Arguments:
+            seconds (float): CPU time spent.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            self.cpu_seconds += seconds
+            self.requests += 1
+
+    def config(self):
+
+        """Get the combined config the stand-in config server gives: the
+        default light states, with this stand-in as the echo box.
+
+        Arguments:
+            None.
+
+        Returns:
+            Dict of config.
+        """
+
+        config = dict(pyliteco.config.DEFAULT_CONFIG_JSON)
+        config['ip'] = self.url
+        return config
+
+    def respond(self, method, path):
+
+        """Work out the answer to a request.
+
+        Arguments:
+            method (string): HTTP method.
+            path (string): Path asked for, including any query.
+
+        Returns:
+            Tuple of status code, content type and body (string).
+        """
+
+        parts = urllib.parse.urlsplit(path)
+        if parts.path == CONFIG_PATH:
+            if parts.query == 'all':
+                return 200, 'application/json', json.dumps(self.config())
+            if parts.query == 'config':
+                config = self.config()
+                del config['ip']
+                return 200, 'application/json', json.dumps(config)
+            return 200, 'text/plain', self.url
+        if parts.path == STATUS_PATH:
+            return 200, 'text/xml', STATUS_PAGE.format(self.state)
+        if parts.path == pyliteco.schedule.SCHEDULE_PATH:
+            return 200, 'text/xml', SCHEDULE_PAGE
+        if method == 'POST' and parts.path == PAUSE_PATH:
+            self.set_state('paused')
+        elif method == 'POST' and parts.path == RECORD_PATH:
+            self.set_state('active')
+        return 200, 'text/xml', '<ok/>'
+
+    def set_state(self, state):
+
+        """Change the state the echo box reports.
+
+        Arguments:
+            state (string): New state, e.g. 'active'.
+
+        Returns:
+            None.
+        """
+
+        self.state = state
+
+    def start(self):
+
+        """Start serving, on a thread of its own.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._thread = threading.Thread(target = self._server.serve_forever, name = 'echo_stub')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+
+        """Stop serving.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,737 @@
+"""Simulated fleet of echo boxes, for load testing many rooms on one machine.
+
+Each virtual box listens on a port of its own and answers the pages an
+echo box does, so echo360.capture_device.Echo360CaptureDevice talks to it
+unchanged. Its state follows a timeline, its answers are delayed by a
+latency distribution and a share of requests can be answered with errors
+or have the connection dropped. Every box is served from one asyncio
+event loop, so hundreds of them cost one thread.
+
+Serve a fleet and write a pyliteco config with a room for each box:
+
+    python3 -m benchmarks.fleet --boxes 500 --write-config fleet.json
+
+Or run pyliteco against it in the same process and save what happened:
+
+    python3 -m benchmarks.fleet --boxes 500 --run async --duration 300 -o results.json
+
+The fleet is described by a JSON spec (--spec), see DEFAULT_SPEC.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import argparse
+import asyncio
+import bisect
+import collections
+import json
+import logging
+import math
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+import benchmarks.echo_stub
+import benchmarks.instrumented
+import pyliteco.config
+import pyliteco.lights
+import pyliteco.schedule
+import pyliteco.version
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SPEC = {
+    'boxes': 10,
+    'timeline': [[0, 'inactive'], [60, 'waiting'], [75, 'active'], [135, 'paused'],
+                 [145, 'active'], [205, 'complete'], [215, 'inactive']],
+    'period': 300,
+    'stagger': True,
+    'latency': {'distribution': 'lognormal', 'median': 0.02, 'sigma': 0.5},
+    'error_rate': 0,
+    'drop_rate': 0,
+    'config_churn': 0,
+    'seed': 1,
+    'overrides': {}
+}
+"""Spec used for anything not given in --spec.
+
+boxes: Number of virtual boxes.
+timeline: [seconds, state] pairs, the state each box reports from that
+    many seconds into its timeline.
+period: Seconds after which the timeline starts again, 0 to stay on the
+    last state.
+stagger: Start each box at a random point of its timeline, so they don't
+    all change state at once.
+latency: Distribution of the delay before answering (see make_latency).
+error_rate: Share of requests answered with 500 Internal Server Error.
+drop_rate: Share of requests whose connection is closed without an answer.
+config_churn: Seconds between changes to the config served, 0 for never.
+seed: Seed for the random numbers, so runs can be repeated.
+overrides: Spec entries to use for particular boxes, by room name.
+"""
+HTTP_REASONS = {200: 'OK', 404: 'Not Found', 500: 'Internal Server Error'}
+"""Reason phrases for the status codes answered with."""
+
+
+def make_latency(spec, rand):
+
+    """Make a function giving response delays from a distribution.
+
+    Arguments:
+        spec (dict): 'distribution' and its parameters, one of:
+            fixed: 'seconds'.
+            uniform: 'low', 'high'.
+            exponential: 'mean'.
+            lognormal: 'median', 'sigma'.
+            None or {} for no delay.
+        rand (random.Random): Source of random numbers.
+
+    Returns:
+        Function taking nothing and giving seconds.
+
+    Raises:
+        ValueError: Unknown distribution.
+    """
+
+    if not spec:
+        return lambda: 0
+    distribution = spec.get('distribution', 'fixed')
+    if distribution == 'fixed':
+        seconds = float(spec.get('seconds', 0))
+        return lambda: seconds
+    if distribution == 'uniform':
+        low, high = float(spec['low']), float(spec['high'])
+        return lambda: rand.uniform(low, high)
+    if distribution == 'exponential':
+        rate = 1.0 / float(spec['mean'])
+        return lambda: rand.expovariate(rate)
+    if distribution == 'lognormal':
+        mu, sigma = math.log(float(spec['median'])), float(spec['sigma'])
+        return lambda: rand.lognormvariate(mu, sigma)
+    raise ValueError('Unknown latency distribution {!r}'.format(distribution))
+
+
+class Timeline(object):
+
+    """States a box goes through over time.
+
+    Instance attributes:
+        offset (float): Seconds into the timeline the box starts at.
+        period (float): Seconds after which the timeline repeats, 0 for never.
+
+    Methods:
+        state_at: Get the state some seconds after the start.
+    """
+
+    def __init__(self, steps, period = 0, offset = 0):
+
+        """Constructor.
+
+        Arguments:
+            steps (list): [seconds, state] pairs.
+            period (float): Seconds after which the timeline repeats, 0 for never.
+            offset (float): Seconds into the timeline to start at.
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError: No steps.
+        """
+
+        steps = sorted((float(seconds), state) for seconds, state in steps)
+        if not steps:
+            raise ValueError('Timeline has no steps.')
+        self._times = [seconds for seconds, _ in steps]
+        self._states = [state for _, state in steps]
+        self.period = float(period)
+        self.offset = float(offset)
+
+    def state_at(self, elapsed):
+
+        """Get the state some seconds after the box started.
+
+        Arguments:
+            elapsed (float): Seconds since the start.
+
+        Returns:
+            State (string).
+        """
+
+        elapsed += self.offset
+        if self.period > 0:
+            elapsed %= self.period
+        index = bisect.bisect_right(self._times, elapsed) - 1
+        return self._states[max(index, 0)]
+
+
+class Virtual_Box(object):
+
+    """One simulated echo box.
+
+    Instance attributes:
+        counts (Counter): Requests answered, errors and drops.
+        name (string): Room name of the box.
+        port (int): Port the box is served on, once the fleet has started.
+        reported (string): State given in the last status answered, None
+            before the first.
+
+    Methods:
+        fault: Decide whether a request goes wrong.
+        respond: Work out the answer to a request.
+        state: Get the state the box reports now.
+    """
+
+    def __init__(self, name, spec, rand, started):
+
+        """Constructor.
+
+        Arguments:
+            name (string): Room name of the box.
+            spec (dict): Spec for this box, as DEFAULT_SPEC.
+            rand (random.Random): Source of random numbers.
+            started (float): time.monotonic() value the fleet started at.
+
+        Returns:
+            None.
+        """
+
+        self.name = name
+        self.port = None
+        self.reported = None
+        self.counts = collections.Counter()
+        period = float(spec.get('period', 0))
+        offset = rand.uniform(0, period) if spec.get('stagger') and period > 0 else 0
+        self._timeline = Timeline(spec['timeline'], period, offset)
+        self._latency = make_latency(spec.get('latency'), rand)
+        self._error_rate = float(spec.get('error_rate', 0))
+        self._drop_rate = float(spec.get('drop_rate', 0))
+        self._rand = rand
+        self._started = started
+        # State set by pause/record, until the timeline next moves on
+        self._held = None
+
+    def state(self, now = None):
+
+        """Get the state the box reports now.
+
+        Arguments:
+            now (float): time.monotonic() value, None for now.
+
+        Returns:
+            State (string).
+        """
+
+        if now is None:
+            now = time.monotonic()
+        state = self._timeline.state_at(now - self._started)
+        if self._held is not None:
+            if self._held[0] == state:
+                return self._held[1]
+            self._held = None
+        return state
+
+    def delay(self):
+
+        """Get how long to wait before answering a request.
+
+        Arguments:
+            None.
+
+        Returns:
+            Seconds.
+        """
+
+        return max(self._latency(), 0)
+
+    def fault(self):
+
+        """Decide whether a request goes wrong.
+
+        Arguments:
+            None.
+
+        Returns:
+            'drop', 'error' or None.
+        """
+
+        roll = self._rand.random()
+        if roll < self._drop_rate:
+            self.counts['drops'] += 1
+            return 'drop'
+        if roll < self._drop_rate + self._error_rate:
+            self.counts['errors'] += 1
+            return 'error'
+        return None
+
+    def respond(self, method, path):
+
+        """Work out the answer to a request.
+
+        Arguments:
+            method (string): HTTP method.
+            path (string): Path asked for, including any query.
+
+        Returns:
+            Tuple of status code, content type and body (string).
+        """
+
+        self.counts['requests'] += 1
+        path = urllib.parse.urlsplit(path).path
+        if path == benchmarks.echo_stub.STATUS_PATH:
+            self.counts['status'] += 1
+            self.reported = self.state()
+            return 200, 'text/xml', benchmarks.echo_stub.STATUS_PAGE.format(self.reported)
+        if path == pyliteco.schedule.SCHEDULE_PATH:
+            return 200, 'text/xml', benchmarks.echo_stub.SCHEDULE_PAGE
+        if method == 'POST' and path in (benchmarks.echo_stub.PAUSE_PATH, benchmarks.echo_stub.RECORD_PATH):
+            self.counts['buttons'] += 1
+            state = self.state()
+            if state in ('active', 'paused'):
+                self._held = (self._timeline.state_at(time.monotonic() - self._started),
+                              'paused' if path == benchmarks.echo_stub.PAUSE_PATH else 'active')
+        return 200, 'text/xml', '<ok/>'
+
+
+class Fleet(object):
+
+    """Every virtual box, and a config server pointing at the first, served
+    from one asyncio event loop on a thread of its own.
+
+    Instance attributes:
+        boxes (list): Virtual_Box for each box.
+        config_url (string): URL of the config server, once started.
+        cpu_seconds (float): CPU time used by the event loop, once stopped.
+        host (string): Address served on.
+
+    Methods:
+        churn_config: Change the config served.
+        light_config: Get the light state config served.
+        rooms_config: Get a pyliteco local config with a room for each box.
+        start: Start serving.
+        stats: Get the totals of the box counts.
+        stop: Stop serving.
+    """
+
+    def __init__(self, spec = None, host = '127.0.0.1'):
+
+        """Constructor.
+
+        Arguments:
+            spec (dict): Spec of the fleet, as DEFAULT_SPEC. Missing entries
+                are taken from DEFAULT_SPEC.
+            host (string): Address to serve on.
+
+        Returns:
+            None.
+        """
+
+        self.spec = dict(DEFAULT_SPEC)
+        self.spec.update(spec or {})
+        self.host = host
+        self.boxes = []
+        self.config_url = None
+        self.cpu_seconds = None
+        self._config_version = 0
+        self._loop = None
+        self._thread = None
+        self._servers = []
+        self._started = threading.Event()
+        self._stopped = None
+
+    def light_config(self):
+
+        """Get the light state config served, with the first box as the echo
+        box. Changes each time churn_config is called, so clients reload.
+
+        Arguments:
+            None.
+
+        Returns:
+            Dict of config.
+        """
+
+        config = dict(pyliteco.config.DEFAULT_CONFIG_JSON)
+        config['complete'] = dict(config['complete'], flash_speed = 1 + (self._config_version % 2) / 2.0)
+        config['ip'] = 'http://{}:{}'.format(self.host, self.boxes[0].port)
+        return config
+
+    def churn_config(self):
+
+        """Change the config served, as if someone edited it on the server.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._config_version += 1
+
+    def rooms_config(self, indicator = 'dummy', **settings):
+
+        """Get a pyliteco local config with a room for each box.
+
+        Arguments:
+            indicator (string): Indicator for every room.
+            settings: Anything else to put in the config.
+
+        Returns:
+            Dict of config.
+        """
+
+        config = {'user': 'user', 'pass': 'pass', 'logging': 'WARNING',
+                  'indicator': indicator, 'server': self.config_url, 'schedule_refresh': 0,
+                  'rooms': [{'name': box.name, 'ip': 'http://{}:{}'.format(self.host, box.port),
+                             'indicator_serial': box.name} for box in self.boxes]}
+        config.update(settings)
+        return config
+
+    def start(self):
+
+        """Start serving, returning once every box is listening.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._thread = threading.Thread(target = self._run, name = 'fleet')
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+
+        """Stop serving.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._thread.join()
+
+    def stats(self):
+
+        """Get the totals of the box counts.
+
+        Arguments:
+            None.
+
+        Returns:
+            Dict of requests, status, buttons, errors and drops.
+        """
+
+        totals = collections.Counter()
+        for box in self.boxes:
+            totals.update(box.counts)
+        return {key: totals[key] for key in ('requests', 'status', 'buttons', 'errors', 'drops')}
+
+    def _run(self):
+
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+
+        self._stopped = asyncio.Event()
+        rand = random.Random(self.spec.get('seed'))
+        started = time.monotonic()
+        overrides = self.spec.get('overrides', {})
+        for index in range(int(self.spec['boxes'])):
+            name = 'room{}'.format(index)
+            spec = dict(self.spec)
+            spec.update(overrides.get(name, {}))
+            box = Virtual_Box(name, spec, random.Random(rand.random()), started)
+            server = await asyncio.start_server(
+                        lambda reader, writer, box = box: self._handle(box.respond, box, reader, writer),
+                        self.host, 0)
+            box.port = server.sockets[0].getsockname()[1]
+            self.boxes.append(box)
+            self._servers.append(server)
+        server = await asyncio.start_server(
+                        lambda reader, writer: self._handle(self._respond_config, None, reader, writer),
+                        self.host, 0)
+        self._servers.append(server)
+        self.config_url = 'http://{}:{}{}'.format(self.host, server.sockets[0].getsockname()[1],
+                                                  benchmarks.echo_stub.CONFIG_PATH)
+        churn = float(self.spec.get('config_churn', 0))
+        self._started.set()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), churn or None)
+                except asyncio.TimeoutError:
+                    self.churn_config()
+        finally:
+            for server in self._servers:
+                server.close()
+            handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in handlers:
+                task.cancel()
+            await asyncio.gather(*handlers, return_exceptions = True)
+            # Let the closed connections finish closing
+            await asyncio.sleep(0)
+            self.cpu_seconds = time.thread_time()
+
+    def _respond_config(self, method, path):
+
+        parts = urllib.parse.urlsplit(path)
+        if parts.path != benchmarks.echo_stub.CONFIG_PATH:
+            return 404, 'text/plain', '404'
+        config = self.light_config()
+        if parts.query == 'all':
+            return 200, 'application/json', json.dumps(config)
+        if parts.query == 'config':
+            del config['ip']
+            return 200, 'application/json', json.dumps(config)
+        return 200, 'text/plain', config['ip']
+
+    async def _handle(self, respond, box, reader, writer):
+
+        # Just enough HTTP/1.1 for urllib and the echo360 library, keep-alive included
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                try:
+                    method, path, version = line.decode('latin-1').split(None, 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = header.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                fault = None
+                if box is not None:
+                    fault = box.fault()
+                    await asyncio.sleep(box.delay())
+                if fault == 'drop':
+                    break
+                if fault == 'error':
+                    code, content_type, body = 500, 'text/plain', 'Simulated error'
+                else:
+                    code, content_type, body = respond(method, path)
+                keep_alive = (version.strip() == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                body = body.encode('utf-8')
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+                             'Connection: {}\r\n\r\n'.format(code, HTTP_REASONS.get(code, ''),
+                                                              content_type, len(body),
+                                                              'keep-alive' if keep_alive else 'close')
+                             .encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled when the fleet stops
+            pass
+        finally:
+            writer.close()
+
+
+def raise_file_limit():
+
+    """Raise the limit on open files as far as allowed, as every room needs
+    a listening socket and both ends of a connection.
+
+    Arguments:
+        None.
+
+    Returns:
+        The limit now.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        # Not on Linux
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        target = 65536 if hard == resource.RLIM_INFINITY else hard
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def run(fleet, mode, duration, config_file):
+
+    """Run pyliteco against a fleet for a while, and say how it went.
+
+    Arguments:
+        fleet (Fleet): Started fleet.
+        mode (string): 'rooms' for Supervisor_Thread, 'async' for Async_Supervisor_Thread.
+        duration (float): Seconds to run for.
+        config_file (string): Where to write the local config.
+
+    Returns:
+        Dict of results.
+    """
+
+    import benchmarks.e2e_latency
+    import pyliteco.metrics
+
+    benchmarks.instrumented.register()
+    benchmarks.instrumented.Device.devices.clear()
+    with open(config_file, 'w') as file_:
+        json.dump(fleet.rooms_config(benchmarks.instrumented.DEVICE_NAME), file_)
+    actions = pyliteco.lights.compile_light_actions(fleet.light_config())
+
+    thread = benchmarks.e2e_latency.make_thread(mode, config_file)
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    thread.start()
+    try:
+        time.sleep(duration)
+        # How many indicators are showing what their box last said, and how
+        # many of those the box has moved on from since it was last polled
+        following = 0
+        behind = 0
+        for box in fleet.boxes:
+            device = benchmarks.instrumented.Device.devices.get(box.name)
+            if device is None or not device.changes or box.reported is None:
+                continue
+            shown = (device.changes[-1].colours, device.changes[-1].flash)
+            action = actions.get(box.reported, actions['unknown'])
+            if shown == (action.colours, action.flash):
+                following += 1
+                action = actions.get(box.state(), actions['unknown'])
+                if shown != (action.colours, action.flash):
+                    behind += 1
+        opened = len(benchmarks.instrumented.Device.devices)
+        calls = sum(device.hid_calls() for device in benchmarks.instrumented.Device.devices.values())
+    finally:
+        thread.stop()
+        thread.join(30)
+    wall = time.perf_counter() - wall_before
+    fleet.stop()
+    cpu = time.process_time() - cpu_before - fleet.cpu_seconds
+    rooms = len(fleet.boxes)
+    _, status_total, status_count = pyliteco.metrics.STATUS_LATENCY.snapshot()
+
+    reconnects = collections.Counter()
+    for result in ('ok', 'failed'):
+        reconnects[result] = sum(pyliteco.metrics.RECONNECTS.value(box.name, result) for box in fleet.boxes)
+    return {'benchmark': 'fleet',
+            'version': pyliteco.version.VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'mode': mode,
+            'spec': fleet.spec,
+            'rooms': rooms,
+            'wall_seconds': wall,
+            'indicators_opened': opened,
+            'indicators_following': following,
+            'indicators_behind': behind,
+            'fleet': fleet.stats(),
+            'status_requests_per_room_per_minute': 60.0 * fleet.stats()['status'] / rooms / wall,
+            'reconnects': dict(reconnects),
+            'config_fetches': {outcome: pyliteco.metrics.CONFIG_FETCHES.value(outcome)
+                               for outcome in ('fresh', 'cached', 'default')},
+            'status_latency_mean': status_total / status_count if status_count else None,
+            'hid_calls': calls,
+            'cpu_seconds': cpu,
+            'cpu_percent_per_room': 100.0 * cpu / rooms / wall,
+            'fleet_cpu_seconds': fleet.cpu_seconds}
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'Serve a fleet of simulated echo boxes.')
+    parser.add_argument('--spec', default = None, help = 'JSON file describing the fleet (see DEFAULT_SPEC)')
+    parser.add_argument('--boxes', type = int, default = None, help = 'Number of boxes, overriding the spec')
+    parser.add_argument('--write-config', dest = 'write_config', default = 'fleet.json',
+                        help = 'Where to write a pyliteco config with a room for each box')
+    parser.add_argument('--run', choices = ('rooms', 'async'), default = None,
+                        help = 'Run pyliteco against the fleet in this process')
+    parser.add_argument('--duration', type = float, default = 300, help = 'Seconds to --run for')
+    parser.add_argument('-o', dest = 'output', default = 'fleet-results.json', help = 'File to save --run results to')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level = logging.WARNING)
+    spec = {}
+    if args.spec is not None:
+        with open(args.spec) as file_:
+            spec = json.load(file_)
+    if args.boxes is not None:
+        spec['boxes'] = args.boxes
+    limit = raise_file_limit()
+    fleet = Fleet(spec)
+    if limit is not None and limit < 3 * int(fleet.spec['boxes']) + 64:
+        logger.warning('Only %d open files allowed, which may not be enough for %s boxes.',
+                       limit, fleet.spec['boxes'])
+    fleet.start()
+
+    if args.run is not None:
+        results = run(fleet, args.run, args.duration, args.write_config)
+        with open(args.output, 'w') as file_:
+            json.dump(results, file_, indent = 4)
+        print('{} rooms for {:.0f}s: {} of {} indicators following their box, {} of them '
+              'not yet polled since its last change'.format(
+                    results['rooms'], results['wall_seconds'], results['indicators_following'],
+                    results['indicators_opened'], results['indicators_behind']))
+        print('{:.1f} status requests per room per minute, {} errors and {} drops injected'.format(
+                    results['status_requests_per_room_per_minute'], results['fleet']['errors'],
+                    results['fleet']['drops']))
+        print('CPU {:.2f}s ({:.3f}% per room)'.format(results['cpu_seconds'], results['cpu_percent_per_room']))
+        print('Saved to {}'.format(args.output))
+        return
+
+    with open(args.write_config, 'w') as file_:
+        json.dump(fleet.rooms_config(), file_, indent = 4)
+    print('Serving {} boxes, config server at {}'.format(len(fleet.boxes), fleet.config_url))
+    print('Run pyliteco with: python3 __main__.py -m -c {}'.format(args.write_config))
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(fleet.stats()))
+    except KeyboardInterrupt:
+        fleet.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Dummy indicator that records what it is asked to do and when, for benchmarks.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import collections
+import threading
+import time
+
+import indicators
+import indicators.dummy
+
+
+DEVICE_NAME = 'instrumented'
+"""Name to give as "indicator" in the config to use Device."""
+
+
+Change = collections.namedtuple('Change', ['time', 'colours', 'flash'])
+"""Change of what the indicator shows: time.perf_counter() value, tuple
+of colours and whether flashing."""
+
+
+class Device(indicators.dummy.Device):
+
+    """Dummy indicator counting the calls that would go to the hardware,
+    and noting the time of each change of what it shows.
+
+    Class attributes:
+        devices (dict): Every Device made, by serial.
+
+    Instance attributes:
+        calls (Counter): Calls that would go to the hardware, by method name.
+        changes (list): Change for each change of what is shown.
+
+    Methods:
+        hid_calls: Get the number of calls that would go to the hardware.
+        wait_for_change: Wait until the indicator shows something.
+    """
+
+    devices = {}
+
+    def __init__(self, serial = None):
+
+        """Constructor.
+
+        Arguments:
+            serial (string): Name to keep the device under in devices.
+
+        Returns:
+            None.
+        """
+
+        indicators.dummy.Device.__init__(self, serial)
+        self.calls = collections.Counter()
+        self.changes = []
+        self._changed = threading.Condition()
+        Device.devices[serial] = self
+
+    def _report(self, msg):
+
+        # Logging every call would be most of what gets measured
+        pass
+
+    def flashing_start(self, colours = None, flash_speed = None):
+
+        self.calls['flashing_start'] += 1
+
+    def flashing_stop(self):
+
+        self.calls['flashing_stop'] += 1
+
+    def set_brightness(self, brightness):
+
+        self.calls['set_brightness'] += 1
+
+    def set_light(self, colour):
+
+        self.calls['set_light'] += 1
+
+    def show(self, colours, flash = False, flash_speed = None):
+
+        changed = indicators.dummy.Device.show(self, colours, flash, flash_speed)
+        if changed:
+            if isinstance(colours, str):
+                colours = (colours,)
+            with self._changed:
+                self.changes.append(Change(time.perf_counter(), tuple(colours), bool(flash)))
+                self._changed.notify_all()
+        return changed
+
+    def hid_calls(self):
+
+        """Get the number of calls that would go to the hardware so far.
+
+        Arguments:
+            None.
+
+        Returns:
+            int.
+        """
+
+        return sum(self.calls.values())
+
+    def wait_for_change(self, colours, flash, since, timeout):
+
+        """Wait until the indicator shows something, having changed to it
+        after a given time.
+
+        Arguments:
+            colours (tuple): Colours to wait for.
+            flash (bool): Whether they should be flashing.
+            since (float): time.perf_counter() value the change should be after.
+            timeout (float): Most seconds to wait.
+
+        Returns:
+            Change, or None if it didn't happen in time.
+        """
+
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                for change in reversed(self.changes):
+                    if change.time < since:
+                        break
+                    if change.colours == tuple(colours) and change.flash == flash:
+                        return change
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+
+def register():
+
+    """Make Device available as "indicator": "instrumented" in the config.
+
+    Arguments:
+        None.
+
+    Returns:
+        None.
+    """
+
+    indicators.register_device(DEVICE_NAME, Device)
@@ -26,19 +26,41 @@ class NoDeviceError(Exception):
         
         Exception.__init__(self, 'Device can not be found - check it is plugged in.')
 
+_registered = {}
+"""Device classes added with register_device, by name."""
+
+
+def register_device(device, device_class):
+    
+    """Make another device class available through get_device, e.g. an
+    instrumented dummy for benchmarks.
+    
+    Arguments:
+        device (string): Case-sensitive name for the device, as used in the config.
+        device_class: Subclass of indicators.indicator.Indicator.
+        
+    Returns:
+        None.
+    """
+    
+    _registered[device] = device_class
+
 def get_device(device):
     
     """Find the relevant device (as given by device) and return
     the class.
     
     Arguments:
-        device (string): Case-sensitive string for the device - Currently 'dummy' or 'delcom'.
+        device (string): Case-sensitive string for the device - Currently 'dummy',
+            'delcom' or one added with register_device.
         
     Return:
         Device class as required
     """
     
-    if device == 'dummy':
+    if device in _registered:
+        return _registered[device]
+    elif device == 'dummy':
         import indicators.dummy
         class USBError(Exception):
             pass
@@ -19,16 +19,254 @@ Copyright (C) 2015 Robert Walker
 """
 
 # Imports
+import collections
 import indicators
 import indicators.indicator
 import logging
 import pywinusb
 import pywinusb.hid as hid
+import queue
+import threading
+import time
+import weakref
 
 
 logger = logging.getLogger(__name__)
 
 
+class Packet_Queue(object):
+    
+    """Write-behind queue of packets for a device, sent from its own thread
+    so whoever asks for a change never waits on USB.
+    
+    Packets setting the same thing (e.g. the port 1 outputs, or the flash
+    mode of one pin) share a key. A queued packet is replaced by a later
+    one with the same key, and a packet matching what was last sent for
+    its key is dropped, as it wouldn't change anything.
+    
+    Instance attributes:
+        error: Exception raised by the last failed send, None if it worked.
+        issued (int): Number of packets put on the queue.
+        sent (int): Number of packets actually sent to the device.
+        
+    Methods:
+        close: Stop the writer thread once the queue is empty.
+        flush: Wait for the queue to empty.
+        forget: Forget what state the device is in.
+        put: Queue a packet.
+    """
+    
+    def __init__(self, send):
+        
+        """Constructor. Starts the writer thread.
+        
+        Arguments:
+            send: Bound method sending a packet to the device. Only held
+                weakly, so the queue doesn't keep the device alive.
+                
+        Returns:
+            None.
+        """
+        
+        self._send = weakref.WeakMethod(send)
+        self._condition = threading.Condition()
+        self._pending = collections.OrderedDict()
+        self._sent = {}
+        self._busy = False
+        self._closed = False
+        self.error = None
+        self.issued = 0
+        self.sent = 0
+        
+        thread = threading.Thread(target = self._run)
+        thread.daemon = True
+        thread.start()
+    
+    def close(self):
+        
+        """Stop the writer thread once everything queued has been sent.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+    
+    def flush(self, timeout = None):
+        
+        """Wait until everything queued has been sent.
+        
+        Arguments:
+            timeout (float): Most seconds to wait, None to wait for as long as it takes.
+            
+        Returns:
+            True if the queue is empty, False if it timed out.
+        """
+        
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+    
+    def forget(self):
+        
+        """Forget what has been sent, so nothing gets dropped as unchanged.
+        Needed whenever the device might not be in the state we think.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        with self._condition:
+            self._sent.clear()
+    
+    def put(self, key, data):
+        
+        """Queue a packet, replacing any queued packet with the same key.
+        
+        Arguments:
+            key: What the packet sets, or None if it must always be sent.
+            data (list): Packet, in the form returned by Device._make_packet.
+            
+        Returns:
+            None.
+        """
+        
+        with self._condition:
+            self.issued += 1
+            if key is None:
+                # Unique key, so never replaced or dropped
+                key = object()
+            self._pending.pop(key, None)
+            if self._sent.get(key) != data:
+                self._pending[key] = data
+                self._condition.notify_all()
+    
+    def _run(self):
+        
+        """Send packets until closed."""
+        
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                key, data = self._pending.popitem(last = False)
+                self._busy = True
+            send = self._send()
+            try:
+                if send is None:
+                    # Device has gone
+                    return
+                send(data)
+                with self._condition:
+                    self._sent[key] = data
+                    self.sent += 1
+            except Exception as err:
+                self.error = err
+                self.forget()
+            finally:
+                del send
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+class Button_Reader(threading.Thread):
+    
+    """Reads the button from its own thread, so presses are picked up
+    within BUTTON_INTERVAL without the main loop having to ask.
+    
+    The button is only seen through the event counter feature report, so
+    this polls it all the time (20 times a second by default), taking the
+    device lock for each read.
+    
+    Instance attributes:
+        error: NoDeviceError if the device was found unplugged, else None.
+        events (queue.Queue): time.monotonic() of each button press.
+        interval (float): Seconds between reads.
+        pressed (threading.Event): Set when there are presses on the queue.
+        beat: Function called after each read, or None.
+        
+    Methods:
+        run: Read the button until stopped.
+        stop: Signal to stop the thread.
+    """
+    
+    def __init__(self, read, interval):
+        
+        """Constructor.
+        
+        Arguments:
+            read: Bound method reading the button once, returning True if
+                pressed. Only held weakly, so the reader doesn't keep the
+                device alive.
+            interval (float): Seconds between reads.
+            
+        Returns:
+            None.
+        """
+        
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._read = weakref.WeakMethod(read)
+        self.interval = interval
+        self.events = queue.Queue()
+        self.pressed = threading.Event()
+        self.error = None
+        self.beat = None
+        self.running = False
+    
+    def start(self):
+        
+        self.running = True
+        threading.Thread.start(self)
+    
+    def stop(self):
+        
+        """Set attribute so thread stops running.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        self.running = False
+    
+    def run(self):
+        
+        while self.running:
+            read = self._read()
+            if read is None:
+                # Device has gone
+                return
+            try:
+                if read():
+                    self.events.put(time.monotonic())
+                    self.pressed.set()
+            except hid.HIDError as e:
+                # There might be a useful case to see these
+                logger.warning(e)
+            except indicators.NoDeviceError as e:
+                self.error = e
+                self.pressed.set()
+                return
+            finally:
+                del read
+            beat = self.beat
+            if beat is not None:
+                beat()
+            time.sleep(self.interval)
+
+
 class Device(indicators.indicator.Indicator):
     
     """Delcom Products generation 2 USB device class.
@@ -36,20 +274,36 @@ class Device(indicators.indicator.Indicator):
     Class attributes:
         _colour_pins (dict): Mapping of colours to pins on device.
         allowed_colours (dict): The colours allowed by this device.
+        flash_colours (tuple): The colours this device can flash, one at a time.
+        BUTTON_INTERVAL: Seconds between reads of the button.
         PRODUCT_ID: Specific indicator id.
         VENDOR_ID: Delcom vendor id.
     
     Instance attributes:
+        _button_reader: Button_Reader picking up button presses.
         _current_colour: Which colour is currently on.
         _flashing_pin: Which pin is currently set to flashing.
+        _hid_lock: Held for every use of the device and of _reports, as
+            the packet writer and the button reader use them from their
+            own threads.
+        _queue: Packet_Queue the packets go out through.
+        _reports: Feature reports of the device by report ID, None until looked up.
+        _write_observer: Function given the seconds each packet took to send, or None.
         device: Pywinusb device for the indicator.
+        serial: Serial number of the device asked for, or None.
         
     Methods:
         flashing_start: Start the indicator flashing.
         flashing_stop: Stop the indicator flashing.
+        flush: Wait for queued packets to be sent.
+        packet_counts: Get the number of packets issued and sent.
         read_switch: See if the button has been pressed.
+        wait_for_button: Wait for the button to be pressed.
+        wake: Cut short a wait for the button.
         set_brightness: Change the brightness of the LED's
+        set_heartbeat: Give a function to call after each button read.
         set_light: Turn on/off the specified colour.
+        set_write_observer: Give a function to call with how long each packet took to send.
         set_light_green: Turn on the green LED's.
         set_light_off: Turn off the LED's.
         set_light_red: Turn on the red LED's.
@@ -61,6 +315,8 @@ class Device(indicators.indicator.Indicator):
     """Delcom Vendor ID."""
     PRODUCT_ID      = 0xB080
     """Delcom Product ID."""
+    BUTTON_INTERVAL = 0.05
+    """Seconds between reads of the button."""
     allowed_colours = {'green': [0x01, 0xFF], 
                                 'yellow': [0x04, 0xFF], 
                                 'red': [0x02, 0xFF],
@@ -71,14 +327,17 @@ class Device(indicators.indicator.Indicator):
                     'yellow'    : 4,
                     'red'       : 2
                     }
+    flash_colours = tuple(_colour_pins)
+    """Colours with a pin of their own, so can be flashed."""
     
 
-    def __init__(self):
+    def __init__(self, serial = None):
         
         """Constructor.
         
         Arguments:
-            None.
+            serial (string): Serial number of the indicator to open. None
+                opens the first one found.
             
         Returns:
             None.
@@ -90,14 +349,23 @@ class Device(indicators.indicator.Indicator):
         # Set some default attributes
         self._flashing_pin = None
         self._current_colour = 'off'
+        self._reports = None
+        self._write_observer = None
+        self._hid_lock = threading.RLock()
+        self.serial = serial
         
         filter = hid.HidDeviceFilter(vendor_id = self.VENDOR_ID, product_id = self.PRODUCT_ID)
+        devices = filter.get_devices()
+        if serial is not None:
+            devices = [device for device in devices if device.serial_number == serial]
         try:
-            self.device = filter.get_devices()[0]
+            self.device = devices[0]
         except IndexError:
             raise indicators.NoDeviceError
         
         self.device.open()
+        self._find_reports()
+        self._queue = Packet_Queue(self._send_data)
         
         self._force_off()
         
@@ -105,6 +373,49 @@ class Device(indicators.indicator.Indicator):
         self._write_data(self._make_packet(101, 38, 0x01))
         
         self.set_brightness(50)
+        
+        self._button_reader = Button_Reader(self._read_switch, self.BUTTON_INTERVAL)
+        self._button_reader.start()
+    
+    def _find_reports(self):
+        
+        """Look up the feature report for each report ID, so sending and
+        reading don't have to search the device's reports each packet.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        with self._hid_lock:
+            self._reports = dict((report.report_id, report) 
+                                 for report in self.device.find_feature_reports())
+    
+    def _get_report(self, report_id):
+        
+        """Get the feature report for a report ID, looking the reports up
+        again if they have been lost (e.g. by the device being unplugged).
+        
+        Arguments:
+            report_id (int): Report ID, as the first byte of the packet.
+            
+        Returns:
+            Feature report, or None if the device doesn't have one.
+            
+        Raises:
+            NoDeviceError: Device not plugged in.
+        """
+        
+        with self._hid_lock:
+            if not self.device.is_plugged():
+                # Handles won't be any good after a replug
+                self._reports = None
+                raise indicators.NoDeviceError()
+            if self._reports is None:
+                self._find_reports()
+            return self._reports.get(report_id)
     
     def _force_off(self):
         
@@ -224,9 +535,52 @@ class Device(indicators.indicator.Indicator):
         self._write_data(self._make_packet(101, 34, 1, pwr))
         self._write_data(self._make_packet(101, 34, 2, pwr))
         
+    def _packet_key(self, data):
+        
+        """Work out what a packet sets on the device, so a later packet
+        setting the same thing can replace it.
+        
+        Arguments:
+            data (list): Packet, in the form returned by _make_packet.
+            
+        Returns:
+            Key for the packet, or None if it must always be sent.
+        """
+        
+        if data[1] == 12 or 21 <= data[1] <= 28:
+            # Port 1 outputs, or the duty cycle of one pin
+            return (data[0], data[1])
+        elif data[1] == 20:
+            # Flash mode for the pins given
+            return (data[0], data[1], data[2] | data[3])
+        elif data[1] == 34:
+            # Power of one pin
+            return (data[0], data[1], data[2])
+        return None
+    
     def _write_data(self, data):
         
-        """Send data to the device.
+        """Queue data to go to the device.
+        
+        Arguments:
+            data (list): list of bytes to send, in the form returned by _make_packet.
+            
+        Returns:
+            None.
+            
+        Raises:
+            NoDeviceError: Sending an earlier packet found the device unplugged.
+        """
+        
+        with self._span('Device._write_data'):
+            error, self._queue.error = self._queue.error, None
+            if error is not None:
+                raise error
+            self._queue.put(self._packet_key(data), data)
+    
+    def _send_data(self, data):
+        
+        """Send data to the device, from the writer thread.
         
         Arguments:
             data (list): list of bytes to send, in the form returned by _make_packet.
@@ -235,34 +589,145 @@ class Device(indicators.indicator.Indicator):
             None.
         """
 
-        if not self.device.is_plugged():
-            raise indicators.NoDeviceError()
-        for report in self.device.find_feature_reports():
-            if report.report_id == data[0]:
+        with self._span('Device._send_data'):
+            with self._hid_lock:
+                report = self._get_report(data[0])
+                if report is None:
+                    return
+                start = time.perf_counter()
                 report[4278190083] = data[1:]
                 report.send()
+                seconds = time.perf_counter() - start
+            observe = self._write_observer
+            if observe is not None:
+                observe(seconds)
 
+    def flush(self, timeout = None):
+        
+        """Wait for queued packets to be sent.
+        
+        Arguments:
+            timeout (float): Most seconds to wait, None to wait for as long as it takes.
+            
+        Returns:
+            True if everything was sent, False if it timed out.
+        """
+        
+        return self._queue.flush(timeout)
+    
+    def packet_counts(self):
+        
+        """Get the number of packets issued, and the number actually sent
+        once superseded and no-change packets were dropped.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            Tuple of packets issued and packets sent.
+        """
+        
+        return self._queue.issued, self._queue.sent
+    
     def read_switch(self):
     
-        """See if the button has been pressed.
+        """See if the button has been pressed since last time. Doesn't
+        touch the device, the presses are picked up by the button reader.
         
         Arguments:
             None.
         
         Returns: 
             True if pressed, False otherwise.
+            
+        Raises:
+            NoDeviceError: Device has been unplugged.
         """
         
-        data = None
-        while not data:
-            if not self.device.is_plugged():
-                raise indicators.NoDeviceError()
+        if self._button_reader.error is not None:
+            raise self._button_reader.error
+        self._button_reader.pressed.clear()
+        pressed = False
+        while True:
             try:
-                data = self._read_data(8)
-            except hid.HIDError as e:
-                # There might be a useful case to see these
-                logger.warning(e)
-        if data[8:11] == [0, 0, 0]:
+                self._button_reader.events.get_nowait()
+                pressed = True
+            except queue.Empty:
+                return pressed
+    
+    def wait_for_button(self, timeout):
+        
+        """Wait for the button to be pressed.
+        
+        Arguments:
+            timeout (float): Most seconds to wait.
+            
+        Returns:
+            True if pressed or woken, False if it timed out.
+        """
+        
+        return self._button_reader.pressed.wait(timeout)
+    
+    def set_heartbeat(self, beat):
+        
+        """Give a function to call after each read of the button, so a
+        watchdog can tell if reading the device hangs.
+        
+        Arguments:
+            beat: Function taking no arguments, None to stop calling it.
+            
+        Returns:
+            True.
+        """
+        
+        self._button_reader.beat = beat
+        return True
+    
+    def set_write_observer(self, observe):
+        
+        """Give a function to call with the seconds each packet took to send.
+        
+        Arguments:
+            observe: Function taking the seconds as a float, None to stop calling it.
+            
+        Returns:
+            True.
+        """
+        
+        self._write_observer = observe
+        return True
+    
+    def wake(self):
+        
+        """Cut short a wait for the button. read_switch still only reports
+        real presses, as nothing is put on the event queue.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        self._button_reader.pressed.set()
+    
+    def _read_switch(self):
+        
+        """Read the event counter from the device, from the button reader.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            True if pressed since the last read, False otherwise.
+            
+        Raises:
+            NoDeviceError: Device not plugged in.
+            HIDError: Problem reading the device.
+        """
+        
+        data = self._read_data(8)
+        if not data or data[8:11] == [0, 0, 0]:
             # Bad data, disregard
             return False
         counter = data[0]
@@ -283,10 +748,11 @@ class Device(indicators.indicator.Indicator):
             Data, as list of bytes.
         """
 
-        reports = self.device.find_feature_reports()
-        for report in reports:
-            if report.report_id == cmd:
-                return report.get()
+        with self._span('Device._read_data'):
+            with self._hid_lock:
+                report = self._get_report(cmd)
+                if report is not None:
+                    return report.get()
 
 
     def _get_current_colour(self):
@@ -381,7 +847,12 @@ class Device(indicators.indicator.Indicator):
             if self.device.is_open():
                 self.flashing_stop()
                 self.set_light_off()
-                self.device.close()
+                self.flush(5)
+            self._queue.close()
+            self._button_reader.stop()
+            with self._hid_lock:
+                if self.device.is_open():
+                    self.device.close()
         except AttributeError:
             # Device wasn't created succesfully
             pass
@@ -18,22 +18,69 @@ Copyright (C) 2015 Robert Walker
     51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 """
 
+import collections
+import contextlib
+import threading
+
+
+Display = collections.namedtuple('Display', ['colours', 'flash', 'flash_speed', 'brightness'])
+"""What an indicator is showing. None for anything not known."""
+UNKNOWN_DISPLAY = Display(None, None, None, None)
+"""Display of an indicator nothing has been shown on yet."""
+_NO_SPAN = contextlib.nullcontext()
+
+
 class Indicator(object):
     
     """Indicator class displaying the methods that are expected by
     the pyliteco service. Subclass this class and overload all the
     methods with the required code.
     
+    Class attributes:
+        allowed_colours: Colours the indicator can show, None if it takes any.
+        flash_colours: Single colours the indicator can flash, None if it
+            can flash any colour, or a list of colours, that it can show.
+    
     Attributes:
-        None
+        display (Display): What the indicator is showing, as far as show and
+            show_brightness know. Calls straight to set_light etc. aren't
+            tracked, so call forget_display after them.
+        serial (string): Serial number of the physical device to use, or None for the first found.
     
     Methods:
         flashing_start: Start the indicator flashing.
         flashing_stop: Stop the indicator flashing.
+        forget_display: Stop trusting the record of what is showing.
         read_switch: Check if something's been pressed.
+        set_brightness: Change the brightness.
+        set_heartbeat: Give a function to call while background I/O is alive.
         set_light: Turn the indicator on to a static colour. 
+        set_tracer: Give a function to time device I/O with.
+        set_write_observer: Give a function to call with how long each write took.
+        show: Show a colour or flash, unless it is already showing.
+        show_brightness: Change the brightness, unless it is already set.
+        wait_for_button: Wait for something to be pressed.
+        wake: Cut short a wait_for_button.
     """
     
+    allowed_colours = None
+    flash_colours = None
+    display = UNKNOWN_DISPLAY
+    
+    def __init__(self, serial = None):
+        
+        """Constructor.
+        
+        Arguments:
+            serial (string): Serial number of the device to use, for when
+                more than one is plugged in. None uses the first found.
+                
+        Returns:
+            None.
+        """
+        
+        self.serial = serial
+    
     def flashing_start(self, flash_speed = None, colours = None):
         
         """Whatever code to make the indicator flash one or more colours.
@@ -61,6 +108,20 @@ class Indicator(object):
         
         pass
     
+    def forget_display(self):
+        
+        """Stop trusting the record of what is showing, so the next show
+        and show_brightness go to the device.
+        
+        Arguments:
+            None.
+            
+        Return:
+            None.
+        """
+        
+        self.display = UNKNOWN_DISPLAY
+    
     def read_switch(self):
         
         """Return whether the switch/button/whatever has been pressed since
@@ -75,6 +136,69 @@ class Indicator(object):
         
         return False
     
+    def wait_for_button(self, timeout):
+        
+        """Wait until the switch/button/whatever is pressed, wake is called,
+        or until the timeout. Indicators that can't tell straight away just wait.
+        
+        Arguments:
+            timeout (float): Most seconds to wait.
+            
+        Return:
+            True if pressed or woken, False if it timed out.
+        """
+        
+        event = self._wake_event()
+        woken = event.wait(timeout)
+        event.clear()
+        return woken
+    
+    def wake(self):
+        
+        """Cut short a wait_for_button, e.g. when stopping.
+        
+        Arguments:
+            None.
+            
+        Return:
+            None.
+        """
+        
+        self._wake_event().set()
+    
+    def _wake_event(self):
+        
+        # Made on first use, as subclasses don't all call the constructor
+        return self.__dict__.setdefault('_wake', threading.Event())
+    
+    def set_brightness(self, brightness):
+        
+        """Whatever code to change the brightness of the indicator.
+        
+        Arguments:
+            brightness (int): Brightness between 0 and 100.
+        
+        Return:
+            None.
+        """
+        
+        pass
+    
+    def set_heartbeat(self, beat):
+        
+        """Give the indicator a function to call each time its background
+        I/O (e.g. a thread reading the button) goes round, so a watchdog
+        can tell if it hangs. Indicators without any don't call it.
+        
+        Arguments:
+            beat: Function taking no arguments.
+        
+        Return:
+            True if the indicator will call beat, else False.
+        """
+        
+        return False
+    
     def set_light(self, colour):
         
         """Whatever code to make the indicator turn on to a certain colour.
@@ -88,4 +212,84 @@ class Indicator(object):
             None.
         """
         
-        pass
\ No newline at end of file
+        pass
+    
+    def set_tracer(self, span):
+        
+        """Give the indicator a function to time its device I/O with.
+        
+        Arguments:
+            span: Function taking a name and giving a context manager,
+                as pyliteco.trace.span.
+        
+        Return:
+            None.
+        """
+        
+        self._span = span
+    
+    def _span(self, name):
+        
+        # Replaced by set_tracer
+        return _NO_SPAN
+    
+    def set_write_observer(self, observe):
+        
+        """Give the indicator a function to call with the seconds each
+        write to the device took, for the metrics. Indicators that don't
+        write to anything don't call it.
+        
+        Arguments:
+            observe: Function taking the seconds as a float.
+        
+        Return:
+            True if the indicator will call observe, else False.
+        """
+        
+        return False
+    
+    def show(self, colours, flash = False, flash_speed = None):
+        
+        """Show a static colour, or flash, unless the indicator is already
+        showing exactly that. Stops any flashing first.
+        
+        Arguments:
+            colours: Colour to show, or colours to flash between.
+            flash (bool): Whether to flash.
+            flash_speed (float): Seconds to stay in each state when flashing.
+        
+        Return:
+            True if the indicator was changed, False if it was already showing that.
+        """
+        
+        if not flash:
+            flash_speed = None
+        if self.display[:3] == (colours, flash, flash_speed):
+            return False
+        # Don't trust the record if the device fails part way through
+        self.display = self.display._replace(colours = None, flash = None, flash_speed = None)
+        self.flashing_stop()
+        if flash:
+            self.flashing_start(colours = colours, flash_speed = flash_speed)
+        else:
+            self.set_light(colours)
+        self.display = self.display._replace(colours = colours, flash = flash, flash_speed = flash_speed)
+        return True
+    
+    def show_brightness(self, brightness):
+        
+        """Change the brightness, unless it is already set to that.
+        
+        Arguments:
+            brightness (int): Brightness between 0 and 100.
+        
+        Return:
+            True if the brightness was changed, False if it was already set.
+        """
+        
+        if self.display.brightness == brightness:
+            return False
+        self.display = self.display._replace(brightness = None)
+        self.set_brightness(brightness)
+        self.display = self.display._replace(brightness = brightness)
+        return True
\ No newline at end of file
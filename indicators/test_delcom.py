@@ -0,0 +1,159 @@
+"""Tests for indicators.delcom's write-behind packet queue. pywinusb is only
+on Windows, and the queue doesn't touch it, so a stand-in is used to import
+the module where it isn't installed.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+import unittest
+import unittest.mock
+
+
+def _import_delcom():
+
+    if importlib.util.find_spec('pywinusb') is not None:
+        return importlib.import_module('indicators.delcom')
+    hid = unittest.mock.MagicMock()
+    pywinusb = unittest.mock.MagicMock(hid = hid)
+    # sys.modules is put back afterwards, so nothing else gets the stand-in
+    with unittest.mock.patch.dict(sys.modules, {'pywinusb': pywinusb, 'pywinusb.hid': hid}):
+        return importlib.import_module('indicators.delcom')
+
+
+delcom = _import_delcom()
+
+
+class Fake_Device(object):
+
+    """Records the packets sent, optionally holding each send until released."""
+
+    def __init__(self, hold = False):
+
+        self.sent = []
+        self.fail = False
+        self.release = threading.Event()
+        self.sending = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def send(self, data):
+
+        self.sending.set()
+        self.release.wait(5)
+        if self.fail:
+            raise IOError('USB unplugged')
+        self.sent.append(data)
+
+
+class Packet_Queue_Test(unittest.TestCase):
+
+    def _queue(self, device):
+
+        packets = delcom.Packet_Queue(device.send)
+        self.addCleanup(packets.close)
+        return packets
+
+    def test_sends_in_order(self):
+
+        device = Fake_Device()
+        packets = self._queue(device)
+        packets.put('a', [1])
+        packets.put('b', [2])
+        self.assertTrue(packets.flush(5))
+        self.assertEqual(device.sent, [[1], [2]])
+        self.assertEqual((packets.issued, packets.sent), (2, 2))
+
+    def test_queued_packet_replaced(self):
+
+        device = Fake_Device(hold = True)
+        packets = self._queue(device)
+        packets.put('a', [0])
+        self.assertTrue(device.sending.wait(5))
+        # Held up sending [0], so these wait in the queue
+        packets.put('a', [1])
+        packets.put('b', [2])
+        packets.put('a', [3])
+        device.release.set()
+        self.assertTrue(packets.flush(5))
+        self.assertEqual(device.sent, [[0], [2], [3]])
+        self.assertEqual(packets.issued, 4)
+
+    def test_unchanged_packet_dropped(self):
+
+        device = Fake_Device()
+        packets = self._queue(device)
+        packets.put('a', [1])
+        packets.flush(5)
+        packets.put('a', [1])
+        packets.put(None, [9])
+        packets.put(None, [9])
+        self.assertTrue(packets.flush(5))
+        self.assertEqual(device.sent, [[1], [9], [9]])
+
+    def test_forget(self):
+
+        device = Fake_Device()
+        packets = self._queue(device)
+        packets.put('a', [1])
+        packets.flush(5)
+        packets.forget()
+        packets.put('a', [1])
+        self.assertTrue(packets.flush(5))
+        self.assertEqual(device.sent, [[1], [1]])
+
+    def test_failed_send(self):
+
+        device = Fake_Device()
+        device.fail = True
+        packets = self._queue(device)
+        packets.put('a', [1])
+        self.assertTrue(packets.flush(5))
+        self.assertIsInstance(packets.error, IOError)
+        self.assertEqual(packets.sent, 0)
+        # Not counted as sent, so tried again
+        device.fail = False
+        packets.put('a', [1])
+        self.assertTrue(packets.flush(5))
+        self.assertEqual(device.sent, [[1]])
+
+    def test_flush_times_out(self):
+
+        device = Fake_Device(hold = True)
+        packets = self._queue(device)
+        packets.put('a', [1])
+        self.assertFalse(packets.flush(0.01))
+        device.release.set()
+        self.assertTrue(packets.flush(5))
+
+    def test_device_gone(self):
+
+        device = Fake_Device()
+        packets = delcom.Packet_Queue(device.send)
+        del device
+        packets.put('a', [1])
+        # Writer thread stops rather than keeping the device alive
+        self.assertTrue(packets.flush(5))
+        self.assertEqual(packets.sent, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Work out how often to poll an echo box from the state it is in.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import logging
+import math
+import numbers
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_POLL_INTERVALS = {
+    'inactive': [1, 10],
+    'waiting': [0.5, 1],
+    'active': [1, 5],
+    'paused': [1, 5],
+    'complete': [1, 10],
+    'unknown': [1, 5]
+}
+"""Shortest and longest seconds between polls for each state. Can be
+overridden with "poll_intervals" in the config."""
+GROWTH = 1.5
+"""How much longer each poll interval is than the last while nothing changes."""
+
+
+class Poll_Scheduler(object):
+
+    """Decides how long to wait before the next poll. Just after a change
+    of state it polls at the shortest interval for the new state, then
+    backs off towards the longest while the state stays the same.
+
+    Instance attributes:
+        intervals (dict): Shortest and longest interval for each state.
+
+    Methods:
+        next_interval: Get the seconds to wait before polling again.
+        reset: Forget the current state, so the next poll is soon.
+        set_intervals: Change the intervals for some states.
+    """
+
+    def __init__(self, intervals = None):
+
+        """Constructor.
+
+        Arguments:
+            intervals (dict): Intervals to use instead of the defaults, as
+                state: [shortest, longest].
+
+        Returns:
+            None.
+        """
+
+        self.set_intervals(intervals)
+        self.reset()
+
+    def next_interval(self, state, schedule = None):
+
+        """Get the seconds to wait before polling again.
+
+        Arguments:
+            state (string): State the echo box is in now.
+            schedule (Schedule_Index): Scheduled captures, to poll quickly
+                around their starts and ends.
+
+        Returns:
+            Seconds to wait (float).
+        """
+
+        try:
+            shortest, longest = self.intervals[state]
+        except KeyError:
+            shortest, longest = self.intervals['unknown']
+        if state != self._state:
+            self._state = state
+            self._interval = shortest
+        else:
+            self._interval = min(max(self._interval * GROWTH, shortest), longest)
+        if schedule is not None:
+            return schedule.clamp_interval(self._interval, self.intervals['waiting'][0])
+        return self._interval
+
+    def reset(self):
+
+        """Forget the current state, so the next poll is at the shortest interval.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._state = None
+        self._interval = 0
+
+    def set_intervals(self, intervals = None):
+
+        """Change the intervals for some states, keeping the defaults for the
+        rest. Bad entries are logged and the default kept for that state.
+
+        Arguments:
+            intervals (dict): Intervals as state: [shortest, longest].
+
+        Returns:
+            None.
+        """
+
+        self.intervals = dict(DEFAULT_POLL_INTERVALS)
+        if intervals is None:
+            return
+        if not isinstance(intervals, dict):
+            logger.error('Bad poll_intervals %r, using the defaults.', intervals)
+            return
+        for state, interval in intervals.items():
+            if (not isinstance(interval, (list, tuple)) or len(interval) != 2
+                    or not all(isinstance(seconds, numbers.Real) and not isinstance(seconds, bool)
+                               and math.isfinite(seconds) and seconds > 0 for seconds in interval)):
+                logger.error('Bad poll interval %r for %s, using the default.', interval, state)
+                continue
+            shortest, longest = interval
+            if shortest > longest:
+                logger.warning('Poll interval for %s is backwards, swapping.', state)
+                shortest, longest = longest, shortest
+            self.intervals[state] = [float(shortest), float(longest)]
@@ -0,0 +1,408 @@
+"""Poll echo boxes from an asyncio event loop.
+
+Each room gets its own coroutine, sleeping until it is next due, and the
+echo360 library's requests go to a pool of worker threads, so a slow box
+only holds up its own room. The threaded
+pyliteco.pyliteco.Main_Thread is still there as the fallback.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+# Built-in modules
+import asyncio
+import concurrent.futures
+import logging
+import time
+
+# Local modules
+import indicators
+import pyliteco.clock
+import pyliteco.config
+import pyliteco.metrics
+import pyliteco.pyliteco
+import pyliteco.recorder
+import pyliteco.rooms
+import pyliteco.status
+import pyliteco.watchdog
+
+logger = logging.getLogger(__name__)
+
+
+class Async_Echo_Device(object):
+
+    """Echo box talked to through the echo360 library, each request run on
+    a worker thread so it doesn't block the event loop. Has the same
+    methods as echo360.capture_device.Echo360CaptureDevice that pyliteco
+    uses, but as coroutines.
+
+    Instance attributes:
+        device: echo360.capture_device.Echo360CaptureDevice making the requests.
+        executor: concurrent.futures.Executor the requests are run on.
+
+    Methods:
+        capture_pause: Pause the current capture.
+        capture_record: Carry on recording the current capture.
+        capture_status_str: Get the status string.
+    """
+
+    def __init__(self, device, executor = None):
+
+        """Constructor.
+
+        Arguments:
+            device: echo360.capture_device.Echo360CaptureDevice for the echo box.
+            executor: Executor to run the requests on, None for the loop's default.
+
+        Returns:
+            None.
+        """
+
+        self.device = device
+        self.executor = executor
+
+    async def _call(self, function):
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function)
+
+    async def capture_status_str(self):
+
+        """Get the current status of the echo box.
+
+        Arguments:
+            None.
+
+        Returns:
+            Status string, in the form 'Key=value;Key=value'.
+        """
+
+        return await self._call(self.device.capture_status_str)
+
+    async def capture_pause(self):
+
+        """Pause the current capture."""
+
+        await self._call(self.device.capture_pause)
+
+    async def capture_record(self):
+
+        """Carry on recording the current capture."""
+
+        await self._call(self.device.capture_record)
+
+
+async def check_button_status(indi_device, echo_device, state = None, room = 'default'):
+
+    """Look at the indicator and check if it's been pressed.
+    Then take appropriate action.
+
+    Arguments:
+        indi_device: Indicator object to check status on.
+        echo_device (Async_Echo_Device): Echo box to update if button is pressed.
+        state: The current state (as known to the program) of the echo box
+        room (string): Name of the room, for the recorder.
+
+    Returns:
+        None
+    """
+
+    pressed = indi_device.read_switch()
+    pyliteco.recorder.button(room, pressed)
+    if pressed:
+        logger.debug('Button pressed while in state %s', state)
+        if state == 'active':
+            # recording, so pause
+            await echo_device.capture_pause()
+        elif state == 'paused':
+            # paused, so restart
+            await echo_device.capture_record()
+
+
+class Async_Room(pyliteco.rooms.Room):
+
+    """Room polled by a coroutine.
+
+    Instance attributes:
+        executor: Executor the echo box requests are run on, None for the
+            loop's default.
+        task: asyncio task running the room, None until started.
+
+    Methods:
+        apply_config: Pick up a new config, reopening whatever has changed.
+        close: Stop the task and let go of the devices.
+        connect: Coroutine trying to connect to the echo box.
+        poll: Coroutine checking the echo box state and the button once.
+        run: Coroutine looping the room until cancelled.
+        step: Coroutine doing whatever the room needs next.
+        wake: Cut short the wait for the next step.
+    """
+
+    def __init__(self, name, config):
+
+        pyliteco.rooms.Room.__init__(self, name, config)
+        self.executor = None
+        self.task = None
+        self._wakeup = asyncio.Event()
+
+    def apply_config(self, config):
+
+        pyliteco.rooms.Room.apply_config(self, config)
+        # Might be due sooner now, e.g. to reconnect
+        self.wake()
+
+    def wake(self):
+
+        """Cut short the wait for the next step, so a new config is acted
+        on straight away. Only call from the event loop's thread.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._wakeup.set()
+
+    def close(self):
+
+        """Stop the task and let go of the indicator and echo box.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        if self.task is not None:
+            self.task.cancel()
+        pyliteco.rooms.Room.close(self)
+
+    async def connect(self):
+
+        """Try to connect to the echo box, showing the error light if not.
+
+        Arguments:
+            None.
+
+        Returns:
+            True if connected, else False.
+        """
+
+        logger.info('%s: Got echo url %s', self.name, self.config['ip'])
+        echo_device = await asyncio.get_running_loop().run_in_executor(
+                                    self.executor, pyliteco.pyliteco.connect_echo, self.config)
+        if not echo_device.connection_test.success():
+            logger.error('%s: Something went wrong connecting to echo box. Will try again in a minute', self.name)
+            logger.debug(echo_device.connection_test)
+            if not self.error_flash:
+                self.light_actions['error'].apply(self.indi_device)
+                self.error_flash = True
+            self.retry_at = pyliteco.clock.monotonic() + 60
+            return False
+
+        self.echo_device = Async_Echo_Device(echo_device, self.executor)
+        self.error_flash = False
+        self.state = None
+        self.poll_scheduler.reset()
+        return True
+
+    async def poll(self):
+
+        """Check the echo box state, update the light and check the button.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        # Schedule is fetched in the background, so this doesn't block
+        self.schedule.refresh()
+        held_state = self.schedule.held_state()
+        start = time.perf_counter()
+        status = await self.echo_device.capture_status_str()
+        pyliteco.metrics.STATUS_LATENCY.observe(time.perf_counter() - start)
+        pyliteco.recorder.status(self.name, status, held_state)
+        self.state = pyliteco.pyliteco.process_status(status, self.indi_device,
+                                                      self.light_actions, self.state,
+                                                      held_state, self.name)
+        await check_button_status(self.indi_device, self.echo_device, self.state, self.name)
+        self.retry_at = pyliteco.clock.monotonic() + self.poll_scheduler.next_interval(self.state,
+                                                                             self.schedule.index)
+
+    async def step(self):
+
+        """Do whatever this room needs next - open the indicator, connect
+        to the echo box or poll it. Problems only affect this room.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        if pyliteco.clock.monotonic() < self.retry_at:
+            return
+        try:
+            if self.indi_device is None:
+                # Opening a HID device blocks, so keep it off the loop
+                await asyncio.get_running_loop().run_in_executor(None, self.open_indicator)
+            if self.echo_device is None:
+                await self.connect()
+            else:
+                await self.poll()
+        except indicators.NoDeviceError:
+            logger.error('%s: Can not connect to device. Check config and check it is plugged in.', self.name)
+            self.indi_device = None
+            self.retry_at = pyliteco.clock.monotonic() + 10
+        except pyliteco.status.StatusParseError:
+            logger.exception('%s: Bad status message from echo box.', self.name)
+            self.retry_at = pyliteco.clock.monotonic() + 1
+
+    async def run(self, executor = None):
+
+        """Step the room whenever it is due, until cancelled. Sleeps until
+        the next step is due, unless woken by a new config.
+
+        Arguments:
+            executor: Executor to run the echo box requests on, None for
+                the loop's default.
+
+        Returns:
+            None.
+        """
+
+        self.executor = executor
+        while True:
+            # Cleared first, so a wake during the step isn't missed
+            self._wakeup.clear()
+            try:
+                await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('%s: Error polling echo box, reconnecting in a minute.', self.name)
+                self.echo_device = None
+                self.retry_at = pyliteco.clock.monotonic() + 60
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       max(0, self.retry_at - pyliteco.clock.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+
+class Async_Supervisor_Thread(pyliteco.rooms.Supervisor_Thread):
+
+    """Thread running every room from one asyncio event loop. The echo box
+    requests go to a pool of ROOM_THREADS worker threads, apart from the
+    loop's default executor so rooms stuck on a slow box can't hold up the
+    config fetch.
+
+    Instance Attributes:
+        loop: The event loop, while running.
+
+    Methods:
+        main_loop: The loop to execute while thread is running.
+    """
+
+    room_class = Async_Room
+
+    def __init__(self, kwargs = None):
+
+        pyliteco.rooms.Supervisor_Thread.__init__(self, kwargs)
+        self.loop = None
+
+    async def _supervise(self, config_file):
+
+        """Start the room coroutines and reload the config while running.
+        The config fetch and the wait on the clock are blocking, so go to
+        the default executor.
+
+        Arguments:
+            config_file (string): Location of local config file.
+
+        Returns:
+            None.
+        """
+
+        CONFIG = self.update_rooms(await self.loop.run_in_executor(
+                                    None, pyliteco.pyliteco.fetch_config, config_file))
+        reload_at = pyliteco.clock.monotonic() + pyliteco.pyliteco.CONFIG_RELOAD_INTERVAL
+        check_at = pyliteco.clock.monotonic() + pyliteco.pyliteco.CONFIG_CHECK_INTERVAL
+        pyliteco.config.add_change_listener(self.wake)
+        try:
+            while self.is_running():
+                if self._pool is None:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(pyliteco.rooms.ROOM_THREADS,
+                                                                       thread_name_prefix = 'room')
+                for room in self.rooms.values():
+                    if room.task is None:
+                        room.task = self.loop.create_task(room.run(self._pool))
+                now = pyliteco.clock.monotonic()
+                if now >= reload_at or (now >= check_at and pyliteco.config.config_changed(config_file)):
+                    logger.debug('Reloading config')
+                    CONFIG = self.update_rooms(await self.loop.run_in_executor(
+                                    None, pyliteco.pyliteco.fetch_config, config_file), CONFIG)
+                    reload_at = pyliteco.clock.monotonic() + pyliteco.pyliteco.CONFIG_RELOAD_INTERVAL
+                if now >= check_at:
+                    check_at = now + pyliteco.pyliteco.CONFIG_CHECK_INTERVAL
+
+                # Wait for the next check, or for a stop or pushed config
+                wait = max(0, min(reload_at, check_at) - pyliteco.clock.monotonic())
+                pyliteco.watchdog.heartbeat('poll', wait)
+                if await self.loop.run_in_executor(None, pyliteco.clock.wait, self._wakeup, wait):
+                    self._wakeup.clear()
+                    check_at = 0
+        finally:
+            pyliteco.config.remove_change_listener(self.wake)
+            tasks = [room.task for room in self.rooms.values() if room.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+
+    def main_loop(self, config_file_entered = None):
+
+        """The main loop for running.
+
+        Arguments:
+            config_file_entered (string): Location of local config file.
+
+        Returns:
+            None.
+        """
+
+        pyliteco.watchdog.heartbeat()
+        config_file = 'pyliteco.json'
+
+        if config_file_entered is not None:
+            config_file = config_file_entered
+
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._supervise(config_file))
+        except KeyboardInterrupt:
+            # Someone wants to escape!
+            pass
+        except:
+            logger.exception(None)
+        finally:
+            self.quit()
+            self.loop.close()
@@ -0,0 +1,388 @@
+"""Clock the main loop, watchdog and timers read the time and wait on.
+
+Everything that waits does so through the clock in use, so swapping in a
+Virtual_Clock runs them in simulated time: a 60 second reconnect wait or
+a watchdog restart takes as long as it takes the threads to get back to
+their next wait, rather than minutes. Install the clock with use() before
+starting any threads, as their events come from the clock.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import itertools
+import logging
+import threading
+import time as _time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Clock(object):
+
+    """The real clock.
+
+    Class attributes:
+        virtual (bool): Whether time is simulated.
+
+    Methods:
+        event: Make an event that waits can be cut short by.
+        monotonic: Get seconds from a clock that never goes back.
+        sleep: Wait for some seconds.
+        time: Get seconds since the epoch.
+        wait: Wait for an event or some seconds.
+    """
+
+    virtual = False
+
+    def monotonic(self):
+
+        """Get seconds from a clock that never goes back, as time.monotonic.
+
+        Arguments:
+            None.
+
+        Returns:
+            float.
+        """
+
+        return _time.monotonic()
+
+    def time(self):
+
+        """Get seconds since the epoch, as time.time.
+
+        Arguments:
+            None.
+
+        Returns:
+            float.
+        """
+
+        return _time.time()
+
+    def event(self):
+
+        """Make an event that waits can be cut short by.
+
+        Arguments:
+            None.
+
+        Returns:
+            Object with the methods of threading.Event.
+        """
+
+        return threading.Event()
+
+    def wait(self, event, timeout = None):
+
+        """Wait until an event is set, or for some seconds.
+
+        Arguments:
+            event: Event from this clock's event(), None to just wait.
+            timeout (float): Most seconds to wait, None for no limit.
+
+        Returns:
+            True if the event was set, else False.
+        """
+
+        if event is None:
+            _time.sleep(timeout)
+            return False
+        return event.wait(timeout)
+
+    def sleep(self, seconds):
+
+        """Wait for some seconds.
+
+        Arguments:
+            seconds (float): Seconds to wait.
+
+        Returns:
+            None.
+        """
+
+        self.wait(None, seconds)
+
+
+class _Virtual_Event(object):
+
+    """threading.Event whose waits go by a Virtual_Clock."""
+
+    def __init__(self, clock):
+
+        self._clock = clock
+        self._flag = False
+
+    def is_set(self):
+
+        return self._flag
+
+    def set(self):
+
+        with self._clock._condition:
+            self._flag = True
+            self._clock._condition.notify_all()
+
+    def clear(self):
+
+        self._flag = False
+
+    def wait(self, timeout = None):
+
+        return self._clock.wait(self, timeout)
+
+
+class Virtual_Clock(Clock):
+
+    """Clock that only moves when told to, for running long scenarios
+    quickly. Threads waiting on it block (in real time) until the clock
+    is moved past the end of their wait, or their event is set.
+
+    Drive it with advance, or with run_until/run_for, which move the clock
+    from one wait's end to the next as soon as the threads being simulated
+    are all waiting, so nothing is skipped and nothing waits for real.
+
+    Methods:
+        advance: Move the clock on.
+        blocked: Count the threads waiting for the clock to move.
+        run_for: Run the waiting threads for some simulated seconds.
+        run_until: Run the waiting threads until a simulated time.
+        settle: Wait (in real time) for threads to be waiting on the clock.
+    """
+
+    virtual = True
+
+    def __init__(self, start = 0.0, epoch = None):
+
+        """Constructor.
+
+        Arguments:
+            start (float): What monotonic gives to start with.
+            epoch (float): What time gives to start with, None for the real time now.
+
+        Returns:
+            None.
+        """
+
+        self._now = float(start)
+        self._epoch_offset = (_time.time() if epoch is None else epoch) - self._now
+        self._condition = threading.Condition()
+        self._waits = {}
+        self._tokens = itertools.count()
+
+    def monotonic(self):
+
+        return self._now
+
+    def time(self):
+
+        return self._epoch_offset + self._now
+
+    def event(self):
+
+        return _Virtual_Event(self)
+
+    def wait(self, event, timeout = None):
+
+        deadline = float('inf') if timeout is None else self._now + timeout
+        token = next(self._tokens)
+        with self._condition:
+            self._waits[token] = (deadline, event)
+            self._condition.notify_all()
+            try:
+                while not (event is not None and event.is_set()) and self._now < deadline:
+                    self._condition.wait()
+            finally:
+                del self._waits[token]
+                self._condition.notify_all()
+        return event is not None and event.is_set()
+
+    def advance(self, seconds):
+
+        """Move the clock on, ending any waits that are now over.
+
+        Arguments:
+            seconds (float): Simulated seconds to move on by.
+
+        Returns:
+            None.
+        """
+
+        with self._condition:
+            self._now += seconds
+            self._condition.notify_all()
+
+    def _blocked(self):
+
+        return [deadline for deadline, event in self._waits.values()
+                if deadline > self._now and not (event is not None and event.is_set())]
+
+    def blocked(self):
+
+        """Count the threads waiting for the clock to move.
+
+        Arguments:
+            None.
+
+        Returns:
+            int.
+        """
+
+        with self._condition:
+            return len(self._blocked())
+
+    def settle(self, threads, timeout = 10):
+
+        """Wait, in real time, until some threads are waiting for the clock
+        to move, e.g. after starting them or moving the clock.
+
+        Arguments:
+            threads (int): Number of threads expected to be waiting, or a
+                function giving it, for when threads come and go.
+            timeout (float): Most real seconds to wait.
+
+        Returns:
+            None.
+
+        Raises:
+            RuntimeError: The threads didn't all get to a wait in time.
+        """
+
+        expected = threads if callable(threads) else lambda: threads
+        give_up = _time.monotonic() + timeout
+        with self._condition:
+            while len(self._blocked()) < expected():
+                remaining = give_up - _time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError('Only {} of {} threads waiting on the clock after {}s.'.format(
+                                                            len(self._blocked()), expected(), timeout))
+                # Woken by each wait starting, or checked again shortly
+                # in case the number expected has changed
+                self._condition.wait(min(remaining, 0.1))
+
+    def run_until(self, until, threads, timeout = 10):
+
+        """Run the threads on the clock until a simulated time, moving the
+        clock to the end of the earliest wait each time they are all
+        waiting.
+
+        Arguments:
+            until (float): monotonic value to stop at.
+            threads (int): Number of threads being simulated, or a function
+                giving it.
+            timeout (float): Most real seconds to wait for the threads to
+                get back to waiting each time the clock moves.
+
+        Returns:
+            None.
+
+        Raises:
+            RuntimeError: The threads didn't all get to a wait in time.
+        """
+
+        while self._now < until:
+            self.settle(threads, timeout)
+            with self._condition:
+                self._now = min([until] + self._blocked())
+                self._condition.notify_all()
+        self.settle(threads, timeout)
+
+    def run_for(self, seconds, threads, timeout = 10):
+
+        """Run the threads on the clock for some simulated seconds. See run_until.
+
+        Arguments:
+            seconds (float): Simulated seconds to run for.
+            threads (int): Number of threads being simulated, or a function giving it.
+            timeout (float): Most real seconds to wait for the threads each step.
+
+        Returns:
+            None.
+        """
+
+        self.run_until(self._now + seconds, threads, timeout)
+
+
+_clock = Clock()
+"""Clock in use."""
+
+
+def use(clock):
+
+    """Start using a clock, e.g. a Virtual_Clock for tests and benchmarks.
+
+    Arguments:
+        clock (Clock): Clock to use, None for the real clock.
+
+    Returns:
+        The clock in use before.
+    """
+
+    global _clock
+    old, _clock = _clock, clock if clock is not None else Clock()
+    return old
+
+
+def get():
+
+    """Get the clock in use.
+
+    Arguments:
+        None.
+
+    Returns:
+        Clock.
+    """
+
+    return _clock
+
+
+def monotonic():
+
+    """Seconds from the clock in use that never go back. See Clock.monotonic."""
+
+    return _clock.monotonic()
+
+
+def time():
+
+    """Seconds since the epoch from the clock in use. See Clock.time."""
+
+    return _clock.time()
+
+
+def event():
+
+    """Make an event for the clock in use. See Clock.event."""
+
+    return _clock.event()
+
+
+def wait(event, timeout = None):
+
+    """Wait on the clock in use. See Clock.wait."""
+
+    return _clock.wait(event, timeout)
+
+
+def sleep(seconds):
+
+    """Sleep on the clock in use. See Clock.sleep."""
+
+    _clock.sleep(seconds)
@@ -20,9 +20,17 @@ Copyright (C) 2015 Robert Walker
 
 import json
 import logging
+import os
+import threading
+import time
 import urllib.error
+import urllib.parse
 import urllib.request
 
+import pyliteco.clock
+import pyliteco.metrics
+import pyliteco.trace
+
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +90,29 @@ EXAMPLE_CONFIG_JSON = json.loads(EXAMPLE_CONFIG)
 """JSON object representing example settings."""
 DEFAULT_CONFIG_JSON = json.loads(DEFAULT_CONFIG)
 """JSON object for default config."""
+SUBSCRIBE_RETRY_INTERVAL = 10
+"""Seconds to wait before subscribing again after losing the config server."""
+TRANSIENT_HTTP_ERRORS = (408, 429)
+"""4xx codes which don't mean the config server didn't understand."""
+
+_responses = {}
+"""Last good response for each URL, as (body, ETag, Last-Modified)."""
+_light_state_configs = {}
+"""Parsed light state config for each config server."""
+_echo_configs = {}
+"""Last full config got from each config server."""
+_separate_request_servers = set()
+"""Config servers which don't understand the combined ?all request."""
+_local_configs = {}
+"""Last read local config for each file, as (fingerprint, config)."""
+_polling_servers = set()
+"""Config servers which don't do subscriptions."""
+_subscribers = {}
+"""Running Config_Subscriber for each config server."""
+_configs = {}
+"""Last result of get_config for each local file, as (local, remote, config)."""
+_change_listeners = []
+"""Functions called when a config server pushes a new config."""
 
 
 class EchoipError(Exception):
@@ -109,32 +140,189 @@ def get_config(file_ = 'config.json', url = "http://example.com"):
         Config data in JSON style.
     """
     
-    try:
-        with open(file_) as CONFIG_FILE:
-            CONFIG = json.load(CONFIG_FILE)
-    except IOError:
-        logger.warning('Cannot find config file. Creating new one with defaults.')
-        with open(file_, 'a') as open_file:
-            json.dump(EXAMPLE_CONFIG_JSON, open_file)
-        return get_config(file_)
-    except ValueError:
-        raise BadConfigError()
+    start = time.perf_counter()
+    local = get_local_config(file_)
+    CONFIG = dict(local)
     
     try:
-        CONFIG.update(get_echo_config(CONFIG['server']))
+        remote = _get_subscribed_config(CONFIG['server'], CONFIG.get('subscribe', False))
+        if remote is None:
+            remote = get_echo_config(CONFIG['server'])
     except urllib.error.URLError:
         logger.warning('Cannot reach config server. Using default settings.')
-        CONFIG.update(DEFAULT_CONFIG_JSON)
+        remote = DEFAULT_CONFIG_JSON
     except EchoipError:
         logger.warning('Config server refused to return details - check config server details.Using default config.')
-        CONFIG.update(DEFAULT_CONFIG_JSON)
+        remote = DEFAULT_CONFIG_JSON
     except KeyError:
         logger.warning('Can\'t find server URL in config, using default server settings.')
-        CONFIG.update(DEFAULT_CONFIG_JSON)
+        remote = DEFAULT_CONFIG_JSON
+    
+    if remote is DEFAULT_CONFIG_JSON:
+        outcome = 'default'
+    elif file_ in _configs and remote is _configs[file_][1]:
+        outcome = 'cached'
+    else:
+        outcome = 'fresh'
+    pyliteco.metrics.CONFIG_FETCHES.inc(outcome)
+    pyliteco.metrics.CONFIG_LATENCY.observe(time.perf_counter() - start)
+    
+    # Nothing changed, so hand back the very same object to show that
+    try:
+        local_old, remote_old, config_old = _configs[file_]
+        if remote is remote_old and local is local_old:
+            return config_old
+    except KeyError:
+        pass
+    
+    CONFIG.update(remote)
+    _configs[file_] = (local, remote, CONFIG)
+    return CONFIG
+
+
+def _fingerprint(file_):
+    
+    """Get something that changes whenever the file does.
+    
+    Arguments:
+        file_ (string): Location of the file.
+        
+    Returns:
+        Tuple of modification time and size.
+        
+    Raises:
+        OSError: Can't find the file.
+    """
+    
+    stat = os.stat(file_)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_local_config(file_ = 'config.json'):
+    
+    """Get the config from the local file, only reading it again if it
+    has changed since last time. Creates the file with example settings
+    if it isn't there.
+    
+    Arguments:
+        file_ (string): Location of the local config file.
+        
+    Returns:
+        Local config data in JSON style. This is shared between calls,
+        so don't change it.
+    """
+    
+    try:
+        fingerprint = _fingerprint(file_)
+    except OSError:
+        logger.warning('Cannot find config file. Creating new one with defaults.')
+        with open(file_, 'a') as open_file:
+            json.dump(EXAMPLE_CONFIG_JSON, open_file)
+        fingerprint = _fingerprint(file_)
+    
+    try:
+        if _local_configs[file_][0] == fingerprint:
+            return _local_configs[file_][1]
+    except KeyError:
+        pass
     
+    try:
+        with open(file_) as CONFIG_FILE:
+            CONFIG = json.load(CONFIG_FILE)
+    except ValueError:
+        raise BadConfigError()
+    _local_configs[file_] = (fingerprint, CONFIG)
     return CONFIG
 
 
+def local_config_changed(file_ = 'config.json'):
+    
+    """Check whether the local config file has changed since it was last
+    read. Only costs a stat, so fine to call every poll.
+    
+    Arguments:
+        file_ (string): Location of the local config file.
+        
+    Returns:
+        True if changed (or never read), else False.
+    """
+    
+    try:
+        return _fingerprint(file_) != _local_configs[file_][0]
+    except (OSError, KeyError):
+        return True
+
+
+def config_changed(file_ = 'config.json'):
+    
+    """Check whether the config has changed, either the local file or
+    a change pushed by the config server. Cheap enough to call every poll.
+    
+    Arguments:
+        file_ (string): Location of the local config file.
+        
+    Returns:
+        True if get_config would give something new, else False.
+    """
+    
+    if local_config_changed(file_):
+        return True
+    subscriber = _subscribers.get(_local_configs[file_][1].get('server'))
+    return subscriber is not None and subscriber.changed.is_set()
+
+
+def add_change_listener(listener):
+    
+    """Have a function called whenever a config server pushes a new
+    config, e.g. to wake a thread waiting on a timer.
+    
+    Arguments:
+        listener: Function taking no arguments. Called from the subscriber
+            thread, so should be quick.
+        
+    Returns:
+        None.
+    """
+    
+    _change_listeners.append(listener)
+
+
+def remove_change_listener(listener):
+    
+    """Stop calling a function added with add_change_listener.
+    
+    Arguments:
+        listener: Function to stop calling.
+        
+    Returns:
+        None.
+    """
+    
+    try:
+        _change_listeners.remove(listener)
+    except ValueError:
+        pass
+
+
+def diff_config(old_config, new_config):
+    
+    """Find which settings differ between two configs.
+    
+    Arguments:
+        old_config (dict): Config currently in use.
+        new_config (dict): Freshly loaded config.
+        
+    Returns:
+        Dict of the settings in new_config that are new or changed.
+    """
+    
+    changes = {}
+    for key, value in new_config.items():
+        if key not in old_config or old_config[key] != value:
+            changes[key] = value
+    return changes
+
+
 def _get_file(url):
     
     """Wrapper to grab a file and raise an exception if the file
@@ -147,16 +335,47 @@ def _get_file(url):
         file_ (string): Body of the file.
     """
     
+    return _get_file_conditional(url)[0]
+
+
+@pyliteco.trace.traced('config._get_file')
+def _get_file_conditional(url):
+    
+    """Grab a file like _get_file, but send the validators from the last
+    good response so an unchanged file comes back as 304 Not Modified.
+    
+    Arguments:
+        url (string): URL to get the file from.
+        
+    Returns:
+        Tuple of the body of the file (string) and whether it has
+        changed since the last fetch (bool).
+    """
+    
+    request = urllib.request.Request(url)
+    cached = _responses.get(url)
+    if cached is not None:
+        if cached[1] is not None:
+            request.add_header('If-None-Match', cached[1])
+        if cached[2] is not None:
+            request.add_header('If-Modified-Since', cached[2])
+    
     try:
-        file_ = urllib.request.urlopen(url).read().decode("utf-8")
+        response = urllib.request.urlopen(request)
+        file_ = response.read().decode("utf-8")
         if '<html>' in file_:
             # Oops, wrong place
             raise EchoipError("Server responded with HTML document, check URL and try again.")
         if file_ == '404' or file_ == '' or 'Not Found' in file_:
             raise EchoipError("Server doesn't know this client.")
         else:
-            return file_
+            _responses[url] = (file_, response.headers.get('ETag'),
+                               response.headers.get('Last-Modified'))
+            return file_, cached is None or cached[0] != file_
     except urllib.error.HTTPError as err:
+        if err.code == 304 and cached is not None:
+            logger.debug('%s not modified.', url)
+            return cached[0], False
         if err.code == 404:
             err404 = True
         else:
@@ -189,28 +408,273 @@ def get_light_state_config(server_url):
                             e.g. http://example.com/pyliteco.php.
         
     Returns:
-        Light state config in data structure.
+        Light state config in data structure. This is shared between
+        calls, so don't change it.
+    """
+    
+    return _get_light_state_config(server_url)[0]
+
+
+def _get_light_state_config(server_url):
+    
+    """Get the light state config, only parsing it if it has changed.
+    
+    Arguments:
+        server_url (string): URL of the config server, including page.
+        
+    Returns:
+        Tuple of the light state config and whether it has changed.
+    """
+    
+    file_, modified = _get_file_conditional(server_url + "?config")
+    if modified or server_url not in _light_state_configs:
+        _light_state_configs[server_url] = json.loads(file_)
+        modified = True
+    return _light_state_configs[server_url], modified
+
+
+def _get_combined_config(server_url):
+    
+    """Get the light state config and echo IP in one request, as a JSON
+    object of the light state config with an extra "ip" entry.
+    
+    Arguments:
+        server_url (string): URL of the config server, including page.
+        
+    Returns:
+        Configuration data structure.
+        
+    Raises:
+        BadConfigError: Server didn't give the combined format.
+    """
+    
+    file_, modified = _get_file_conditional(server_url + "?all")
+    if not modified and server_url in _echo_configs:
+        return _echo_configs[server_url]
+    config = _parse_combined_config(file_)
+    _echo_configs[server_url] = config
+    return config
+
+
+def _echo_url(echo_ip):
+    
+    """Make the echo box URL from what the config server gave.
+    
+    Arguments:
+        echo_ip (string): IP or host of the echo box, or a full URL
+            (e.g. http://127.0.0.1:8080 for a stand-in echo box).
+        
+    Returns:
+        URL of the echo box, https unless the server said otherwise.
+    """
+    
+    echo_ip = echo_ip.strip()
+    if '://' in echo_ip:
+        return echo_ip
+    return 'https://' + echo_ip
+
+
+def _parse_combined_config(file_):
+    
+    """Parse the combined light state config and echo IP.
+    
+    Arguments:
+        file_ (string): Body of the response from the config server.
+        
+    Returns:
+        Configuration data structure.
+        
+    Raises:
+        BadConfigError: Not in the combined format.
     """
     
-    return json.loads(_get_file(server_url + "?config"))
+    try:
+        config = json.loads(file_)
+        config['ip'] = _echo_url(config['ip'])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise BadConfigError()
+    return config
 
 
 def get_echo_config(server_url):
     
-    """Get the full config from the config server.
+    """Get the full config from the config server. Asks for it all in one
+    request, falling back to asking for the light state config and echo
+    IP separately if the server is too old to understand (it refuses
+    the request or answers with something that isn't the combined config).
     
     Arguments:
         server_url (string): URL of the config server, including page.
                             e.g. http://example.com/pyliteco.php.
         
     Returns:
-        Configuration data structure.
+        Configuration data structure. The same object is returned
+        until something changes on the server.
     """
     
-    config = get_light_state_config(server_url)
-    config.update({'ip': 'https://' + get_echo_ip(server_url)})
+    if server_url not in _separate_request_servers:
+        try:
+            return _get_combined_config(server_url)
+        except urllib.error.HTTPError as err:
+            if not 400 <= err.code < 500 or err.code in TRANSIENT_HTTP_ERRORS:
+                raise
+            logger.info('Config server refused combined config (%s), using separate requests.', err.code)
+            _separate_request_servers.add(server_url)
+        except (BadConfigError, EchoipError):
+            logger.info('Config server does not give combined config, using separate requests.')
+            _separate_request_servers.add(server_url)
+    
+    light_state_config, config_modified = _get_light_state_config(server_url)
+    echo_ip, ip_modified = _get_file_conditional(server_url)
+    if not (config_modified or ip_modified) and server_url in _echo_configs:
+        return _echo_configs[server_url]
+    
+    config = dict(light_state_config)
+    config.update({'ip': _echo_url(echo_ip)})
+    _echo_configs[server_url] = config
     return config
 
 
+class Config_Subscriber(threading.Thread):
+    
+    """Holds a long-poll request open to the config server, so changes
+    are picked up as soon as they are published.
+    
+    The request is server_url?subscribe, plus &version=<ETag of the last
+    config>. The server holds it open until the config differs from that
+    version, then answers with the combined config (as for ?all) and its
+    ETag. 204 or 304 means nothing changed before the server gave up
+    waiting, so just ask again. Anything else means the server doesn't
+    do subscriptions, and the thread stops so get_config goes back to
+    fetching the config itself.
+    
+    Instance attributes:
+        changed (threading.Event): Set when a new config has arrived.
+        config (dict): Latest config from the server, None until one arrives.
+        server_url (string): URL of the config server.
+        timeout (int): Seconds to wait on each request.
+        version (string): ETag of the latest config.
+        
+    Methods:
+        run: Keep a request open until stopped.
+        stop: Signal to stop the thread.
+    """
+    
+    def __init__(self, server_url, timeout = 300):
+        
+        """Constructor.
+        
+        Arguments:
+            server_url (string): URL of the config server, including page.
+            timeout (int): Seconds to wait on each request. Should be longer
+                than the server holds requests for.
+                
+        Returns:
+            None.
+        """
+        
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.server_url = server_url
+        self.timeout = timeout
+        self.changed = threading.Event()
+        self.config = None
+        self.version = None
+        self.running = False
+        self._stopped = pyliteco.clock.event()
+    
+    def start(self):
+        
+        self.running = True
+        self._stopped.clear()
+        threading.Thread.start(self)
+    
+    def stop(self):
+        
+        """Set attribute so thread stops running.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        self.running = False
+        self._stopped.set()
+    
+    def run(self):
+        
+        logger.info('Subscribing to config server %s', self.server_url)
+        while self.running:
+            url = self.server_url + '?subscribe'
+            if self.version is not None:
+                url += '&version=' + urllib.parse.quote(self.version)
+            try:
+                response = urllib.request.urlopen(url, timeout = self.timeout)
+                file_ = response.read().decode('utf-8')
+                if response.status == 204:
+                    # Nothing new, ask again
+                    continue
+                config = _parse_combined_config(file_)
+            except urllib.error.HTTPError as err:
+                if err.code == 304:
+                    continue
+                logger.info('Config server does not do subscriptions, polling instead.')
+                _polling_servers.add(self.server_url)
+                break
+            except BadConfigError:
+                logger.info('Config server does not do subscriptions, polling instead.')
+                _polling_servers.add(self.server_url)
+                break
+            except (urllib.error.URLError, OSError):
+                # Lost the server, give it a bit before trying again
+                pyliteco.clock.wait(self._stopped, SUBSCRIBE_RETRY_INTERVAL)
+                continue
+            self.version = response.headers.get('ETag')
+            self.config = config
+            self.changed.set()
+            logger.debug('Config pushed from server.')
+            for listener in list(_change_listeners):
+                listener()
+        
+        self.running = False
+        if _subscribers.get(self.server_url) is self:
+            del _subscribers[self.server_url]
+
+
+def _get_subscribed_config(server_url, subscribe):
+    
+    """Get the config pushed by the config server, starting or stopping
+    the subscription to match the local config.
+    
+    Arguments:
+        server_url (string): URL of the config server, including page.
+        subscribe (bool): Whether to subscribe to the server.
+        
+    Returns:
+        Configuration data structure, or None if there isn't one and the
+        config needs fetching the normal way.
+    """
+    
+    subscriber = _subscribers.get(server_url)
+    if not subscribe:
+        if subscriber is not None:
+            subscriber.stop()
+            del _subscribers[server_url]
+        return None
+    if subscriber is None:
+        if server_url in _separate_request_servers or server_url in _polling_servers:
+            # Old server, no point asking
+            return None
+        subscriber = Config_Subscriber(server_url)
+        _subscribers[server_url] = subscriber
+        subscriber.start()
+    subscriber.changed.clear()
+    if subscriber.config is not None:
+        _echo_configs[server_url] = subscriber.config
+    return subscriber.config
+
+
 if __name__ == '__main__':
     print(get_echo_config('http://yorkie.york.ac.uk/echolight.php'))
\ No newline at end of file
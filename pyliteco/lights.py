@@ -0,0 +1,156 @@
+"""Turn the light state part of the config into actions for the indicator.
+
+The config is checked and compiled once when it is loaded, so bad light
+settings are reported then rather than when the echo box changes state,
+and a change of state is just a lookup in the compiled table.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import collections
+import logging
+
+import indicators
+import pyliteco.config
+import pyliteco.trace
+
+
+logger = logging.getLogger(__name__)
+
+
+LIGHT_STATES = ('inactive', 'active', 'waiting', 'complete', 'paused', 'error', 'unknown')
+"""Config entries giving what the light does in each state."""
+
+
+class LightConfigError(Exception):
+
+    """Light state entry in the config can't be used."""
+
+    pass
+
+
+class Light_Action(collections.namedtuple('Light_Action', ['colours', 'flash', 'flash_speed'])):
+
+    """What the indicator should show for one state. Immutable.
+
+    Instance attributes:
+        colours (tuple): Colours to show, the first is used when not flashing.
+        flash (bool): Whether to flash.
+        flash_speed (float): Seconds to stay in each flash state, None
+            when not flashing.
+
+    Methods:
+        apply: Set an indicator to show this.
+    """
+
+    __slots__ = ()
+
+    @pyliteco.trace.traced('Light_Action.apply')
+    def apply(self, device):
+
+        """Set the indicator to show this action. Does nothing if the
+        indicator is already showing it.
+
+        Arguments:
+            device (indicators.Device): LED device to set.
+
+        Returns:
+            True if the indicator was changed, else False.
+        """
+
+        if self.flash:
+            colours = self.colours[0] if len(self.colours) == 1 else list(self.colours)
+            return device.show(colours, True, self.flash_speed)
+        return device.show(self.colours[0])
+
+
+def compile_light_action(config_json, allowed_colours = None, flash_colours = None):
+
+    """Check one light state entry from the config and make it into an action.
+
+    Arguments:
+        config_json (dict): Entry with 'colour', 'flash' and, if flashing,
+            'flash_speed'.
+        allowed_colours: Colours the indicator can show, None for any.
+        flash_colours: Single colours the indicator can flash, None for
+            any colour or list of colours.
+
+    Returns:
+        Light_Action.
+
+    Raises:
+        LightConfigError: Entry is missing something or has a bad value.
+    """
+
+    try:
+        colours = config_json['colour']
+        flash = bool(config_json['flash'])
+        # Only needed when flashing, as it always was
+        flash_speed = float(config_json['flash_speed']) if flash else None
+    except KeyError as err:
+        raise LightConfigError('Missing {}'.format(err))
+    except (TypeError, ValueError) as err:
+        raise LightConfigError(err)
+
+    if isinstance(colours, str):
+        colours = (colours,)
+    elif isinstance(colours, list) and len(colours) > 0:
+        colours = tuple(colours)
+    else:
+        raise LightConfigError('Bad colour {!r}'.format(colours))
+    if allowed_colours is not None:
+        for colour in colours:
+            if colour not in allowed_colours:
+                raise LightConfigError('Colour {} not allowed by indicator'.format(colour))
+    if flash and flash_colours is not None:
+        if len(colours) != 1:
+            raise LightConfigError('Indicator can only flash one colour, not {}'.format(list(colours)))
+        if colours[0] not in flash_colours:
+            raise LightConfigError('Indicator can not flash {}'.format(colours[0]))
+    return Light_Action(colours, flash, flash_speed)
+
+
+def compile_light_actions(config):
+
+    """Make the table of actions for every state from a config, checked
+    against the colours the configured indicator can show and flash. Bad
+    entries are logged and replaced with the default for that state.
+
+    Arguments:
+        config (dict): Full config, with an entry for each of LIGHT_STATES.
+
+    Returns:
+        Dict mapping state to Light_Action.
+    """
+
+    try:
+        device_class = indicators.get_device(config['indicator'])
+    except KeyError:
+        device_class = None
+    allowed_colours = getattr(device_class, 'allowed_colours', None)
+    flash_colours = getattr(device_class, 'flash_colours', None)
+
+    actions = {}
+    for state in LIGHT_STATES:
+        default = pyliteco.config.DEFAULT_CONFIG_JSON[state]
+        try:
+            actions[state] = compile_light_action(config.get(state, default), allowed_colours, flash_colours)
+        except LightConfigError as err:
+            logger.error('Bad light config for %s: %s. Using default.', state, err)
+            actions[state] = compile_light_action(default)
+    return actions
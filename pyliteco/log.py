@@ -0,0 +1,254 @@
+"""Logging that never holds up the thread doing the logging.
+
+Records are put on a queue and written out by a background thread, so a
+slow disk or Event Log can't stall the status loop (and set the watchdog
+off). The message isn't formatted until it is written, and only if some
+handler wants it. The same warning logged over and over (e.g. failing to
+reach the echo box every minute) is only written once per RATE_LIMIT
+seconds, with a count of how many were left out. The log file is rotated
+once it gets to MAX_BYTES.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+"""Format of each line logged."""
+MAX_BYTES = 5 * 1024 * 1024
+"""Size the log file is rotated at."""
+BACKUP_COUNT = 5
+"""Number of rotated log files kept."""
+QUEUE_SIZE = 10000
+"""Most records waiting to be written before new ones are dropped."""
+RATE_LIMIT = 300
+"""Seconds in which an identical message is only written once."""
+
+
+class Rate_Limit_Filter(logging.Filter):
+
+    """Lets an identical message (same logger, level, message, arguments
+    and exception) through once per interval. The next one let through says
+    how many were left out. Only applies to warnings and worse, so changes
+    of state and the like are always logged.
+
+    Instance attributes:
+        interval (float): Seconds in which a message is only let through once.
+        level (int): Lowest level limited.
+    """
+
+    def __init__(self, interval = RATE_LIMIT, level = logging.WARNING):
+
+        """Constructor.
+
+        Arguments:
+            interval (float): Seconds in which a message is only let through once.
+            level (int): Lowest level to limit.
+
+        Returns:
+            None.
+        """
+
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.level = level
+        # Key: [time let through, number left out since]
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._prune_at = time.monotonic() + interval
+
+    def filter(self, record):
+
+        if record.levelno < self.level:
+            return True
+        exception = None
+        if record.exc_info and record.exc_info[1] is not None:
+            exception = (type(record.exc_info[1]), str(record.exc_info[1]))
+        try:
+            key = (record.name, record.levelno, record.msg, record.args, exception)
+            hash(key)
+        except TypeError:
+            # Unhashable arguments, go by the unformatted message
+            key = (record.name, record.levelno, str(record.msg), exception)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._prune_at:
+                # Keep those with a count left out still to report
+                self._seen = dict((old_key, seen) for old_key, seen in self._seen.items()
+                                  if seen[1] or now - seen[0] < self.interval)
+                self._prune_at = now + self.interval
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.interval:
+                seen[1] += 1
+                return False
+            self._seen[key] = [now, 0]
+        if seen is not None and seen[1]:
+            record.suppressed = seen[1]
+        return True
+
+
+class Formatter(logging.Formatter):
+
+    """Formatter adding the count of messages left out by Rate_Limit_Filter."""
+
+    def format(self, record):
+
+        text = logging.Formatter.format(self, record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += ' [{} more like this not logged]'.format(suppressed)
+        return text
+
+
+_IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+"""Argument types left for the listener to format."""
+_exception_formatter = logging.Formatter()
+
+
+def _frozen(args):
+
+    if isinstance(args, tuple):
+        return all(_frozen(arg) for arg in args)
+    return isinstance(args, _IMMUTABLE_TYPES)
+
+
+class Queue_Handler(logging.handlers.QueueHandler):
+
+    """Puts records on the queue, and drops them (counting how many) rather
+    than waiting if the queue is full. Messages whose arguments are all
+    simple values are left for the listener to format; anything else is
+    formatted first, so a later change to an argument isn't what gets
+    logged. Tracebacks are always turned into text first, so the queue
+    doesn't keep their frames alive.
+
+    Instance attributes:
+        dropped (int): Records dropped because the queue was full.
+    """
+
+    def __init__(self, queue_):
+
+        logging.handlers.QueueHandler.__init__(self, queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+
+        # The stock QueueHandler always formats the message here, on the
+        # logging thread. Only done when an argument could change later.
+        if record.args and not _frozen(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+
+
+def start(filename = None, stream = None, event_log = None, level = logging.INFO,
+          max_bytes = MAX_BYTES, backup_count = BACKUP_COUNT, rate_limit = RATE_LIMIT):
+
+    """Send all logging through a queue to a background thread writing to
+    a rotating file, a stream and/or the Windows Event Log. Replaces any
+    logging set up before.
+
+    Arguments:
+        filename (string): Log file, None for none.
+        stream: Stream (e.g. sys.stdout) to log to as well, None for none.
+        event_log (string): Application name to log to the Windows Event
+            Log as, None for none.
+        level (int): Level to log at to start with. The config's
+            "logging" setting changes it later.
+        max_bytes (int): Size to rotate the log file at.
+        backup_count (int): Number of rotated log files to keep.
+        rate_limit (float): Seconds in which an identical message is only
+            logged once, 0 to log every one.
+
+    Returns:
+        None.
+    """
+
+    global _listener, _handler
+    stop()
+    formatter = Formatter(FORMAT)
+    handlers = []
+    if filename is not None:
+        handlers.append(logging.handlers.RotatingFileHandler(filename, maxBytes = max_bytes,
+                                                             backupCount = backup_count))
+    if stream is not None:
+        handlers.append(logging.StreamHandler(stream))
+    if event_log is not None:
+        handlers.append(logging.handlers.NTEventLogHandler(event_log))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _handler = Queue_Handler(queue.Queue(QUEUE_SIZE))
+    if rate_limit:
+        _handler.addFilter(Rate_Limit_Filter(rate_limit))
+    _listener = logging.handlers.QueueListener(_handler.queue, *handlers, respect_handler_level = True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+
+def stop():
+
+    """Write out whatever is waiting and stop the background thread.
+    Logging after this goes nowhere until start is called again.
+
+    Arguments:
+        None.
+
+    Returns:
+        None.
+    """
+
+    global _listener, _handler
+    if _listener is None:
+        return
+    if _handler.dropped:
+        logging.getLogger(__name__).warning('%d log records dropped as the queue was full.', _handler.dropped)
+    logging.getLogger().removeHandler(_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _handler = None
+
+
+atexit.register(stop)
@@ -0,0 +1,366 @@
+"""Counters and latency histograms, served over HTTP for Prometheus.
+
+Updating a metric is a lock and an add, so is cheap enough for the poll
+loop. Nothing is served unless 'metrics_port' is set in the config.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import bisect
+import http.server
+import logging
+import threading
+import urllib.parse
+
+import pyliteco.trace
+
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Upper bounds (seconds) of the latency histogram buckets."""
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""Content type of the Prometheus text format."""
+
+
+def _format_labels(names, values):
+
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter(object):
+
+    """Count of something that only goes up, optionally split by labels.
+
+    Instance attributes:
+        help (string): What is being counted.
+        labels (tuple): Names of the labels.
+        name (string): Name of the metric.
+
+    Methods:
+        inc: Add to the count.
+        render: Get the count in Prometheus text format.
+        value: Get the count for some labels.
+    """
+
+    def __init__(self, name, help, labels = ()):
+
+        """Constructor.
+
+        Arguments:
+            name (string): Name of the metric, e.g. pyliteco_reconnects_total.
+            help (string): What is being counted.
+            labels (tuple): Names of the labels to split the count by.
+
+        Returns:
+            None.
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount = 1):
+
+        """Add to the count.
+
+        Arguments:
+            values: Value of each label, in order.
+            amount (float): How much to add.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, *values):
+
+        """Get the count for some labels.
+
+        Arguments:
+            values: Value of each label, in order.
+
+        Returns:
+            The count.
+        """
+
+        with self._lock:
+            return self._values.get(values, 0)
+
+    def render(self):
+
+        """Get the count in Prometheus text format.
+
+        Arguments:
+            None.
+
+        Returns:
+            List of lines.
+        """
+
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} counter'.format(self.name)]
+        for label_values, count in values:
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labels, label_values), count))
+        return lines
+
+
+class Histogram(object):
+
+    """Distribution of something, e.g. how long a request took.
+
+    Instance attributes:
+        buckets (tuple): Upper bound of each bucket.
+        help (string): What is being measured.
+        name (string): Name of the metric.
+
+    Methods:
+        observe: Add a measurement.
+        render: Get the histogram in Prometheus text format.
+        snapshot: Get the bucket counts, sum and count.
+    """
+
+    def __init__(self, name, help, buckets = LATENCY_BUCKETS):
+
+        """Constructor.
+
+        Arguments:
+            name (string): Name of the metric, e.g. pyliteco_get_config_seconds.
+            help (string): What is being measured.
+            buckets (tuple): Upper bound of each bucket, in order.
+
+        Returns:
+            None.
+        """
+
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+
+        """Add a measurement.
+
+        Arguments:
+            value (float): The measurement, e.g. seconds taken.
+
+        Returns:
+            None.
+        """
+
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+
+        """Get the bucket counts, sum and count.
+
+        Arguments:
+            None.
+
+        Returns:
+            Tuple of the (non-cumulative) count in each bucket, with the
+            last one being above every bound, the sum and the count.
+        """
+
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        return counts, total, sum(counts)
+
+    def render(self):
+
+        """Get the histogram in Prometheus text format.
+
+        Arguments:
+            None.
+
+        Returns:
+            List of lines.
+        """
+
+        counts, total, count = self.snapshot()
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append('{}_sum {}'.format(self.name, total))
+        lines.append('{}_count {}'.format(self.name, count))
+        return lines
+
+
+STATUS_LATENCY = Histogram('pyliteco_capture_status_seconds',
+                           'Time taken to get the status from the echo box.')
+CONFIG_LATENCY = Histogram('pyliteco_get_config_seconds',
+                           'Time taken to get the config.')
+HID_WRITE_LATENCY = Histogram('pyliteco_hid_write_seconds',
+                              'Time taken to send a packet to the indicator.')
+STATE_TRANSITIONS = Counter('pyliteco_state_transitions_total',
+                            'Changes of echo box state.', ('room', 'state'))
+HID_PACKETS = Counter('pyliteco_hid_packets_total',
+                      'Packets sent to indicators.')
+RECONNECTS = Counter('pyliteco_reconnects_total',
+                     'Connections made to echo boxes.', ('room', 'result'))
+WATCHDOG_RECOVERIES = Counter('pyliteco_watchdog_recoveries_total',
+                              'Hangs dealt with by the watchdog.', ('tier',))
+ROOM_RECOVERIES = Counter('pyliteco_room_recoveries_total',
+                          'Stuck room steps dealt with by the supervisor.', ('room', 'tier'))
+CONFIG_FETCHES = Counter('pyliteco_config_fetches_total',
+                         'Config fetches, by whether the config was fresh, '
+                         'the same as last time or the defaults.', ('outcome',))
+METRICS = (STATUS_LATENCY, CONFIG_LATENCY, HID_WRITE_LATENCY, STATE_TRANSITIONS,
+           HID_PACKETS, RECONNECTS, WATCHDOG_RECOVERIES, ROOM_RECOVERIES, CONFIG_FETCHES)
+"""Every metric served."""
+
+
+def observe_hid_write(seconds):
+
+    """Record a packet sent to an indicator. Handed to indicators with
+    set_write_observer.
+
+    Arguments:
+        seconds (float): Time taken to send it.
+
+    Returns:
+        None.
+    """
+
+    HID_WRITE_LATENCY.observe(seconds)
+    HID_PACKETS.inc()
+
+
+def render():
+
+    """Get every metric in Prometheus text format.
+
+    Arguments:
+        None.
+
+    Returns:
+        The metrics (string).
+    """
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics_Handler(http.server.BaseHTTPRequestHandler):
+
+    """Serves render() at /metrics, and the recent trace spans as JSON
+    lines at /trace (/trace?seconds=600 for the last ten minutes)."""
+
+    def do_GET(self):
+
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path == '/metrics':
+            body = render().encode('utf-8')
+            content_type = CONTENT_TYPE
+        elif parts.path == '/trace':
+            try:
+                seconds = float(urllib.parse.parse_qs(parts.query)['seconds'][0])
+            except (KeyError, ValueError):
+                seconds = None
+            body = pyliteco.trace.dump(seconds).encode('utf-8')
+            content_type = 'application/x-ndjson'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        logger.debug(format, *args)
+
+
+_server = None
+_server_address = None
+
+
+def serve(port, host = '127.0.0.1'):
+
+    """Serve the metrics on a port, moving or stopping the server to match.
+    Safe to call on every config load. A port that isn't a number is
+    logged and metrics left off, rather than stopping the config load.
+
+    Arguments:
+        port (int): Port to serve on, None to stop serving.
+        host (string): Address to listen on.
+
+    Returns:
+        None.
+    """
+
+    global _server, _server_address
+    address = None
+    if port is not None:
+        try:
+            port = int(port)
+            if not 0 <= port <= 65535:
+                raise ValueError('out of range')
+            address = (host, port)
+        except (TypeError, ValueError) as err:
+            logger.error('Bad metrics_port %r (%s), not serving metrics.', port, err)
+    if address == _server_address:
+        return
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+        _server_address = None
+        logger.info('Stopped metrics server.')
+    if address is None:
+        return
+    try:
+        _server = http.server.ThreadingHTTPServer(address, Metrics_Handler)
+    except OSError as err:
+        # Remember the address anyway, so this isn't logged every reload
+        _server_address = address
+        logger.error('Could not serve metrics on %s:%s: %s', host, port, err)
+        return
+    _server.daemon_threads = True
+    _server_address = address
+    thread = threading.Thread(target = _server.serve_forever, name = 'metrics')
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics on http://%s:%s/metrics', host, port)
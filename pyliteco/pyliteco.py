@@ -25,13 +25,19 @@ import logging
 import logging.handlers
 import sys
 import threading
-import pywintypes
-import pywinusb.hid
-import datetime
 import time
 
 # Local modules
+import pyliteco.adaptive
+import pyliteco.clock
 import pyliteco.config
+import pyliteco.lights
+import pyliteco.metrics
+import pyliteco.recorder
+import pyliteco.schedule
+import pyliteco.session
+import pyliteco.status
+import pyliteco.trace
 import echo360.capture_device as echo
 import indicators
 import pyliteco.watchdog
@@ -39,6 +45,12 @@ import pyliteco.watchdog
 logger = logging.getLogger(__name__)
 
 
+CONFIG_RELOAD_INTERVAL = 60
+"""Seconds between reloads of the config."""
+CONFIG_CHECK_INTERVAL = 1
+"""Most seconds between checks for a change to the local config file."""
+
+
 class EchoError(Exception):
     
     """Something wrong connecting to echobox"""
@@ -46,39 +58,94 @@ class EchoError(Exception):
     pass
 
 
-def get_light_action(config_json, device):
+def connect_echo(config):
     
-    """Return the method to set the light to what the config file wants.
+    """Make the echo box object for the details in the config. Its requests
+    go down the shared keep-alive connections, already authenticated.
     
     Arguments:
-        config_json (dict): Dictionary containing information for the required light state.
-        device (indicators.Device): LED device to set.
+        config (dict): Config with 'ip', 'user' and 'pass'.
         
     Returns:
-        Return code of device.set_light method.
+        echo360.capture_device.Echo360CaptureDevice for the echo box.
     """
     
-    # Stop any flashing
-    device.flashing_stop()
+    pyliteco.session.install(config.get('verify_ssl', True))
+    pyliteco.session.add_credentials(config['ip'], config['user'], config['pass'])
+    before = pyliteco.session.stats()
+    echo_device = echo.Echo360CaptureDevice(config['ip'], config['user'], config['pass'])
+    if pyliteco.session.stats() == before:
+        # Its connection test didn't go through urllib.request.urlopen
+        logger.warning('Echo box requests to %s are not using the shared keep-alive connections.', config['ip'])
+    pyliteco.metrics.RECONNECTS.inc(config.get('name', 'default'),
+                                    'ok' if echo_device.connection_test.success() else 'failed')
+    return echo_device
+
+
+def fetch_config(file_):
+    
+    """Get the config, telling the watchdog the fetch can take as long
+    as the config timeout rather than the poll one.
+    
+    Arguments:
+        file_ (string): Location of the local config file.
+        
+    Returns:
+        Dict with configuration options.
+    """
     
+    pyliteco.watchdog.heartbeat('config')
+    pyliteco.watchdog.heartbeat('poll', pyliteco.watchdog.HEARTBEAT_TIMEOUTS['config'])
     try:
-        if config_json['flash']:
-            
-            return device.flashing_start(colours = config_json['colour'], flash_speed = config_json['flash_speed'])
+        return pyliteco.config.get_config(file_)
+    finally:
+        pyliteco.watchdog.idle('config')
+        pyliteco.watchdog.heartbeat('poll')
+
+
+def watch_indicator(indi_device):
+    
+    """Have the indicator's background I/O beat the 'hid' heartbeat, if
+    it has any, and report its writes to the metrics and trace.
+    
+    Arguments:
+        indi_device: Indicator device just opened.
         
-        if config_json['colour'] == list:
-            
-            return device.set_light(config_json['colour'][0])
+    Returns:
+        None.
+    """
+    
+    if indi_device.set_heartbeat(pyliteco.watchdog.beat_function('hid')):
+        pyliteco.watchdog.heartbeat('hid')
+    else:
+        pyliteco.watchdog.idle('hid')
+    indi_device.set_write_observer(pyliteco.metrics.observe_hid_write)
+    indi_device.set_tracer(pyliteco.trace.span)
+
+
+@pyliteco.trace.traced('get_light_action')
+def get_light_action(config_json, device):
+    
+    """Set the light to what a light state entry of the config wants.
+    The main loops use the actions compiled by pyliteco.lights instead.
+    
+    Arguments:
+        config_json (dict): Dictionary containing information for the required light state.
+        device (indicators.Device): LED device to set.
         
-        else:
-            
-            return device.set_light(config_json['colour'])
-    except KeyError:
-        logger.exception('Bad config file')
-        raise
+    Returns:
+        True if the indicator was changed, else False.
+        
+    Raises:
+        LightConfigError: Entry is missing something or has a bad value.
+    """
+    
+    return pyliteco.lights.compile_light_action(config_json).apply(device)
         
     
-def check_status(echo_device, indi_device, config, state_old = None):
+@pyliteco.trace.traced('check_status')
+def check_status(echo_device, indi_device, light_actions, state_old = None, held_state = None,
+                 room = 'default'):
     
     """Connect to echo box and check state. Do appropriate things based
     on the state.
@@ -86,32 +153,70 @@ def check_status(echo_device, indi_device, config, state_old = None):
     Arguments:
         echo_device: Echo box object to check state of.
         indi_device: Indicator device to display state on.
-        config: Current configuration object.
+        light_actions (dict): Light_Action for each state, as from
+            pyliteco.lights.compile_light_actions.
         state_old (string): Previous state of echo box.
+        held_state (string): State to show while the box says it is
+            waiting or inactive, e.g. ahead of a scheduled capture.
+        room (string): Name of the room, for the metrics.
     
     Returns:
         State of echo box, as string.
+    
+    Raises:
+        StatusParseError: Echo box gave a status with no state.
     """
     
+    start = time.perf_counter()
     state_string = echo_device.capture_status_str()
+    pyliteco.metrics.STATUS_LATENCY.observe(time.perf_counter() - start)
+    pyliteco.recorder.status(room, state_string, held_state)
+    return process_status(state_string, indi_device, light_actions, state_old, held_state, room)
+
+
+def process_status(state_string, indi_device, light_actions, state_old = None, held_state = None,
+                   room = 'default'):
+    
+    """Work out the state from the status string got from the echo box
+    and do appropriate things based on the state.
+    
+    Arguments:
+        state_string (string): Status string, as from capture_status_str.
+        indi_device: Indicator device to display state on.
+        light_actions (dict): Light_Action for each state, as from
+            pyliteco.lights.compile_light_actions.
+        state_old (string): Previous state of echo box.
+        held_state (string): State to show while the box says it is
+            waiting or inactive, e.g. ahead of a scheduled capture.
+        room (string): Name of the room, for the metrics.
+    
+    Returns:
+        State of echo box, as string.
+    
+    Raises:
+        StatusParseError: Status string has no state.
+    """
+    
     logger.debug(state_string)
-    state = [thing.split('=')[1] for thing in state_string.split(';') if 'State' in thing][0]
-    logger.debug('Echo box in state {}'.format(state))
+    state = pyliteco.status.parse_status(state_string).state
+    logger.debug('Echo box in state %s', state)
+    if held_state is not None and state in ['inactive', 'waiting']:
+        logger.debug('Holding at %s for scheduled capture', held_state)
+        state = held_state
     if state_old == state: # Avoid unneccesary changes
         return state
-    logger.info('Change of state from {} to {}'.format(state_old, state))
+    logger.info('Change of state from %s to %s', state_old, state)
+    pyliteco.metrics.STATE_TRANSITIONS.inc(room, state)
     if state in ['inactive', 'active', 'waiting', 'complete', 'paused']:
-        try:
-            get_light_action(config[state], indi_device)
-        except KeyError:
-            logger.exception('Bad light state config')
+        light_actions[state].apply(indi_device)
     else:
-        get_light_action(light_state_config['unknown'], indi_device)
-        logger.warning('Echo box in unknown state: {}'.format(state))
+        light_actions['unknown'].apply(indi_device)
+        logger.warning('Echo box in unknown state: %s', state)
     return state
 
 
-def check_button_status(indi_device, echo_device, state = None):
+@pyliteco.trace.traced('check_button_status')
+def check_button_status(indi_device, echo_device, state = None, room = 'default'):
     
     """Look at the indicator and check if it's been pressed.
     Then take appropriate action.
@@ -120,13 +225,16 @@ def check_button_status(indi_device, echo_device, state = None):
         indi_device: Indicator object to check status on.
         echo_device: Echo box object to update if button is pressed.
         state: The current state (as known to the program) of the echo box
+        room (string): Name of the room, for the recorder.
         
     Returns:
         None
     """
     
-    if indi_device.read_switch():
-        logger.debug('Button pressed while in state {}'.format(state))
+    pressed = indi_device.read_switch()
+    pyliteco.recorder.button(room, pressed)
+    if pressed:
+        logger.debug('Button pressed while in state %s', state)
         if state == 'active':
             # recording, so pause
             echo_device.capture_pause()
@@ -135,6 +243,21 @@ def check_button_status(indi_device, echo_device, state = None):
             echo_device.capture_record()
 
 
+def set_logging_level(config):
+    
+    """Set the root logger to the level asked for in the config.
+    
+    Arguments:
+        config (dict): Config with a 'logging' entry.
+        
+    Returns:
+        None.
+    """
+    
+    if config['logging'] in ['INFO', 'DEBUG', 'ERROR', 'WARNING']:
+        logging.getLogger().setLevel(eval('logging.{}'.format(config['logging'])))
+
+
 class Main_Thread(threading.Thread):
     
     """Thing that does the main running.
@@ -144,13 +267,17 @@ class Main_Thread(threading.Thread):
         
     Instance Attributes:
         arguements (dict): The arguemenets passed into the constructor.
+        light_actions (dict): Light_Action for each state, from the config.
         
     Methods:
+        adopt_indicators: Use indicators opened by another thread.
         is_running: Check whether the thread is running.
         load_config: Get the configuration from file/server.
+        release_indicators: Hand over the open indicators.
         run: The loop to execute while thread is running.
         start: Set the thread going.
         stop: Signal to stop the thread.
+        wake: Cut short whatever wait the thread is in.
     """
     
     running = False
@@ -169,10 +296,45 @@ class Main_Thread(threading.Thread):
         threading.Thread.__init__(self, target = self.main_loop, kwargs = kwargs)
         self.daemon = True
         self.arguments = kwargs
+        self.light_actions = None
+        self._adopted = {}
+        self._wakeup = pyliteco.clock.event()
+        
+    def adopt_indicators(self, devices):
+        
+        """Use indicators already open (from release_indicators on another
+        thread) rather than opening them again. Call before start.
+        
+        Arguments:
+            devices (dict): Open indicators, by room name.
+            
+        Returns:
+            None.
+        """
+        
+        self._adopted = dict(devices)
+    
+    def release_indicators(self):
+        
+        """Hand over the open indicators, so quit doesn't close them.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            Dict of open indicators, by room name.
+        """
         
+        indi_device = getattr(self, 'indi_device', None)
+        self.indi_device = None
+        if indi_device is None:
+            return {}
+        return {'default': indi_device}
+    
     def _sleep(self, seconds):
         
-        """Stop doing execution, but still check flags.
+        """Stop doing execution until the time is up, or straight away
+        if woken (by stop or a pushed config).
         
         Arguments:
             seconds (int): How long to sleep for
@@ -181,10 +343,42 @@ class Main_Thread(threading.Thread):
             None
         """
         
-        while seconds >=0 and self.is_running():
-            pyliteco.watchdog.watchdog_queue.put(datetime.datetime.now())
-            seconds -= 1
-            time.sleep(1)
+        pyliteco.watchdog.heartbeat('poll', seconds)
+        if self.is_running():
+            pyliteco.clock.wait(self._wakeup, seconds)
+            self._wakeup.clear()
+    
+    def _wait_for_button(self, seconds, config_file = None):
+        
+        """Stop doing execution until the time is up, or straight away
+        if the indicator's button is pressed, the thread is woken or the
+        local config file changes.
+        
+        Arguments:
+            seconds (float): Most seconds to wait.
+            config_file (string): Local config file to check every
+                CONFIG_CHECK_INTERVAL seconds, None to not check.
+            
+        Returns:
+            None
+        """
+        
+        pyliteco.watchdog.heartbeat('poll', seconds)
+        until = pyliteco.clock.monotonic() + seconds
+        while self.is_running():
+            wait = until - pyliteco.clock.monotonic()
+            if wait <= 0:
+                return
+            if config_file is not None:
+                wait = min(wait, CONFIG_CHECK_INTERVAL)
+            if pyliteco.clock.get().virtual:
+                # The indicator waits in real time, so just wait on the clock
+                woken = pyliteco.clock.wait(self._wakeup, wait)
+                self._wakeup.clear()
+            else:
+                woken = self.indi_device.wait_for_button(wait)
+            if woken or (config_file is not None and pyliteco.config.config_changed(config_file)):
+                return
     
     def is_running(self):
         
@@ -199,6 +393,7 @@ class Main_Thread(threading.Thread):
         
         return self.running
         
+    @pyliteco.trace.traced('Main_Thread.load_config')
     def load_config(self, file_ = 'config.json', old_config = None):
     
         """Get the config from the config file.
@@ -211,17 +406,13 @@ class Main_Thread(threading.Thread):
             Dict with configuration options.
         """
         
-        CONFIG = pyliteco.config.get_config(file_)
+        CONFIG = fetch_config(file_)
+        if CONFIG is old_config:
+            # Nothing changed locally or on the server
+            return old_config
         
         if old_config is not None:
-            args = {}
-            for thing in CONFIG.keys():
-                try:
-                    if old_config[thing] != CONFIG[thing]:
-                        args[thing] = CONFIG[thing]
-                except KeyError:
-                    # Not in old config, so a change
-                    args[thing] = CONFIG[thing]
+            args = pyliteco.config.diff_config(old_config, CONFIG)
             if len(args) == 0:
                 # No changes
                 return old_config
@@ -231,6 +422,7 @@ class Main_Thread(threading.Thread):
                 indicator = args['indicator']
                 del self.indi_device
                 self.indi_device = indicators.get_device(indicator)()
+                watch_indicator(self.indi_device)
                 self.state = None
                 logger.info('Change indicator type to {}.'.format(indicator))
                 logger.debug('Reset status to None.')
@@ -240,22 +432,26 @@ class Main_Thread(threading.Thread):
                 
             try:
                 brightness = args['brightness']
-                self.indi_device.set_brightness(brightness)
+                self.indi_device.show_brightness(brightness)
             except KeyError:
                 # No change to brightness
                 pass
             
             # Deal with new echo details
             if set(args.keys()).intersection(set(['user', 'pass', 'ip'])):
-                self.echo_device = echo.Echo360CaptureDevice(CONFIG['ip'], CONFIG['user'], CONFIG['pass'])
+                self.echo_device = connect_echo(CONFIG)
                 if not self.echo_device.connection_test.success():
                     # Failed to connect
                     logger.error('Something went wrong connecting to echo box.')
                     logger.debug(self.echo_device.connection_test)
                     raise EchoError('Unable to connect.')
         
-        if CONFIG['logging'] in ['INFO', 'DEBUG', 'ERROR', 'WARNING']:
-            logging.getLogger().setLevel(eval('logging.{}'.format(CONFIG['logging'])))
+        self.light_actions = pyliteco.lights.compile_light_actions(CONFIG)
+        set_logging_level(CONFIG)
+        pyliteco.metrics.serve(CONFIG.get('metrics_port'))
+        pyliteco.trace.configure(CONFIG.get('trace'))
+        pyliteco.recorder.configure(CONFIG.get('record'))
+        pyliteco.recorder.config(CONFIG)
         return CONFIG
     
     def quit(self):
@@ -270,8 +466,11 @@ class Main_Thread(threading.Thread):
         """
         if self.is_running():
             self.stop()
+        pyliteco.watchdog.idle('hid')
         try:
-            del self.indi_device
+            # Dropping the last reference closes it, unless it was
+            # handed over; called again when a replaced thread returns
+            self.indi_device = None
         except:
             logger.exception('Error closing indicator device.')
         logger.info('Closed pyliteco thread.')
@@ -287,7 +486,7 @@ class Main_Thread(threading.Thread):
             None.
         """
         
-        pyliteco.watchdog.watchdog_queue.put(datetime.datetime.now())
+        pyliteco.watchdog.heartbeat()
         config_file = 'pyliteco.json'
         
         if config_file_entered is not None:
@@ -296,25 +495,31 @@ class Main_Thread(threading.Thread):
         
         # Loading of the config
         CONFIG = self.load_config(config_file)
+        pyliteco.config.add_change_listener(self.wake)
 
         try:
             while self.is_running():
-                pyliteco.watchdog.watchdog_queue.put(datetime.datetime.now())
+                pyliteco.watchdog.heartbeat()
                 # Initialise some variables
                 error_flash = False
                 
                 # And the indicator device
                 try:
-                    self.indi_device = indicators.get_device(CONFIG['indicator'])()
+                    self.indi_device = self._adopted.pop('default', None)
+                    if self.indi_device is None:
+                        self.indi_device = indicators.get_device(CONFIG['indicator'])()
+                    else:
+                        logger.info('Using indicator from previous thread.')
+                    watch_indicator(self.indi_device)
                     try:
-                        self.indi_device.set_brightness(CONFIG['brightness'])
+                        self.indi_device.show_brightness(CONFIG['brightness'])
                     except KeyError:
                         # No brightness in config, use device default
                         pass
                 
                     # Loop until connection
                     while self.is_running():
-                        pyliteco.watchdog.watchdog_queue.put(datetime.datetime.now())
+                        pyliteco.watchdog.heartbeat()
                         # Reload config
                         try:
                             CONFIG = self.load_config(config_file, CONFIG)
@@ -324,10 +529,10 @@ class Main_Thread(threading.Thread):
                         logger.debug(CONFIG)
                         
                         # Log echo ip
-                        logger.info('Got echo url {}'.format(CONFIG['ip']))
+                        logger.info('Got echo url %s', CONFIG['ip'])
                         
                         # Try to connect
-                        self.echo_device = echo.Echo360CaptureDevice(CONFIG['ip'], CONFIG['user'], CONFIG['pass'])
+                        self.echo_device = connect_echo(CONFIG)
                         if not self.echo_device.connection_test.success():
                             # Failed to connect, will try again
                             logger.error('Something went wrong connecting to echo box. Will try again in a minute')
@@ -335,33 +540,44 @@ class Main_Thread(threading.Thread):
                             
                             # Check if currently doing error flash and 
                             if not error_flash:
-                                get_light_action(CONFIG['error'], self.indi_device)
+                                self.light_actions['error'].apply(self.indi_device)
                                 error_flash = True
                             self._sleep(60)
                         else:
                             # Connected, so (re)set some more variables
                             error_flash = False
                             self.state = None
-                            count = 0
+                            reload_at = pyliteco.clock.monotonic() + CONFIG_RELOAD_INTERVAL
+                            poll_scheduler = pyliteco.adaptive.Poll_Scheduler(CONFIG.get('poll_intervals'))
+                            schedule = pyliteco.schedule.Schedule_Watcher(CONFIG)
                             
                             # And loop for status
                             while self.is_running():
-                                pyliteco.watchdog.watchdog_queue.put(datetime.datetime.now())
+                                pyliteco.watchdog.heartbeat()
                                 try:
-                                    if count < 60:
-                                        count += 1
-                                    else:
+                                    if pyliteco.clock.monotonic() >= reload_at or pyliteco.config.config_changed(config_file):
                                         logger.debug('Reloading config')
+                                        logger.debug('HTTP connections: %s', pyliteco.session.stats())
                                         CONFIG = self.load_config(config_file, CONFIG)
-                                        count = 0
-                                    self.state = check_status(self.echo_device, self.indi_device, CONFIG, self.state)
+                                        poll_scheduler.set_intervals(CONFIG.get('poll_intervals'))
+                                        schedule.set_config(CONFIG)
+                                        reload_at = pyliteco.clock.monotonic() + CONFIG_RELOAD_INTERVAL
+                                    schedule.refresh()
+                                    self.state = check_status(self.echo_device, self.indi_device, self.light_actions,
+                                                              self.state, schedule.held_state())
+                                    if not self.is_running():
+                                        # Replaced while waiting on the echo box, and may
+                                        # have handed the indicator over
+                                        break
                                     check_button_status(self.indi_device, self.echo_device, self.state)
                                 except EchoError:
                                     break
-                                except IndexError:
-                                    logger.exception('Bad message - lost connection to echo box.')
+                                except pyliteco.status.StatusParseError:
+                                    logger.exception('Bad status message from echo box.')
                                 finally:
-                                    self._sleep(1) # Stop the thrashing
+                                    # Stop the thrashing
+                                    self._wait_for_button(poll_scheduler.next_interval(self.state, schedule.index),
+                                                          config_file)
                 except indicators.NoDeviceError:
                     logger.error('Can not connect to device. Check config and check it is plugged in.')
                 finally:
@@ -373,6 +589,7 @@ class Main_Thread(threading.Thread):
         except:
             logger.exception(None)
         finally:
+            pyliteco.config.remove_change_listener(self.wake)
             self.quit()
             
     def start(self, *args, **kwargs):
@@ -392,5 +609,23 @@ class Main_Thread(threading.Thread):
         """
         
         self.running = False
+        self.wake()
+    
+    def wake(self):
+        
+        """Cut short whatever wait the thread is in, so it notices a stop
+        or a new config straight away.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        self._wakeup.set()
+        indi_device = getattr(self, 'indi_device', None)
+        if indi_device is not None:
+            indi_device.wake()
         
     
\ No newline at end of file
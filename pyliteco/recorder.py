@@ -0,0 +1,373 @@
+"""Record what the echo boxes, buttons and config server said, for replay.
+
+With "record": {"file": "pyliteco-trace.jsonl.gz"} in the config, every
+status string, button read and new config is written to a trace file with
+the time it was got, so an incident can be run again through
+pyliteco.replay instead of pieced together from the log.
+
+The trace is JSON lines: a header object, then one list per event, times
+in seconds since the header. Each start of recording adds a new header to
+the end of the file, so restarts don't lose what went before:
+
+    [time, "s", room, status]          Status string (and held state, if any)
+    [time, "s", room]                  Same status as last time for the room
+    [time, "b", room] / [..., 1]       Button read, not pressed / pressed
+    [time, "c", config]                New config, without the credentials
+
+Files ending in .gz are gzipped. A gzipped trace left unfinished by a
+crash is moved aside (e.g. to pyliteco-trace.jsonl.20150709-100000.gz)
+before recording starts again, as nothing after the cut could be read.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import atexit
+import collections
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import pyliteco.version
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 1
+"""Version of the trace file format written."""
+FLUSH_INTERVAL = 5
+"""Most seconds between writing the trace out to disk."""
+SECRET_KEYS = ('user', 'pass')
+"""Config entries left out of the trace."""
+
+
+class TraceFormatError(Exception):
+
+    """Trace file isn't one written by Recorder."""
+
+    pass
+
+
+Trace_Event = collections.namedtuple('Trace_Event', ['time', 'kind', 'room', 'data'])
+"""Event read back from a trace: time (seconds since the epoch), kind ('s'
+status, 'b' button or 'c' config), room (None for config) and data (tuple
+of status string and held state, whether the button was pressed, or the
+config dict)."""
+
+
+def _open(path, mode):
+
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding = 'utf-8')
+    return open(path, mode, encoding = 'utf-8')
+
+
+def _cleanly_closed(path):
+
+    # Only a gzip trace can be left unreadable past the point it was cut
+    if not path.endswith('.gz') or not os.path.exists(path):
+        return True
+    try:
+        with gzip.open(path, 'rb') as file_:
+            while file_.read(1024 * 1024):
+                pass
+    except (EOFError, OSError):
+        return False
+    return True
+
+
+def _move_aside(path):
+
+    root, ext = os.path.splitext(path)
+    moved = '{}.{}{}'.format(root, time.strftime('%Y%m%d-%H%M%S'), ext)
+    os.replace(path, moved)
+    return moved
+
+
+def _without_secrets(config):
+
+    config = {key: value for key, value in config.items() if key not in SECRET_KEYS}
+    if isinstance(config.get('rooms'), list):
+        config['rooms'] = [{key: value for key, value in room.items() if key not in SECRET_KEYS}
+                           for room in config['rooms'] if isinstance(room, dict)]
+    return config
+
+
+class Recorder(object):
+
+    """Writes events to a trace file.
+
+    Instance attributes:
+        path (string): File written to.
+        start (float): Time (seconds since the epoch) the trace started.
+
+    Methods:
+        button: Record a button read.
+        close: Write out what is left and close the file.
+        config: Record a new config.
+        status: Record a status string.
+    """
+
+    def __init__(self, path):
+
+        """Constructor. Starts a new trace at the end of the file, or in a
+        new file if a gzipped trace there was never finished.
+
+        Arguments:
+            path (string): File to write to.
+
+        Returns:
+            None.
+
+        Raises:
+            OSError: File can't be written.
+        """
+
+        if not _cleanly_closed(path):
+            logger.warning('Trace %s was not closed properly, moved it to %s.', path, _move_aside(path))
+        self.path = path
+        self.start = time.time()
+        self._file = _open(path, 'a')
+        self._lock = threading.Lock()
+        self._last_status = {}
+        self._last_config = None
+        self._flush_at = time.monotonic() + FLUSH_INTERVAL
+        self._write({'pyliteco_trace': FORMAT_VERSION, 'start': self.start,
+                     'version': pyliteco.version.VERSION})
+
+    def _write(self, thing):
+
+        with self._lock:
+            self._write_locked(thing)
+
+    def _write_locked(self, thing):
+
+        # Caller holds self._lock
+        if self._file is None:
+            return
+        self._file.write(json.dumps(thing, separators = (',', ':')) + '\n')
+        if time.monotonic() >= self._flush_at:
+            self._file.flush()
+            self._flush_at = time.monotonic() + FLUSH_INTERVAL
+
+    def _now(self):
+
+        return round(time.time() - self.start, 3)
+
+    def status(self, room, raw, held_state = None):
+
+        """Record a status string got from an echo box.
+
+        Arguments:
+            room (string): Name of the room.
+            raw (string): Status string, as from capture_status_str.
+            held_state (string): State held at for a scheduled capture, if any.
+
+        Returns:
+            None.
+        """
+
+        # Compared and written under the lock, so a repeat is never written
+        # before the status it repeats when rooms record from several threads
+        with self._lock:
+            event = [self._now(), 's', room]
+            if self._last_status.get(room) != (raw, held_state):
+                self._last_status[room] = (raw, held_state)
+                event.append(raw)
+                if held_state is not None:
+                    event.append(held_state)
+            self._write_locked(event)
+
+    def button(self, room, pressed):
+
+        """Record a read of an indicator button.
+
+        Arguments:
+            room (string): Name of the room.
+            pressed (bool): Whether it had been pressed.
+
+        Returns:
+            None.
+        """
+
+        event = [self._now(), 'b', room]
+        if pressed:
+            event.append(1)
+        self._write(event)
+
+    def config(self, config):
+
+        """Record a config, if it isn't the one recorded last.
+
+        Arguments:
+            config (dict): Config, as from pyliteco.config.get_config.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            if config is self._last_config:
+                return
+            self._last_config = config
+            self._write_locked([self._now(), 'c', _without_secrets(config)])
+
+    def close(self):
+
+        """Write out what is left and close the file.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_recorder = None
+"""Recorder in use, None when not recording."""
+_settings = None
+
+
+def configure(settings):
+
+    """Start or stop recording to match the config. Safe to call on every
+    config load.
+
+    Arguments:
+        settings (dict): 'file' to record to, None to not record.
+
+    Returns:
+        None.
+    """
+
+    global _recorder, _settings
+    if settings == _settings:
+        return
+    _settings = settings
+    if _recorder is not None:
+        recorder, _recorder = _recorder, None
+        recorder.close()
+        logger.info('Stopped recording to %s.', recorder.path)
+    if not settings or not settings.get('file'):
+        return
+    try:
+        _recorder = Recorder(settings['file'])
+    except OSError as err:
+        logger.error('Can not record to %s: %s', settings['file'], err)
+        return
+    logger.info('Recording to %s.', settings['file'])
+
+
+def _close():
+
+    if _recorder is not None:
+        _recorder.close()
+
+
+atexit.register(_close)
+
+
+def status(room, raw, held_state = None):
+
+    """Record a status string, if recording. See Recorder.status."""
+
+    recorder = _recorder
+    if recorder is not None:
+        recorder.status(room, raw, held_state)
+
+
+def button(room, pressed):
+
+    """Record a button read, if recording. See Recorder.button."""
+
+    recorder = _recorder
+    if recorder is not None:
+        recorder.button(room, pressed)
+
+
+def config(config):
+
+    """Record a new config, if recording. See Recorder.config."""
+
+    recorder = _recorder
+    if recorder is not None:
+        recorder.config(config)
+
+
+def read_trace(path):
+
+    """Read the events back from a trace file, filling in repeated statuses.
+
+    Arguments:
+        path (string): Trace file.
+
+    Returns:
+        Iterator of Trace_Event, in the order recorded.
+
+    Raises:
+        TraceFormatError: Not a trace file, or a newer format. Bad
+            events part way through are logged and skipped.
+    """
+
+    with _open(path, 'r') as file_:
+        start = None
+        last_status = {}
+        lines = enumerate(file_, 1)
+        while True:
+            try:
+                number, line = next(lines)
+            except StopIteration:
+                return
+            except EOFError:
+                # Gzipped trace not closed, e.g. copied while recording
+                logger.warning('Trace %s is cut short.', path)
+                return
+            try:
+                event = json.loads(line)
+                if isinstance(event, dict):
+                    # Header, at the start of each recording
+                    if event['pyliteco_trace'] > FORMAT_VERSION:
+                        raise TraceFormatError('{} is trace format {}, only up to {} understood.'.format(
+                                                    path, event['pyliteco_trace'], FORMAT_VERSION))
+                    start = float(event['start'])
+                    last_status = {}
+                    continue
+                when, kind = start + event[0], event[1]
+                if kind == 's':
+                    room = event[2]
+                    if len(event) > 3:
+                        last_status[room] = (event[3], event[4] if len(event) > 4 else None)
+                    yield Trace_Event(when, kind, room, last_status[room])
+                elif kind == 'b':
+                    yield Trace_Event(when, kind, event[2], len(event) > 3 and bool(event[3]))
+                elif kind == 'c':
+                    yield Trace_Event(when, kind, None, event[2])
+            except (ValueError, TypeError, IndexError, KeyError) as err:
+                if start is None:
+                    raise TraceFormatError('{} is not a trace: {}'.format(path, err))
+                # e.g. cut short by a crash, or copied while recording
+                logger.warning('Skipping bad event on line %d of %s: %s', number, path, err)
@@ -0,0 +1,315 @@
+"""Run a recorded trace back through the status and button handling.
+
+Each event in a trace from pyliteco.recorder goes through check_status,
+check_button_status and the compiled light actions, as it did when it
+was recorded, but one after the other without any waiting, so a day of
+polling replays in seconds. The changes of state, changes of light and
+button actions are reported, with the time they happened in the trace.
+
+    python3 -m pyliteco.replay pyliteco-trace.jsonl.gz
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import sys
+import time
+
+import indicators.dummy
+import pyliteco.config
+import pyliteco.lights
+import pyliteco.pyliteco
+import pyliteco.recorder
+import pyliteco.rooms
+import pyliteco.status
+
+
+logger = logging.getLogger(__name__)
+
+
+Replay_Change = collections.namedtuple('Replay_Change', ['time', 'room', 'kind', 'value'])
+"""Something that happened in the replay: time (seconds since the epoch,
+as recorded), room, kind ('state', 'light', 'pause', 'record' or
+'bad_status') and value (new state, Display shown, or the status string)."""
+
+
+class Replay_Echo_Device(object):
+
+    """Echo box giving the recorded status strings.
+
+    Instance attributes:
+        status (string): Status string to give next.
+
+    Methods:
+        capture_pause: Note that a pause was asked for.
+        capture_record: Note that recording was asked for.
+        capture_status_str: Give the recorded status string.
+    """
+
+    def __init__(self, replay, room):
+
+        self.status = None
+        self._replay = replay
+        self._room = room
+
+    def capture_status_str(self):
+
+        return self.status
+
+    def capture_pause(self):
+
+        self._replay.note(self._room, 'pause', None)
+
+    def capture_record(self):
+
+        self._replay.note(self._room, 'record', None)
+
+
+class Replay_Indicator(indicators.dummy.Device):
+
+    """Indicator giving the recorded button reads and noting what it shows.
+
+    Instance attributes:
+        pressed (bool): What the next read_switch gives.
+    """
+
+    def __init__(self, replay, room):
+
+        indicators.dummy.Device.__init__(self)
+        self.pressed = False
+        self._replay = replay
+        self._room = room
+
+    def _report(self, msg):
+
+        pass
+
+    def read_switch(self):
+
+        pressed, self.pressed = self.pressed, False
+        return pressed
+
+    def show(self, colours, flash = False, flash_speed = None):
+
+        changed = indicators.dummy.Device.show(self, colours, flash, flash_speed)
+        if changed:
+            self._replay.note(self._room, 'light', self.display)
+        return changed
+
+
+class Replay_Room(object):
+
+    """Devices and state of one room being replayed."""
+
+    def __init__(self, replay, name, light_actions):
+
+        self.name = name
+        self.echo_device = Replay_Echo_Device(replay, name)
+        self.indi_device = Replay_Indicator(replay, name)
+        self.light_actions = light_actions
+        self.state = None
+
+
+class Replay(object):
+
+    """Feeds the events of a trace through the status and button handling.
+
+    Instance attributes:
+        changes (list): Replay_Change for everything that happened.
+        counts (Counter): Events replayed, by kind.
+        first (float): Earliest time of an event, None if there weren't any.
+        last (float): Latest time of an event.
+        rooms (dict): Replay_Room by name.
+
+    Methods:
+        feed: Replay one event.
+        note: Note something that happened.
+        run: Replay every event in a trace.
+    """
+
+    def __init__(self, on_change = None):
+
+        """Constructor.
+
+        Arguments:
+            on_change: Function called with each Replay_Change as it
+                happens, None to only keep them in changes.
+
+        Returns:
+            None.
+        """
+
+        self.changes = []
+        self.counts = collections.Counter()
+        self.first = None
+        self.last = None
+        self.rooms = {}
+        self._on_change = on_change
+        self._light_actions = {}
+        self._default_actions = pyliteco.lights.compile_light_actions(pyliteco.config.DEFAULT_CONFIG_JSON)
+        self._now = None
+
+    def note(self, room, kind, value):
+
+        """Note something that happened, at the time of the event being replayed.
+
+        Arguments:
+            room (string): Room it happened in.
+            kind (string): What happened, as Replay_Change.
+            value: Details, as Replay_Change.
+
+        Returns:
+            None.
+        """
+
+        change = Replay_Change(self._now, room, kind, value)
+        self.changes.append(change)
+        if self._on_change is not None:
+            self._on_change(change)
+
+    def _room(self, name):
+
+        try:
+            return self.rooms[name]
+        except KeyError:
+            room = Replay_Room(self, name, self._light_actions.get(name, self._default_actions))
+            self.rooms[name] = room
+            return room
+
+    def _set_config(self, config):
+
+        # As the main loops do: a set of light actions per room
+        config = dict(config, indicator = 'dummy')
+        self._light_actions = {name: pyliteco.lights.compile_light_actions(room_config)
+                               for name, room_config in pyliteco.rooms.make_room_configs(config).items()}
+        if 'rooms' not in config:
+            # Single room, whatever it was called when recorded
+            self._default_actions = self._light_actions['default']
+        for name, room in self.rooms.items():
+            room.light_actions = self._light_actions.get(name, self._default_actions)
+
+    def feed(self, event):
+
+        """Replay one event.
+
+        Arguments:
+            event (Trace_Event): Event from pyliteco.recorder.read_trace.
+
+        Returns:
+            None.
+        """
+
+        self._now = event.time
+        if self.first is None or event.time < self.first:
+            self.first = event.time
+        if self.last is None or event.time > self.last:
+            self.last = event.time
+        self.counts[event.kind] += 1
+        if event.kind == 'c':
+            self._set_config(event.data)
+            return
+        room = self._room(event.room)
+        if event.kind == 's':
+            raw, held_state = event.data
+            room.echo_device.status = raw
+            try:
+                state = pyliteco.pyliteco.check_status(room.echo_device, room.indi_device,
+                                                       room.light_actions, room.state,
+                                                       held_state, room.name)
+            except pyliteco.status.StatusParseError:
+                self.note(room.name, 'bad_status', raw)
+                return
+            if state != room.state:
+                self.note(room.name, 'state', state)
+            room.state = state
+        elif event.kind == 'b':
+            room.indi_device.pressed = event.data
+            pyliteco.pyliteco.check_button_status(room.indi_device, room.echo_device,
+                                                  room.state, room.name)
+
+    def run(self, events):
+
+        """Replay every event, as fast as they can be handled.
+
+        Arguments:
+            events: Iterable of Trace_Event, e.g. from read_trace.
+
+        Returns:
+            Seconds the replay took.
+        """
+
+        start = time.perf_counter()
+        for event in events:
+            self.feed(event)
+        return time.perf_counter() - start
+
+
+def _describe(change):
+
+    when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(change.time))
+    if change.kind == 'light':
+        display = change.value
+        value = '{}{}'.format('/'.join(display.colours) if isinstance(display.colours, list) else display.colours,
+                              ' flashing' if display.flash else '')
+    elif change.value is None:
+        value = ''
+    else:
+        value = change.value
+    return '{}.{:03d} {} {} {}'.format(when, int(change.time % 1 * 1000), change.room, change.kind, value)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'Replay a trace recorded by pyliteco.')
+    parser.add_argument('trace', help = 'Trace file, from "record" in the config')
+    parser.add_argument('--room', default = None, help = 'Only report this room')
+    parser.add_argument('-q', dest = 'quiet', action = 'store_true', help = 'Only report the totals')
+    parser.add_argument('-o', dest = 'output', default = None, help = 'Save the totals to this file as JSON')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level = logging.WARNING)
+
+    def report(change):
+        if args.room is None or change.room == args.room:
+            print(_describe(change))
+
+    replay = Replay(None if args.quiet else report)
+    seconds = replay.run(pyliteco.recorder.read_trace(args.trace))
+    covered = (replay.last - replay.first) if replay.first is not None else 0
+    totals = {'trace': args.trace,
+              'events': sum(replay.counts.values()),
+              'statuses': replay.counts['s'],
+              'button_reads': replay.counts['b'],
+              'configs': replay.counts['c'],
+              'rooms': len(replay.rooms),
+              'changes': collections.Counter(change.kind for change in replay.changes),
+              'trace_seconds': covered,
+              'replay_seconds': seconds,
+              'speedup': covered / seconds if seconds > 0 else None}
+    print('{} events from {} rooms, {:.0f}s of trace replayed in {:.2f}s'.format(
+                totals['events'], totals['rooms'], covered, seconds))
+    if args.output is not None:
+        with open(args.output, 'w') as file_:
+            json.dump(totals, file_, indent = 4)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
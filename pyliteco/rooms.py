@@ -0,0 +1,633 @@
+"""Drive many echo box / indicator pairs from one process.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+# Built-in modules
+import concurrent.futures
+import logging
+import threading
+
+# Local modules
+import indicators
+import pyliteco.adaptive
+import pyliteco.clock
+import pyliteco.config
+import pyliteco.lights
+import pyliteco.metrics
+import pyliteco.pyliteco
+import pyliteco.recorder
+import pyliteco.schedule
+import pyliteco.session
+import pyliteco.status
+import pyliteco.timer
+import pyliteco.trace
+import pyliteco.watchdog
+
+logger = logging.getLogger(__name__)
+
+ROOM_THREADS = 16
+"""Rooms stepped at the same time, each on a worker thread, so a box that
+is slow to answer only holds up its own room."""
+STEP_TIMEOUT = 30
+"""Seconds a room's step can run before it counts as stuck. A thread can't
+be stopped, so its HTTP connections are dropped, and if it is still stuck
+STEP_TIMEOUT later the room is started again without it."""
+
+
+def make_room_configs(config):
+
+    """Split the shared config into one config per room.
+
+    Each entry of config['rooms'] is laid over the shared config, so a room
+    only needs to give what is different about it (normally 'ip' and maybe
+    'indicator_serial'). Without a 'rooms' list, the shared config is the
+    one and only room.
+
+    Arguments:
+        config (dict): Shared config, with a 'rooms' list of room definitions.
+
+    Returns:
+        Dict mapping room name to the config for that room.
+    """
+
+    shared = dict(config)
+    definitions = shared.pop('rooms', [{'name': 'default'}])
+
+    room_configs = {}
+    for index, definition in enumerate(definitions):
+        room_config = dict(shared)
+        room_config.update(definition)
+        name = room_config.setdefault('name', 'room{}'.format(index))
+        if name in room_configs:
+            logger.warning('Room %s defined more than once, using last definition.', name)
+        room_configs[name] = room_config
+    return room_configs
+
+
+class Room(object):
+
+    """One echo box and the indicator showing its state.
+
+    Instance attributes:
+        config (dict): Config for this room.
+        echo_device: Echo box object, None when not connected.
+        error_flash (bool): Whether the error light is showing.
+        heartbeat (Heartbeat): Deadline for the step under way to finish by.
+        indi_device: Indicator device, None when not open.
+        light_actions (dict): Light_Action for each state, from the config.
+        name (string): Name of the room, used when logging.
+        poll_scheduler: Poll_Scheduler deciding when to poll next.
+        retry_at (float): pyliteco.clock.monotonic() value to wait for before doing anything.
+        schedule: Schedule_Watcher keeping the echo box schedule.
+        state (string): Last known state of the echo box.
+
+    Methods:
+        apply_config: Pick up a new config, reopening whatever has changed.
+        close: Let go of the indicator and echo box.
+        connect: Try to connect to the echo box.
+        open_indicator: Try to open the indicator.
+        poll: Check the echo box state and the button once.
+        step: Do whatever the room needs next.
+    """
+
+    def __init__(self, name, config):
+
+        """Constructor.
+
+        Arguments:
+            name (string): Name of the room.
+            config (dict): Config for this room.
+
+        Returns:
+            None.
+        """
+
+        self.name = name
+        self.config = config
+        self.echo_device = None
+        self.indi_device = None
+        self.error_flash = False
+        self.heartbeat = pyliteco.watchdog.Heartbeat('room:' + name, STEP_TIMEOUT)
+        self.light_actions = pyliteco.lights.compile_light_actions(config)
+        self.retry_at = 0
+        self.state = None
+        self.poll_scheduler = pyliteco.adaptive.Poll_Scheduler(config.get('poll_intervals'))
+        self.schedule = pyliteco.schedule.Schedule_Watcher(config)
+
+    def apply_config(self, config):
+
+        """Swap to a new config, closing anything that needs reopening.
+
+        Arguments:
+            config (dict): New config for this room.
+
+        Returns:
+            None.
+        """
+
+        changes = pyliteco.config.diff_config(self.config, config)
+        self.config = config
+        if len(changes) == 0:
+            return
+
+        self.light_actions = pyliteco.lights.compile_light_actions(config)
+        if 'poll_intervals' in changes:
+            self.poll_scheduler.set_intervals(config['poll_intervals'])
+        self.schedule.set_config(config)
+
+        if 'indicator' in changes or 'indicator_serial' in changes:
+            logger.info('%s: Change indicator type to %s.', self.name, config['indicator'])
+            self.indi_device = None
+            self.state = None
+        elif 'brightness' in changes and self.indi_device is not None:
+            self.indi_device.show_brightness(config['brightness'])
+
+        if set(changes.keys()).intersection(set(['user', 'pass', 'ip'])):
+            logger.info('%s: Echo box details changed, reconnecting.', self.name)
+            self.echo_device = None
+            self.retry_at = 0
+
+    def close(self):
+
+        """Let go of the indicator and the echo box.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self.echo_device = None
+        try:
+            del self.indi_device
+        except:
+            logger.exception('%s: Error closing indicator device.', self.name)
+        self.indi_device = None
+
+    def connect(self):
+
+        """Try to connect to the echo box, showing the error light if not.
+
+        Arguments:
+            None.
+
+        Returns:
+            True if connected, else False.
+        """
+
+        logger.info('%s: Got echo url %s', self.name, self.config['ip'])
+        echo_device = pyliteco.pyliteco.connect_echo(self.config)
+        if not echo_device.connection_test.success():
+            logger.error('%s: Something went wrong connecting to echo box. Will try again in a minute', self.name)
+            logger.debug(echo_device.connection_test)
+            if not self.error_flash:
+                self.light_actions['error'].apply(self.indi_device)
+                self.error_flash = True
+            self.retry_at = pyliteco.clock.monotonic() + 60
+            return False
+
+        self.echo_device = echo_device
+        self.error_flash = False
+        self.state = None
+        self.poll_scheduler.reset()
+        return True
+
+    def open_indicator(self):
+
+        """Open the indicator given in the config.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+
+        Raises:
+            NoDeviceError: Indicator isn't plugged in.
+        """
+
+        self.indi_device = indicators.get_device(self.config['indicator'])(
+                                    serial = self.config.get('indicator_serial'))
+        pyliteco.pyliteco.watch_indicator(self.indi_device)
+        try:
+            self.indi_device.show_brightness(self.config['brightness'])
+        except KeyError:
+            # No brightness in config, use device default
+            pass
+        self.state = None
+
+    def poll(self):
+
+        """Check the echo box state, update the light and check the button.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self.schedule.refresh()
+        self.state = pyliteco.pyliteco.check_status(self.echo_device, self.indi_device,
+                                                    self.light_actions, self.state,
+                                                    self.schedule.held_state(), self.name)
+        pyliteco.pyliteco.check_button_status(self.indi_device, self.echo_device, self.state, self.name)
+        self.retry_at = pyliteco.clock.monotonic() + self.poll_scheduler.next_interval(self.state,
+                                                                             self.schedule.index)
+
+    def step(self):
+
+        """Do whatever this room needs next - open the indicator, connect
+        to the echo box or poll it. Problems only affect this room.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        if pyliteco.clock.monotonic() < self.retry_at:
+            return
+        self.heartbeat.beat()
+        try:
+            if self.indi_device is None:
+                self.open_indicator()
+            if self.echo_device is None:
+                self.connect()
+            else:
+                self.poll()
+        except indicators.NoDeviceError:
+            logger.error('%s: Can not connect to device. Check config and check it is plugged in.', self.name)
+            self.indi_device = None
+            self.retry_at = pyliteco.clock.monotonic() + 10
+        except pyliteco.status.StatusParseError:
+            logger.exception('%s: Bad status message from echo box.', self.name)
+            self.retry_at = pyliteco.clock.monotonic() + 1
+        except Exception:
+            logger.exception('%s: Error polling echo box, reconnecting in a minute.', self.name)
+            self.echo_device = None
+            self.retry_at = pyliteco.clock.monotonic() + 60
+        finally:
+            self.heartbeat.idle()
+
+
+class Supervisor_Thread(pyliteco.pyliteco.Main_Thread):
+
+    """Thread running every room given in the config, sharing the config
+    fetch, logging and watchdog between them. Each room due is stepped on
+    a pool of worker threads, so one box that is slow to answer (or never
+    does) doesn't hold up the others.
+
+    Class Attributes:
+        room_class: Class used to make each room.
+
+    Instance Attributes:
+        rooms (dict): Room objects, by name.
+        timers (Timer_Heap): When each room is next due.
+
+    Methods:
+        check_stuck: Get rooms whose step is taking too long going again.
+        load_config: Get the config and update the rooms from it.
+        main_loop: The loop to execute while thread is running.
+        quit: Close every room and stop the thread.
+        release_indicators: Hand over the open indicators.
+        restart_room: Start a stuck room again without waiting for its step.
+        start_step: Step a room on a worker thread.
+        update_rooms: Add, remove and reconfigure rooms to match a config.
+        wake: Cut short the wait for the next room.
+    """
+
+    room_class = Room
+
+    def __init__(self, kwargs = None):
+
+        """Construct the thread with required arguements.
+
+        Arguments:
+            config_file (string): Location of the local config file.
+
+        Returns:
+            None.
+        """
+
+        pyliteco.pyliteco.Main_Thread.__init__(self, kwargs)
+        self.rooms = {}
+        self.timers = pyliteco.timer.Timer_Heap()
+        self._pool = None
+        # Rooms being stepped: [started, recovery tier, things to do after]
+        self._busy = {}
+        self._busy_lock = threading.Lock()
+
+    def release_indicators(self):
+
+        """Hand over the open indicators, so quit doesn't close them.
+
+        Arguments:
+            None.
+
+        Returns:
+            Dict of open indicators, by room name.
+        """
+
+        devices = {}
+        for name, room in list(self.rooms.items()):
+            if room.indi_device is not None:
+                devices[name] = room.indi_device
+                room.indi_device = None
+        return devices
+
+    @pyliteco.trace.traced('Supervisor_Thread.load_config')
+    def load_config(self, file_ = 'config.json', old_config = None):
+
+        """Get the config and bring the rooms in line with it.
+
+        Arguments:
+            file_ (string): Name of the file to load.
+            old_config (dict): Old config to compare new one to.
+
+        Returns:
+            Dict with configuration options.
+        """
+
+        return self.update_rooms(pyliteco.pyliteco.fetch_config(file_), old_config)
+
+    def update_rooms(self, CONFIG, old_config = None):
+
+        """Bring the rooms in line with a freshly loaded config.
+
+        Arguments:
+            CONFIG (dict): Config just loaded.
+            old_config (dict): Old config to compare new one to.
+
+        Returns:
+            Dict with configuration options.
+        """
+
+        if CONFIG is old_config:
+            # Nothing changed locally or on the server
+            return old_config
+        if old_config is not None and len(pyliteco.config.diff_config(old_config, CONFIG)) == 0:
+            # No changes
+            return old_config
+
+        room_configs = make_room_configs(CONFIG)
+        for name in list(self.rooms.keys()):
+            if name not in room_configs:
+                logger.info('Removing room %s.', name)
+                room = self.rooms.pop(name)
+                self.timers.cancel(room)
+                self._when_idle(room, room.close)
+        for name, room_config in room_configs.items():
+            if name in self.rooms:
+                self._when_idle(self.rooms[name], self.rooms[name].apply_config, room_config)
+            else:
+                logger.info('Adding room %s.', name)
+                self.rooms[name] = self.room_class(name, room_config)
+                self.rooms[name].indi_device = self._adopted.pop(name, None)
+                if self.rooms[name].indi_device is not None:
+                    pyliteco.pyliteco.watch_indicator(self.rooms[name].indi_device)
+            self.timers.schedule(self.rooms[name].retry_at, self.rooms[name])
+
+        # Indicators handed over for rooms that have gone aren't needed
+        self._adopted = {}
+        pyliteco.pyliteco.set_logging_level(CONFIG)
+        pyliteco.metrics.serve(CONFIG.get('metrics_port'))
+        pyliteco.trace.configure(CONFIG.get('trace'))
+        pyliteco.recorder.configure(CONFIG.get('record'))
+        pyliteco.recorder.config(CONFIG)
+        return CONFIG
+
+    def quit(self):
+
+        """Close every room and stop the thread.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        if self.is_running():
+            self.stop()
+        for room in list(self.rooms.values()):
+            self._when_idle(room, room.close)
+        if self._pool is not None:
+            # Don't wait for a stuck room, it closes itself when done
+            self._pool.shutdown(wait = False, cancel_futures = True)
+            self._pool = None
+        logger.info('Closed pyliteco supervisor thread.')
+
+    def _when_idle(self, room, function, *args):
+
+        # Call now, or once the room's step has finished if it is being
+        # stepped, so the room is only ever used by one thread at a time
+        with self._busy_lock:
+            busy = self._busy.get(room)
+            if busy is not None:
+                busy[2].append((function, args))
+                return
+        function(*args)
+
+    def start_step(self, room):
+
+        """Step a room on a worker thread, rescheduling it when done.
+
+        Arguments:
+            room (Room): Room that is due.
+
+        Returns:
+            None.
+        """
+
+        if pyliteco.clock.get().virtual:
+            # Simulated time moves whenever this thread waits, so step in line
+            room.step()
+            self._reschedule(room)
+            return
+        with self._busy_lock:
+            if room in self._busy:
+                # Rescheduled by a new config mid-step, the step reschedules it
+                return
+            self._busy[room] = [pyliteco.clock.monotonic(), 0, []]
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(ROOM_THREADS, thread_name_prefix = 'room')
+        self._pool.submit(self._run_step, room)
+
+    def _run_step(self, room):
+
+        try:
+            room.step()
+        finally:
+            with self._busy_lock:
+                started, tier, deferred = self._busy.pop(room)
+            if tier:
+                logger.warning('%s: Finished after %.0f seconds.', room.name,
+                               pyliteco.clock.monotonic() - started)
+            for function, args in deferred:
+                try:
+                    function(*args)
+                except Exception:
+                    logger.exception('%s: Error updating room.', room.name)
+            self._reschedule(room)
+
+    def _reschedule(self, room):
+
+        if self.is_running() and self.rooms.get(room.name) is room:
+            self.timers.schedule(room.retry_at, room)
+
+    def check_stuck(self, now):
+
+        """Get rooms whose step has gone past their heartbeat going again,
+        doing as little as will work:
+            1. Drop the room's HTTP connections, so a request hung on its
+               echo box fails and the step finishes.
+            2. Start the room again with the same indicator, leaving the
+               step to finish on its own.
+        Each goes STEP_TIMEOUT after the last.
+
+        Arguments:
+            now (float): pyliteco.clock.monotonic() value.
+
+        Returns:
+            pyliteco.clock.monotonic() value to check again at, or None if
+            no room is being stepped.
+        """
+
+        stuck = []
+        check_at = None
+        with self._busy_lock:
+            for room, busy in self._busy.items():
+                if busy[1] == 2:
+                    # Given up on
+                    continue
+                if now > room.heartbeat.deadline:
+                    busy[1] += 1
+                    stuck.append((room, busy[1]))
+                    # Give it another go before the next tier
+                    room.heartbeat.beat()
+                if busy[1] < 2 and (check_at is None or room.heartbeat.deadline < check_at):
+                    check_at = room.heartbeat.deadline
+        for room, tier in stuck:
+            if tier == 1:
+                aborted = pyliteco.session.abort(room.config['ip'])
+                logger.error('%s: Still busy after %d seconds, dropped %d HTTP connections.',
+                             room.name, STEP_TIMEOUT, aborted)
+            else:
+                logger.error('%s: Still busy after %d seconds, starting the room again.',
+                             room.name, 2 * STEP_TIMEOUT)
+                self.restart_room(room)
+            pyliteco.metrics.ROOM_RECOVERIES.inc(room.name, str(tier))
+        return check_at
+
+    def restart_room(self, room):
+
+        """Replace a room whose step is stuck with a new one, handing over
+        its indicator so the light doesn't change. The stuck step keeps
+        its worker, so later steps go to a new pool.
+
+        Arguments:
+            room (Room): Room that is stuck.
+
+        Returns:
+            None.
+        """
+
+        if self.rooms.get(room.name) is not room:
+            return
+        new_room = self.room_class(room.name, room.config)
+        new_room.indi_device = room.indi_device
+        if new_room.indi_device is not None:
+            pyliteco.pyliteco.watch_indicator(new_room.indi_device)
+        self.rooms[room.name] = new_room
+        # Only drops its reference to the indicator, as the new room has it
+        self._when_idle(room, room.close)
+        if self._pool is not None:
+            self._pool.shutdown(wait = False)
+            self._pool = None
+        self.timers.schedule(new_room.retry_at, new_room)
+
+    def wake(self):
+
+        """Cut short the wait for the next room, so a stop or new config
+        is noticed straight away.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        pyliteco.pyliteco.Main_Thread.wake(self)
+        self.timers.wake()
+
+    def main_loop(self, config_file_entered = None):
+
+        """The main loop for running.
+
+        Arguments:
+            config_file_entered (string): Location of local config file.
+
+        Returns:
+            None.
+        """
+
+        pyliteco.watchdog.heartbeat()
+        config_file = 'pyliteco.json'
+
+        if config_file_entered is not None:
+            config_file = config_file_entered
+
+        pyliteco.config.add_change_listener(self.wake)
+        try:
+            CONFIG = self.load_config(config_file)
+            reload_at = pyliteco.clock.monotonic() + pyliteco.pyliteco.CONFIG_RELOAD_INTERVAL
+            check_at = pyliteco.clock.monotonic() + pyliteco.pyliteco.CONFIG_CHECK_INTERVAL
+            while self.is_running():
+                now = pyliteco.clock.monotonic()
+                if now >= reload_at or (now >= check_at and pyliteco.config.config_changed(config_file)):
+                    logger.debug('Reloading config')
+                    logger.debug('HTTP connections: %s', pyliteco.session.stats())
+                    CONFIG = self.load_config(config_file, CONFIG)
+                    reload_at = pyliteco.clock.monotonic() + pyliteco.pyliteco.CONFIG_RELOAD_INTERVAL
+                if now >= check_at:
+                    check_at = now + pyliteco.pyliteco.CONFIG_CHECK_INTERVAL
+                for room in self.timers.pop_due():
+                    self.start_step(room)
+
+                # Sleep until the next room is due, or something wakes the thread
+                until = min(reload_at, check_at)
+                for due in (self.timers.next_due(), self.check_stuck(now)):
+                    if due is not None:
+                        until = min(until, due)
+                pyliteco.watchdog.heartbeat('poll', max(0, until - pyliteco.clock.monotonic()))
+                if self.timers.wait(until):
+                    # Woken by a pushed config or stop, so check straight away
+                    check_at = 0
+        except KeyboardInterrupt:
+            # Someone wants to escape!
+            pass
+        except:
+            logger.exception(None)
+        finally:
+            pyliteco.config.remove_change_listener(self.wake)
+            self.quit()
@@ -0,0 +1,304 @@
+"""Keep track of the captures an echo box has scheduled, so polling can
+speed up and the light can change right at the scheduled start.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import bisect
+import calendar
+import concurrent.futures
+import logging
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree
+
+import pyliteco.clock
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEDULE_PATH = '/status/current_schedule'
+"""Echo box page listing the scheduled captures."""
+WINDOW = 30
+"""Seconds either side of a scheduled start or end to poll quickly for."""
+GRACE = 60
+"""Seconds after a scheduled start to keep the light lit if the box hasn't started."""
+FETCH_TIMEOUT = 10
+"""Seconds to wait for the echo box to give its schedule."""
+FETCH_THREADS = 4
+"""Most schedules fetched at once, shared by every room."""
+
+
+def _parse_time(text):
+
+    """Turn an echo box time (e.g. 2015-07-09T10:00:00.000Z, UTC) into
+    seconds since the epoch.
+
+    Arguments:
+        text (string): Time from the echo box.
+
+    Returns:
+        Seconds since the epoch (float).
+
+    Raises:
+        ValueError: Not a time.
+    """
+
+    return float(calendar.timegm(time.strptime(text.strip()[:19], '%Y-%m-%dT%H:%M:%S')))
+
+
+def parse_schedule(body):
+
+    """Get the captures from an echo box schedule page.
+
+    Arguments:
+        body (string): XML schedule, with start-time and duration (seconds)
+            for each capture.
+
+    Returns:
+        List of (start, end) tuples, in seconds since the epoch.
+
+    Raises:
+        ValueError: Page isn't a schedule.
+    """
+
+    try:
+        root = xml.etree.ElementTree.fromstring(body)
+    except xml.etree.ElementTree.ParseError as err:
+        raise ValueError(err)
+    captures = []
+    for element in root.iter():
+        start = element.findtext('start-time')
+        duration = element.findtext('duration')
+        if start is not None and duration is not None:
+            start = _parse_time(start)
+            captures.append((start, start + float(duration)))
+    return captures
+
+
+class Schedule_Index(object):
+
+    """Sorted index of scheduled captures, to find the next start or end
+    without going through the whole schedule.
+
+    Methods:
+        capture_starting: Find a capture that has just started, or is about to.
+        clamp_interval: Shorten a poll interval to fit around the schedule.
+    """
+
+    def __init__(self, captures = ()):
+
+        """Constructor.
+
+        Arguments:
+            captures (list): (start, end) tuples, in seconds since the epoch.
+
+        Returns:
+            None.
+        """
+
+        self._starts = sorted(start for start, end in captures)
+        self._boundaries = sorted(set(self._starts + [end for start, end in captures]))
+
+    def __len__(self):
+
+        return len(self._starts)
+
+    def capture_starting(self, now = None, lead = 0):
+
+        """Find a capture scheduled to start within lead seconds, or which
+        started less than GRACE seconds ago.
+
+        Arguments:
+            now (float): Time to look from, None for now.
+            lead (float): How many seconds early to count a capture as starting.
+
+        Returns:
+            Start time of the capture, or None if there isn't one.
+        """
+
+        if now is None:
+            now = pyliteco.clock.time()
+        index = bisect.bisect_right(self._starts, now + lead)
+        if index and self._starts[index - 1] > now - GRACE:
+            return self._starts[index - 1]
+        return None
+
+    def clamp_interval(self, interval, fast, now = None):
+
+        """Shorten a poll interval so polling is quick around each scheduled
+        start and end, and doesn't sleep through the start of that window.
+
+        Arguments:
+            interval (float): Seconds to wait before the next poll.
+            fast (float): Seconds between polls near a start or end.
+            now (float): Time to look from, None for now.
+
+        Returns:
+            Seconds to wait before the next poll.
+        """
+
+        if now is None:
+            now = pyliteco.clock.time()
+        index = bisect.bisect_right(self._boundaries, now)
+        if index and now - self._boundaries[index - 1] < WINDOW:
+            return min(interval, fast)
+        if index < len(self._boundaries):
+            until = self._boundaries[index] - now
+            if until < WINDOW:
+                return min(interval, fast)
+            return min(interval, until - WINDOW)
+        return interval
+
+
+def fetch_schedule(url):
+
+    """Get the scheduled captures from an echo box. Goes through urlopen,
+    so uses the shared keep-alive connection and details from pyliteco.session.
+
+    Arguments:
+        url (string): URL of the echo box.
+
+    Returns:
+        Schedule_Index of the captures.
+
+    Raises:
+        URLError: Couldn't get the schedule.
+        ValueError: Echo box didn't give a schedule.
+    """
+
+    body = urllib.request.urlopen(url + SCHEDULE_PATH, timeout = FETCH_TIMEOUT).read().decode('utf-8')
+    return Schedule_Index(parse_schedule(body))
+
+
+_executor = None
+
+
+def _submit(function, *args):
+
+    """Run a function on the threads shared for fetching schedules."""
+
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers = FETCH_THREADS,
+                                                          thread_name_prefix = 'schedule')
+    return _executor.submit(function, *args)
+
+
+class Schedule_Watcher(object):
+
+    """Keeps the schedule of one echo box up to date, and works out what
+    to do about it.
+
+    Instance attributes:
+        index (Schedule_Index): Latest schedule.
+
+    Methods:
+        held_state: Get the state to show ahead of a scheduled start.
+        refresh: Start getting the schedule again if it is due.
+        set_config: Pick up the settings from the config.
+    """
+
+    def __init__(self, config):
+
+        """Constructor.
+
+        Arguments:
+            config (dict): Config for the room.
+
+        Returns:
+            None.
+        """
+
+        self.index = Schedule_Index()
+        self._refresh_at = 0
+        self._fetching = None
+        self.set_config(config)
+
+    def set_config(self, config):
+
+        """Pick up the settings from the config: the echo box 'ip',
+        'schedule_refresh' (seconds between fetches, 0 to turn off) and
+        'schedule_prelight' (seconds before a scheduled start to light up,
+        0 to wait for the box).
+
+        Arguments:
+            config (dict): Config for the room.
+
+        Returns:
+            None.
+        """
+
+        self._url = config['ip']
+        self._refresh = config.get('schedule_refresh', 600)
+        self._prelight = config.get('schedule_prelight', 0)
+        if not self._refresh:
+            self.index = Schedule_Index()
+
+    def held_state(self, now = None):
+
+        """Get the state to show while the echo box still says it is waiting,
+        if a capture is due to start within the prelight time.
+
+        Arguments:
+            now (float): Time to look from, None for now.
+
+        Returns:
+            'active' if the light should be lit ahead of the box, else None.
+        """
+
+        if self._prelight and self.index.capture_starting(now, self._prelight) is not None:
+            return 'active'
+        return None
+
+    def refresh(self):
+
+        """Start getting the schedule again if it is due. The fetch runs in
+        the background, so a slow echo box doesn't hold up polling; index
+        is swapped for the new schedule when it arrives. Problems are
+        logged and the old schedule kept.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        if not self._refresh or pyliteco.clock.monotonic() < self._refresh_at:
+            return
+        if self._fetching is not None and not self._fetching.done():
+            return
+        self._refresh_at = pyliteco.clock.monotonic() + self._refresh
+        self._fetching = _submit(self._fetch, self._url)
+
+    def _fetch(self, url):
+
+        # Finishing is seen through the future refresh keeps, as this can
+        # finish before refresh has stored it
+        try:
+            index = fetch_schedule(url)
+        except (urllib.error.URLError, OSError, ValueError) as err:
+            logger.debug('Could not get schedule from %s: %s', url, err)
+        else:
+            if self._refresh and url == self._url:
+                # Config hasn't moved on while fetching
+                self.index = index
+            logger.debug('Got schedule with %d captures from %s', len(index), url)
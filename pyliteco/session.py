@@ -0,0 +1,447 @@
+"""Keep-alive, pre-authenticated HTTP connections for urllib.
+
+Installing the handler makes every urllib.request.urlopen call (so the echo
+box polls and the config fetches) reuse open connections instead of setting
+up a new TCP/TLS connection each time. Connections live in a shared pool, so
+they outlast the Echo360CaptureDevice objects made on each reconnect.
+
+This relies on echo360.capture_device making its requests with the global
+urllib.request.urlopen, as it can't be handed an opener. connect_echo in
+pyliteco.pyliteco checks that the first request went through the handler
+and warns if it didn't (the polls then still work, just without reuse).
+
+A request is only sent again on a new connection if it is idempotent
+(GET or HEAD) and failed before it was sent, so a pause or record can't
+reach the echo box twice.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import base64
+import http.client
+import io
+import logging
+import select
+import socket
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.response
+
+
+logger = logging.getLogger(__name__)
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+"""Methods that may be sent again on a new connection if sending fails."""
+REQUEST_TIMEOUT = 20
+"""Seconds a request that doesn't give its own timeout (e.g. from the
+echo360 library) waits on the server before failing."""
+
+
+class _Not_Sent(Exception):
+
+    """Sending a request failed, so the server can't have acted on it."""
+
+    def __init__(self, reason):
+
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+
+class Keep_Alive_Handler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+
+    """urllib handler keeping connections open between requests.
+
+    Instance attributes:
+        opened (int): Number of new connections made.
+        reused (int): Number of requests sent down an already open connection.
+        timeout (float): Seconds to wait for requests without their own timeout.
+
+    Methods:
+        abort: Close every connection to a host, including ones in use.
+        abort_all: Close every connection, including ones in use.
+        add_credentials: Send basic auth to a host without waiting to be asked.
+        close_all: Close every idle connection.
+        http_open: Open a http URL.
+        https_open: Open a https URL.
+        stats: Get the connection counters.
+    """
+
+    def __init__(self, context = None, timeout = REQUEST_TIMEOUT):
+
+        """Constructor.
+
+        Arguments:
+            context: SSL context for https connections, None for the default.
+            timeout (float): Seconds to wait for requests without their own timeout.
+
+        Returns:
+            None.
+        """
+
+        urllib.request.AbstractHTTPHandler.__init__(self)
+        self._context = context
+        self._credentials = {}
+        self._idle = {}
+        self._busy = {}
+        self.timeout = timeout
+        self._aborts = 0
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def abort_all(self):
+
+        """Close every connection, including ones a request is waiting on,
+        so a request hung on an unresponsive server fails straight away.
+
+        Arguments:
+            None.
+
+        Returns:
+            Number of connections that were in use.
+        """
+
+        return self._abort()
+
+    def abort(self, url):
+
+        """Close every connection to a host, including ones a request is
+        waiting on, leaving the connections to other hosts alone.
+
+        Arguments:
+            url (string): URL of the host.
+
+        Returns:
+            Number of connections that were in use.
+        """
+
+        return self._abort(urllib.parse.urlsplit(url).netloc)
+
+    def _abort(self, host = None):
+
+        with self._lock:
+            busy = [connection for connection, busy_host in self._busy.items()
+                    if host is None or busy_host == host]
+            self._aborts += 1
+        for connection in busy:
+            sock = connection.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.close_all(host)
+        return len(busy)
+
+    def add_credentials(self, url, user, password):
+
+        """Remember the details for a host, so each request is sent already
+        authenticated rather than being refused and sent again.
+
+        Arguments:
+            url (string): URL of the host.
+            user (string): User name.
+            password (string): Password.
+
+        Returns:
+            None.
+        """
+
+        auth = base64.b64encode('{}:{}'.format(user, password).encode('utf-8')).decode('ascii')
+        self._credentials[urllib.parse.urlsplit(url).netloc] = 'Basic ' + auth
+
+    def close_all(self, host = None):
+
+        """Close every idle connection. Ones in use are closed when handed back.
+
+        Arguments:
+            host (string): Only close connections to this host (as in a
+                URL, e.g. example.com:8080), None for every host.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            idle = dict((key, connections) for key, connections in self._idle.items()
+                        if host is None or key[1] == host)
+            for key in idle:
+                del self._idle[key]
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def stats(self):
+
+        """Get the connection counters.
+
+        Arguments:
+            None.
+
+        Returns:
+            Dict with the number of connections 'opened' and 'reused'.
+        """
+
+        with self._lock:
+            return {'opened': self.opened, 'reused': self.reused}
+
+    def _take(self, key, timeout):
+
+        """Get an idle connection that the server hasn't closed, set to
+        the timeout of the request about to go down it.
+
+        Returns:
+            http.client connection, None if there isn't one.
+        """
+
+        while True:
+            with self._lock:
+                try:
+                    connection = self._idle[key].pop()
+                except (KeyError, IndexError):
+                    return None
+            sock = connection.sock
+            try:
+                # An idle connection has nothing to read unless the server
+                # has closed it (or sent something it shouldn't have)
+                closed = sock is None or select.select([sock], [], [], 0)[0]
+            except (OSError, ValueError):
+                closed = True
+            if closed:
+                connection.close()
+                continue
+            connection.timeout = timeout
+            sock.settimeout(timeout)
+            return connection
+
+    def _give(self, key, connection):
+
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
+
+    def _send(self, connection, req, headers):
+
+        """Send the request and read the whole response, so the connection
+        is free for the next one.
+
+        Returns:
+            Tuple of the response and its body.
+
+        Raises:
+            _Not_Sent: Failed sending the request.
+            HTTPException, OSError: Failed after sending the request.
+        """
+
+        try:
+            if connection.sock is None:
+                # Connect first, so abort has a socket to shut down
+                connection.connect()
+        except (http.client.HTTPException, OSError) as err:
+            raise _Not_Sent(err)
+        with self._lock:
+            self._busy[connection] = req.host
+        try:
+            try:
+                connection.request(req.get_method(), req.selector, req.data, headers)
+            except (http.client.HTTPException, OSError) as err:
+                raise _Not_Sent(err)
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            with self._lock:
+                self._busy.pop(connection, None)
+
+    def _open(self, connection_class, req, **kwargs):
+
+        """Send a request down an idle connection if there is one,
+        otherwise open a new one.
+
+        Arguments:
+            connection_class: http.client connection class to use.
+            req: urllib.request.Request to send.
+
+        Returns:
+            File-like response, as from urllib.request.urlopen.
+
+        Raises:
+            URLError: Couldn't reach the server.
+        """
+
+        key = (connection_class, req.host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update((name, value) for name, value in req.headers.items() if name not in headers)
+        headers = dict((name.title(), value) for name, value in headers.items())
+        headers['Connection'] = 'keep-alive'
+        if 'Authorization' not in headers and req.host in self._credentials:
+            headers['Authorization'] = self._credentials[req.host]
+
+        timeout = req.timeout
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        aborts = self._aborts
+        connection = self._take(key, timeout)
+        response = None
+        if connection is not None:
+            try:
+                response, body = self._send(connection, req, headers)
+                with self._lock:
+                    self.reused += 1
+            except _Not_Sent as err:
+                connection.close()
+                if self._aborts != aborts or req.get_method() not in IDEMPOTENT_METHODS:
+                    # Closed by abort_all, or not safe to send twice
+                    raise urllib.error.URLError(err.reason)
+                # Server has closed the idle connection, so start again
+                logger.debug('Idle connection to %s closed, sending again.', req.host)
+            except (http.client.HTTPException, OSError) as err:
+                connection.close()
+                raise urllib.error.URLError(err)
+        if response is None:
+            connection = connection_class(req.host, timeout = timeout, **kwargs)
+            with self._lock:
+                self.opened += 1
+            try:
+                response, body = self._send(connection, req, headers)
+            except _Not_Sent as err:
+                connection.close()
+                raise urllib.error.URLError(err.reason)
+            except (http.client.HTTPException, OSError) as err:
+                connection.close()
+                raise urllib.error.URLError(err)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._give(key, connection)
+
+        ret_val = urllib.response.addinfourl(io.BytesIO(body), response.msg,
+                                             req.get_full_url(), response.status)
+        ret_val.msg = response.reason
+        return ret_val
+
+    def http_open(self, req):
+
+        return self._open(http.client.HTTPConnection, req)
+
+    def https_open(self, req):
+
+        return self._open(http.client.HTTPSConnection, req, context = self._context)
+
+
+_handler = None
+_verify_ssl = None
+
+
+def install(verify_ssl = True):
+
+    """Make urllib.request.urlopen use a shared keep-alive handler.
+    Safe to call more than once, the pool is only replaced if the
+    SSL settings change.
+
+    Arguments:
+        verify_ssl (bool): Check certificates on https connections.
+
+    Returns:
+        The installed Keep_Alive_Handler.
+    """
+
+    global _handler, _verify_ssl
+    if _handler is not None and _verify_ssl == verify_ssl:
+        return _handler
+    context = ssl.create_default_context()
+    if not verify_ssl:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if _handler is not None:
+        _handler.close_all()
+    _handler = Keep_Alive_Handler(context)
+    _verify_ssl = verify_ssl
+    urllib.request.install_opener(urllib.request.build_opener(_handler))
+    logger.debug('Installed keep-alive HTTP handler.')
+    return _handler
+
+
+def add_credentials(url, user, password):
+
+    """Register details for a host with the installed handler, if there is one.
+
+    Arguments:
+        url (string): URL of the host.
+        user (string): User name.
+        password (string): Password.
+
+    Returns:
+        None.
+    """
+
+    if _handler is not None:
+        _handler.add_credentials(url, user, password)
+
+
+def abort_all():
+
+    """Close every connection of the installed handler, including ones in
+    use, so any request hung on an unresponsive server fails.
+
+    Arguments:
+        None.
+
+    Returns:
+        Number of connections that were in use.
+    """
+
+    if _handler is None:
+        return 0
+    return _handler.abort_all()
+
+
+def abort(url):
+
+    """Close every connection of the installed handler to a host, including
+    ones in use, so a request hung on that server fails.
+
+    Arguments:
+        url (string): URL of the host.
+
+    Returns:
+        Number of connections that were in use.
+    """
+
+    if _handler is None:
+        return 0
+    return _handler.abort(url)
+
+
+def stats():
+
+    """Get the connection counters of the installed handler.
+
+    Arguments:
+        None.
+
+    Returns:
+        Dict with the number of connections 'opened' and 'reused'.
+    """
+
+    if _handler is None:
+        return {'opened': 0, 'reused': 0}
+    return _handler.stats()
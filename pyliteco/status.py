@@ -0,0 +1,115 @@
+"""Parse the status string given by an echo box.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import collections
+import functools
+import logging
+import types
+
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_SIZE = 64
+"""Number of different status strings to remember the parse of."""
+
+
+class StatusParseError(Exception):
+
+    """Echo box status string isn't in the expected format."""
+
+    pass
+
+
+class Echo_Status(collections.namedtuple('Echo_Status', ['state', 'fields', 'raw'])):
+
+    """Parsed echo box status. Immutable, so the same one can be handed
+    out each time the echo box gives the same status string.
+
+    Instance attributes:
+        state (string): State of the capture, e.g. 'active'.
+        fields (mapping): Every field in the status string, read only.
+        raw (string): The status string it was parsed from.
+
+    Methods:
+        get: Get a field from the status.
+    """
+
+    __slots__ = ()
+
+    def get(self, key, default = None):
+
+        """Get a field from the status.
+
+        Arguments:
+            key (string): Name of the field, e.g. 'Duration'.
+            default: Value to give if the field isn't there.
+
+        Returns:
+            Value of the field, as string, or default.
+        """
+
+        return self.fields.get(key, default)
+
+
+def parse_status(raw):
+
+    """Parse a status string ('Key=value;Key=value') in a single pass.
+    Status strings identical to one seen recently aren't parsed again.
+
+    The state is taken from the 'State' field, or failing that the first
+    field with 'State' in its name. Fields without an '=' are logged and
+    skipped, so an odd extra field doesn't lose the state.
+
+    Arguments:
+        raw (string): Status string, as from capture_status_str.
+
+    Returns:
+        Echo_Status.
+
+    Raises:
+        StatusParseError: Status isn't a string or has no state.
+    """
+
+    if not isinstance(raw, str):
+        # Checked before the cache, which can't take unhashable things
+        raise StatusParseError('Status is not a string: {!r}'.format(raw))
+    return _parse(raw)
+
+
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def _parse(raw):
+
+    fields = {}
+    state_key = None
+    for thing in raw.split(';'):
+        if not thing.strip():
+            continue
+        key, equals, value = thing.partition('=')
+        key = key.strip()
+        if not equals or not key:
+            logger.warning('Skipping bad field %r in status %r', thing, raw)
+            continue
+        fields[key] = value.strip()
+        if key == 'State' or (state_key is None and 'State' in key):
+            state_key = key
+    if state_key is None or not fields[state_key]:
+        raise StatusParseError('No state in status {!r}'.format(raw))
+    return Echo_Status(fields[state_key], types.MappingProxyType(fields), raw)
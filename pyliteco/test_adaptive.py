@@ -0,0 +1,107 @@
+"""Tests for pyliteco.adaptive.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import unittest
+
+import pyliteco.adaptive
+import pyliteco.clock
+import pyliteco.schedule
+
+
+class Poll_Scheduler_Test(unittest.TestCase):
+
+    def test_backs_off_to_longest(self):
+
+        scheduler = pyliteco.adaptive.Poll_Scheduler({'active': [1, 5]})
+        intervals = [scheduler.next_interval('active') for _ in range(6)]
+        self.assertEqual(intervals[0], 1)
+        self.assertEqual(intervals[1], 1 * pyliteco.adaptive.GROWTH)
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(intervals[-1], 5)
+
+    def test_change_of_state_polls_quickly(self):
+
+        scheduler = pyliteco.adaptive.Poll_Scheduler({'active': [1, 5], 'paused': [2, 8]})
+        for _ in range(5):
+            scheduler.next_interval('active')
+        self.assertEqual(scheduler.next_interval('paused'), 2)
+
+    def test_reset(self):
+
+        scheduler = pyliteco.adaptive.Poll_Scheduler({'active': [1, 5]})
+        for _ in range(5):
+            scheduler.next_interval('active')
+        scheduler.reset()
+        self.assertEqual(scheduler.next_interval('active'), 1)
+
+    def test_unknown_state(self):
+
+        scheduler = pyliteco.adaptive.Poll_Scheduler()
+        self.assertEqual(scheduler.next_interval('exploded'),
+                         pyliteco.adaptive.DEFAULT_POLL_INTERVALS['unknown'][0])
+
+    def test_overrides_keep_other_defaults(self):
+
+        scheduler = pyliteco.adaptive.Poll_Scheduler({'active': [2, 3]})
+        self.assertEqual(scheduler.intervals['active'], [2.0, 3.0])
+        self.assertEqual(scheduler.intervals['waiting'], pyliteco.adaptive.DEFAULT_POLL_INTERVALS['waiting'])
+
+    def test_backwards_interval_swapped(self):
+
+        with self.assertLogs('pyliteco.adaptive', 'WARNING'):
+            scheduler = pyliteco.adaptive.Poll_Scheduler({'active': [5, 1]})
+        self.assertEqual(scheduler.intervals['active'], [1.0, 5.0])
+
+    def test_bad_intervals_skipped(self):
+
+        bad = {'active': [0, 5], 'paused': [1], 'waiting': 'fast', 'complete': [1, float('inf')],
+               'inactive': [True, 5]}
+        with self.assertLogs('pyliteco.adaptive', 'ERROR') as logs:
+            scheduler = pyliteco.adaptive.Poll_Scheduler(bad)
+        self.assertEqual(len(logs.output), len(bad))
+        self.assertEqual(scheduler.intervals, pyliteco.adaptive.DEFAULT_POLL_INTERVALS)
+
+    def test_not_a_dict(self):
+
+        with self.assertLogs('pyliteco.adaptive', 'ERROR'):
+            scheduler = pyliteco.adaptive.Poll_Scheduler([1, 5])
+        self.assertEqual(scheduler.intervals, pyliteco.adaptive.DEFAULT_POLL_INTERVALS)
+
+    def test_clamped_by_schedule(self):
+
+        scheduler = pyliteco.adaptive.Poll_Scheduler({'inactive': [10, 10], 'waiting': [0.5, 1]})
+        schedule = pyliteco.schedule.Schedule_Index([(1000, 2000)])
+        # Woken in time for the window around the start
+        self._use_clock(1000 - pyliteco.schedule.WINDOW - 4)
+        self.assertEqual(scheduler.next_interval('inactive', schedule), 4)
+        # Polling quickly around the start
+        self._use_clock(1001)
+        self.assertEqual(scheduler.next_interval('inactive', schedule), 0.5)
+        # Nothing scheduled any more
+        self._use_clock(3000)
+        self.assertEqual(scheduler.next_interval('inactive', schedule), 10)
+
+    def _use_clock(self, epoch):
+
+        old = pyliteco.clock.use(pyliteco.clock.Virtual_Clock(epoch = epoch))
+        self.addCleanup(pyliteco.clock.use, old)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests for polling echo boxes from an asyncio event loop.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import asyncio
+import unittest
+import unittest.mock
+
+import pyliteco.test_support
+pyliteco.test_support.stub_echo360()
+
+import pyliteco.aio
+import pyliteco.rooms
+import pyliteco.test_rooms
+
+
+class Async_Room_Test(unittest.TestCase):
+
+    def _room(self):
+
+        return pyliteco.aio.Async_Room('a', pyliteco.test_rooms.room_config())
+
+    def test_same_state_as_thread_room(self):
+
+        # Both go through the echo360 client, so see the same status
+        for status, state in (('Time=0;State=active', 'active'),
+                              ('Time=0;CaptureState=paused', 'paused'),
+                              ('Time=0;State=inactive', 'inactive')):
+            thread_room = pyliteco.rooms.Room('a', pyliteco.test_rooms.room_config())
+            async_room = self._room()
+            with self.assertLogs('pyliteco', 'INFO'):
+                thread_room.step()
+                asyncio.run(async_room.step())
+            self.assertIsInstance(async_room.echo_device, pyliteco.aio.Async_Echo_Device)
+            thread_room.echo_device.status = status
+            thread_room.step()
+            async_room.echo_device.device.status = status
+            asyncio.run(async_room.step())
+            self.assertEqual(async_room.state, state)
+            self.assertEqual(thread_room.state, state)
+
+    def test_button(self):
+
+        room = self._room()
+        with self.assertLogs('pyliteco.aio', 'INFO'):
+            asyncio.run(room.step())
+        room.echo_device.device.status = 'State=active'
+        room.indi_device.read_switch = lambda: True
+        asyncio.run(room.step())
+        self.assertEqual(room.echo_device.device.pauses, 1)
+
+    def test_connect_failed(self):
+
+        room = self._room()
+        room.indi_device = unittest.mock.Mock()
+        with unittest.mock.patch.object(pyliteco.test_support.Stub_Connection_Test, 'success',
+                                        return_value = False), \
+                self.assertLogs('pyliteco.aio', 'ERROR'):
+            self.assertFalse(asyncio.run(room.connect()))
+        self.assertIsNone(room.echo_device)
+        self.assertTrue(room.error_flash)
+        self.assertTrue(room.indi_device.method_calls)
+        self.assertGreater(room.retry_at, 0)
+
+    def test_sleeps_until_due(self):
+
+        room = self._room()
+        steps = []
+
+        async def step():
+            steps.append(asyncio.get_running_loop().time())
+            room.retry_at = pyliteco.clock.monotonic() + (0.2 if len(steps) == 1 else 100)
+
+        async def run():
+            room.step = step
+            task = asyncio.get_running_loop().create_task(room.run())
+            await asyncio.sleep(0.5)
+            self.assertEqual(len(steps), 2)
+            # A new config is acted on straight away
+            room.apply_config(pyliteco.test_rooms.room_config(ip = 'http://127.0.0.1:2'))
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(steps), 3)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertGreaterEqual(steps[1] - steps[0], 0.2)
+
+    def test_error_reconnects_later(self):
+
+        room = self._room()
+
+        async def step():
+            raise OSError('gone')
+
+        async def run():
+            room.step = step
+            room.echo_device = unittest.mock.Mock()
+            task = asyncio.get_running_loop().create_task(room.run())
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        with self.assertLogs('pyliteco.aio', 'ERROR'):
+            asyncio.run(run())
+        self.assertIsNone(room.echo_device)
+        self.assertGreater(room.retry_at, pyliteco.clock.monotonic() + 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
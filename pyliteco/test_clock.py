@@ -0,0 +1,116 @@
+"""Tests for pyliteco.clock.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import threading
+import unittest
+
+import pyliteco.clock
+
+
+class Clock_Test(unittest.TestCase):
+
+    def test_wait_for_event(self):
+
+        clock = pyliteco.clock.Clock()
+        event = clock.event()
+        self.assertFalse(clock.wait(event, 0.01))
+        event.set()
+        self.assertTrue(clock.wait(event, 5))
+
+    def test_use(self):
+
+        virtual = pyliteco.clock.Virtual_Clock(start = 50)
+        old = pyliteco.clock.use(virtual)
+        try:
+            self.assertIs(pyliteco.clock.get(), virtual)
+            self.assertEqual(pyliteco.clock.monotonic(), 50)
+        finally:
+            self.assertIs(pyliteco.clock.use(old), virtual)
+        self.assertFalse(pyliteco.clock.get().virtual)
+
+
+class Virtual_Clock_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock(start = 100, epoch = 1000)
+
+    def _in_thread(self, function, *args):
+
+        results = []
+        thread = threading.Thread(target = lambda: results.append(function(*args)))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread, results
+
+    def test_time_only_moves_when_told(self):
+
+        self.assertEqual(self.clock.monotonic(), 100)
+        self.assertEqual(self.clock.time(), 1000)
+        self.clock.advance(2.5)
+        self.assertEqual(self.clock.monotonic(), 102.5)
+        self.assertEqual(self.clock.time(), 1002.5)
+
+    def test_wait_ends_when_clock_passes_it(self):
+
+        thread, results = self._in_thread(self.clock.wait, self.clock.event(), 10)
+        self.clock.settle(1)
+        self.clock.advance(9)
+        self.clock.settle(1)
+        self.clock.advance(1)
+        thread.join(5)
+        self.assertEqual(results, [False])
+
+    def test_wait_ends_when_event_set(self):
+
+        event = self.clock.event()
+        thread, results = self._in_thread(self.clock.wait, event, 10)
+        self.clock.settle(1)
+        event.set()
+        thread.join(5)
+        self.assertEqual(results, [True])
+        self.assertEqual(self.clock.monotonic(), 100)
+
+    def test_run_for_skips_between_waits(self):
+
+        ticks = []
+
+        def tick():
+            while self.clock.monotonic() < 130:
+                self.clock.sleep(7)
+                ticks.append(self.clock.monotonic())
+
+        thread, _ = self._in_thread(tick)
+        self.clock.run_for(30, 1)
+        self.assertEqual(ticks, [107, 114, 121, 128])
+        self.assertEqual(self.clock.monotonic(), 130)
+        self.clock.advance(5)
+        thread.join(5)
+        self.assertEqual(ticks[-1], 135)
+
+    def test_settle_times_out(self):
+
+        with self.assertRaises(RuntimeError):
+            self.clock.settle(1, timeout = 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
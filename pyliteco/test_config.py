@@ -0,0 +1,329 @@
+"""Tests for getting the config from the local file and the config server.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.parse
+
+import pyliteco.config
+
+
+COMBINED = '{"ip": "10.0.0.1", "active": {"colour": "red", "flash": false}}'
+"""Answer to ?all from a new config server."""
+LIGHT_STATES = '{"active": {"colour": "red", "flash": false}}'
+"""Answer to ?config from any config server."""
+
+
+class Config_Handler(http.server.BaseHTTPRequestHandler):
+
+    """Answers with whatever the server has for the query, noting each
+    request."""
+
+    def do_GET(self):
+
+        query = urllib.parse.urlsplit(self.path).query
+        self.server.requests.append((query, self.headers))
+        page = self.server.pages.get(query.split('&')[0], (404, {}, ''))
+        if callable(page):
+            page = page(self)
+        status, headers, body = page
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+
+        pass
+
+
+class Config_Server_Test(unittest.TestCase):
+
+    """Runs a config server on a spare port, with the config module's
+    caches emptied for each test."""
+
+    def setUp(self):
+
+        for name in ('_responses', '_light_state_configs', '_echo_configs', '_local_configs',
+                     '_subscribers', '_configs'):
+            patcher = unittest.mock.patch.object(pyliteco.config, name, {})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ('_separate_request_servers', '_polling_servers'):
+            patcher = unittest.mock.patch.object(pyliteco.config, name, set())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = unittest.mock.patch.object(pyliteco.config, '_change_listeners', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Config_Handler)
+        self.server.daemon_threads = True
+        self.server.pages = {}
+        self.server.requests = []
+        threading.Thread(target = self.server.serve_forever, args = (0.01,), daemon = True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/pyliteco.php'.format(self.server.server_address[1])
+
+    def queries(self):
+
+        return [query for query, headers in self.server.requests]
+
+
+class Conditional_Test(Config_Server_Test):
+
+    def test_not_modified(self):
+
+        self.server.pages['all'] = lambda handler: (
+            (304, {}, '') if handler.headers['If-None-Match'] == '"v1"'
+            else (200, {'ETag': '"v1"'}, COMBINED))
+        config = pyliteco.config.get_echo_config(self.url)
+        self.assertEqual(config['ip'], 'https://10.0.0.1')
+        self.assertIs(pyliteco.config.get_echo_config(self.url), config)
+        self.assertEqual(self.server.requests[1][1]['If-None-Match'], '"v1"')
+
+    def test_changed(self):
+
+        self.server.pages['all'] = (200, {'ETag': '"v1"'}, COMBINED)
+        config = pyliteco.config.get_echo_config(self.url)
+        self.server.pages['all'] = (200, {'ETag': '"v2"'}, COMBINED.replace('10.0.0.1', '10.0.0.2'))
+        new_config = pyliteco.config.get_echo_config(self.url)
+        self.assertIsNot(new_config, config)
+        self.assertEqual(new_config['ip'], 'https://10.0.0.2')
+
+    def test_same_body_gives_same_config(self):
+
+        # No validators, so the server sends it all again
+        self.server.pages['all'] = (200, {}, COMBINED)
+        config = pyliteco.config.get_echo_config(self.url)
+        self.assertIs(pyliteco.config.get_echo_config(self.url), config)
+        self.assertIsNone(self.server.requests[1][1]['If-None-Match'])
+
+
+class Combined_Test(Config_Server_Test):
+
+    def setUp(self):
+
+        Config_Server_Test.setUp(self)
+        self.server.pages['config'] = (200, {}, LIGHT_STATES)
+        self.server.pages[''] = (200, {}, '10.0.0.3')
+
+    def test_combined(self):
+
+        self.server.pages['all'] = (200, {}, COMBINED)
+        config = pyliteco.config.get_echo_config(self.url)
+        self.assertEqual(config['ip'], 'https://10.0.0.1')
+        self.assertEqual(self.queries(), ['all'])
+
+    def _check_separate(self):
+
+        with self.assertLogs('pyliteco.config', 'INFO'):
+            config = pyliteco.config.get_echo_config(self.url)
+        self.assertEqual(config['ip'], 'https://10.0.0.3')
+        self.assertEqual(config['active']['colour'], 'red')
+        self.assertIn(self.url, pyliteco.config._separate_request_servers)
+        # Doesn't ask for the combined config again
+        pyliteco.config.get_echo_config(self.url)
+        self.assertEqual(self.queries().count('all'), 1)
+
+    def test_not_combined_format(self):
+
+        self.server.pages['all'] = (200, {}, LIGHT_STATES)
+        self._check_separate()
+
+    def test_unparseable(self):
+
+        self.server.pages['all'] = (200, {}, '10.0.0.3')
+        self._check_separate()
+
+    def test_not_found(self):
+
+        self._check_separate()
+
+    def test_html(self):
+
+        self.server.pages['all'] = (200, {}, '<html><body>Hello</body></html>')
+        self._check_separate()
+
+    def test_empty(self):
+
+        self.server.pages['all'] = (200, {}, '')
+        self._check_separate()
+
+    def test_refused(self):
+
+        self.server.pages['all'] = (400, {}, 'Bad request')
+        self._check_separate()
+
+    def test_server_error_not_taken_as_old_server(self):
+
+        self.server.pages['all'] = (503, {}, 'Busy')
+        with self.assertRaises(urllib.error.HTTPError):
+            pyliteco.config.get_echo_config(self.url)
+        self.assertNotIn(self.url, pyliteco.config._separate_request_servers)
+
+    def test_get_config_uses_separate_requests(self):
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            with open(path, 'w') as file_:
+                json.dump({'server': self.url}, file_)
+            with self.assertLogs('pyliteco.config', 'INFO'):
+                config = pyliteco.config.get_config(path)
+        self.assertEqual(config['ip'], 'https://10.0.0.3')
+        self.assertEqual(config['server'], self.url)
+
+
+class Subscribe_Test(Config_Server_Test):
+
+    def _subscribe(self, *pages):
+
+        pages = list(pages)
+        self.server.pages['subscribe'] = lambda handler: pages.pop(0) if pages else (404, {}, '')
+        subscriber = pyliteco.config.Config_Subscriber(self.url, timeout = 5)
+        subscriber.start()
+        subscriber.join(5)
+        self.assertFalse(subscriber.is_alive())
+        return subscriber
+
+    def test_pushed_config(self):
+
+        listener = unittest.mock.Mock()
+        pyliteco.config.add_change_listener(listener)
+        with self.assertLogs('pyliteco.config', 'INFO'):
+            subscriber = self._subscribe((200, {'ETag': '"v1"'}, COMBINED), (204, {}, ''),
+                                         (304, {}, ''))
+        self.assertTrue(subscriber.changed.is_set())
+        self.assertEqual(subscriber.config['ip'], 'https://10.0.0.1')
+        self.assertEqual(listener.call_count, 1)
+        # Asks for anything newer than what it has
+        self.assertEqual(self.queries(), ['subscribe', 'subscribe&version=%22v1%22',
+                                          'subscribe&version=%22v1%22', 'subscribe&version=%22v1%22'])
+        # Last answer said the server stopped doing subscriptions
+        self.assertIn(self.url, pyliteco.config._polling_servers)
+
+    def test_not_a_subscription_server(self):
+
+        with self.assertLogs('pyliteco.config', 'INFO'):
+            subscriber = self._subscribe((200, {}, LIGHT_STATES))
+        self.assertIsNone(subscriber.config)
+        self.assertIn(self.url, pyliteco.config._polling_servers)
+
+    def test_get_subscribed_config(self):
+
+        self.server.pages['subscribe'] = (200, {'ETag': '"v1"'}, COMBINED)
+        # Nothing pushed yet, so fetched the normal way
+        with unittest.mock.patch.object(pyliteco.config.Config_Subscriber, 'start'):
+            self.assertIsNone(pyliteco.config._get_subscribed_config(self.url, True))
+            subscriber = pyliteco.config._subscribers[self.url]
+            subscriber.config = {'ip': 'https://10.0.0.1'}
+            subscriber.changed.set()
+            self.assertIs(pyliteco.config._get_subscribed_config(self.url, True), subscriber.config)
+        self.assertFalse(subscriber.changed.is_set())
+        # Turned off in the local config
+        self.assertIsNone(pyliteco.config._get_subscribed_config(self.url, False))
+        self.assertNotIn(self.url, pyliteco.config._subscribers)
+        self.assertFalse(subscriber.running)
+
+    def test_old_server_not_subscribed_to(self):
+
+        pyliteco.config._separate_request_servers.add(self.url)
+        self.assertIsNone(pyliteco.config._get_subscribed_config(self.url, True))
+        self.assertNotIn(self.url, pyliteco.config._subscribers)
+
+    def test_stop_while_server_gone(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+        subscriber = pyliteco.config.Config_Subscriber(self.url, timeout = 5)
+        subscriber.start()
+        # Let it find the server gone and start waiting to retry
+        time.sleep(0.1)
+        subscriber.stop()
+        subscriber.join(pyliteco.config.SUBSCRIBE_RETRY_INTERVAL / 2)
+        self.assertFalse(subscriber.is_alive())
+
+
+class Local_Config_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        patcher = unittest.mock.patch.object(pyliteco.config, '_local_configs', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'config.json')
+
+    def _write(self, config):
+
+        with open(self.path, 'w') as file_:
+            json.dump(config, file_)
+
+    def test_unchanged_not_read_again(self):
+
+        self._write({'indicator': 'dummy'})
+        config = pyliteco.config.get_local_config(self.path)
+        self.assertFalse(pyliteco.config.local_config_changed(self.path))
+        with unittest.mock.patch('builtins.open', side_effect = AssertionError('read again')):
+            self.assertIs(pyliteco.config.get_local_config(self.path), config)
+
+    def test_changed(self):
+
+        self._write({'indicator': 'dummy'})
+        pyliteco.config.get_local_config(self.path)
+        self._write({'indicator': 'delcom'})
+        self.assertTrue(pyliteco.config.local_config_changed(self.path))
+        self.assertTrue(pyliteco.config.config_changed(self.path))
+        self.assertEqual(pyliteco.config.get_local_config(self.path)['indicator'], 'delcom')
+        self.assertFalse(pyliteco.config.config_changed(self.path))
+
+    def test_never_read(self):
+
+        self._write({'indicator': 'dummy'})
+        self.assertTrue(pyliteco.config.local_config_changed(self.path))
+
+    def test_missing_file_created(self):
+
+        self.assertTrue(pyliteco.config.local_config_changed(self.path))
+        with self.assertLogs('pyliteco.config', 'WARNING'):
+            config = pyliteco.config.get_local_config(self.path)
+        self.assertEqual(config, pyliteco.config.EXAMPLE_CONFIG_JSON)
+        self.assertFalse(pyliteco.config.local_config_changed(self.path))
+
+    def test_bad_file(self):
+
+        with open(self.path, 'w') as file_:
+            file_.write('{"indicator": ')
+        with self.assertRaises(pyliteco.config.BadConfigError):
+            pyliteco.config.get_local_config(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Tests for pyliteco.lights.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import unittest
+
+import indicators.dummy
+import pyliteco.config
+import pyliteco.lights
+
+
+class Compile_Light_Action_Test(unittest.TestCase):
+
+    def test_single_colour(self):
+
+        action = pyliteco.lights.compile_light_action({'colour': 'red', 'flash': False, 'flash_speed': 1})
+        self.assertEqual(action, pyliteco.lights.Light_Action(('red',), False, None))
+
+    def test_flash_speed_only_needed_when_flashing(self):
+
+        action = pyliteco.lights.compile_light_action({'colour': 'red', 'flash': False})
+        self.assertEqual(action, pyliteco.lights.Light_Action(('red',), False, None))
+        with self.assertRaises(pyliteco.lights.LightConfigError):
+            pyliteco.lights.compile_light_action({'colour': 'red', 'flash': True})
+
+    def test_list_of_colours(self):
+
+        action = pyliteco.lights.compile_light_action({'colour': ['red', 'green'], 'flash': True,
+                                                       'flash_speed': '0.5'})
+        self.assertEqual(action, pyliteco.lights.Light_Action(('red', 'green'), True, 0.5))
+
+    def test_missing_entry(self):
+
+        with self.assertRaises(pyliteco.lights.LightConfigError):
+            pyliteco.lights.compile_light_action({'colour': 'red'})
+
+    def test_bad_values(self):
+
+        for entry in ({'colour': 'red', 'flash': True, 'flash_speed': 'fast'},
+                      {'colour': [], 'flash': False, 'flash_speed': 1},
+                      {'colour': 7, 'flash': False, 'flash_speed': 1}):
+            with self.assertRaises(pyliteco.lights.LightConfigError):
+                pyliteco.lights.compile_light_action(entry)
+
+    def test_colour_not_allowed(self):
+
+        with self.assertRaises(pyliteco.lights.LightConfigError):
+            pyliteco.lights.compile_light_action({'colour': 'blue', 'flash': False, 'flash_speed': 1},
+                                                 allowed_colours = ('red', 'green'))
+
+    def test_flash_colours(self):
+
+        flash_colours = ('red', 'green')
+        action = pyliteco.lights.compile_light_action({'colour': 'red', 'flash': True, 'flash_speed': 1},
+                                                      flash_colours = flash_colours)
+        self.assertTrue(action.flash)
+        with self.assertRaises(pyliteco.lights.LightConfigError):
+            pyliteco.lights.compile_light_action({'colour': ['red', 'green'], 'flash': True, 'flash_speed': 1},
+                                                 flash_colours = flash_colours)
+        with self.assertRaises(pyliteco.lights.LightConfigError):
+            pyliteco.lights.compile_light_action({'colour': 'off', 'flash': True, 'flash_speed': 1},
+                                                 flash_colours = flash_colours)
+        # Not flashing, so only the allowed colours matter
+        action = pyliteco.lights.compile_light_action({'colour': 'off', 'flash': False, 'flash_speed': 1},
+                                                      flash_colours = flash_colours)
+        self.assertEqual(action.colours, ('off',))
+
+
+class Compile_Light_Actions_Test(unittest.TestCase):
+
+    def test_every_state(self):
+
+        actions = pyliteco.lights.compile_light_actions(dict(pyliteco.config.DEFAULT_CONFIG_JSON,
+                                                             indicator = 'dummy'))
+        self.assertEqual(set(actions.keys()), set(pyliteco.lights.LIGHT_STATES))
+
+    def test_bad_entry_uses_default(self):
+
+        config = dict(pyliteco.config.DEFAULT_CONFIG_JSON, indicator = 'dummy',
+                      active = {'colour': 'red', 'flash': True})
+        with self.assertLogs('pyliteco.lights', 'ERROR'):
+            actions = pyliteco.lights.compile_light_actions(config)
+        self.assertEqual(actions['active'],
+                         pyliteco.lights.compile_light_action(pyliteco.config.DEFAULT_CONFIG_JSON['active']))
+
+
+class Light_Action_Test(unittest.TestCase):
+
+    def test_apply_only_changes_once(self):
+
+        device = indicators.dummy.Device()
+        action = pyliteco.lights.Light_Action(('green',), False, None)
+        self.assertTrue(action.apply(device))
+        self.assertFalse(action.apply(device))
+        self.assertEqual(device.display.colours, 'green')
+
+    def test_apply_flash(self):
+
+        device = indicators.dummy.Device()
+        action = pyliteco.lights.Light_Action(('red', 'green'), True, 0.5)
+        self.assertTrue(action.apply(device))
+        self.assertEqual(device.display.colours, ['red', 'green'])
+        self.assertTrue(device.display.flash)
+        device.flashing_stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
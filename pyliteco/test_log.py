@@ -0,0 +1,117 @@
+"""Tests for pyliteco.log.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import logging
+import sys
+import unittest
+import unittest.mock
+
+import pyliteco.log
+
+
+def _record(msg, *args, level = logging.WARNING, name = 'test'):
+
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+class Rate_Limit_Filter_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.now = 1000.0
+        patcher = unittest.mock.patch.object(pyliteco.log, 'time')
+        patcher.start().monotonic.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.filter = pyliteco.log.Rate_Limit_Filter(interval = 60)
+
+    def test_repeat_dropped_then_counted(self):
+
+        self.assertTrue(self.filter.filter(_record('Box %s gone', 'a')))
+        self.assertFalse(self.filter.filter(_record('Box %s gone', 'a')))
+        self.assertFalse(self.filter.filter(_record('Box %s gone', 'a')))
+        self.now += 60
+        record = _record('Box %s gone', 'a')
+        self.assertTrue(self.filter.filter(record))
+        self.assertEqual(record.suppressed, 2)
+        self.assertIn('[2 more like this not logged]', pyliteco.log.Formatter('%(message)s').format(record))
+
+    def test_different_messages_let_through(self):
+
+        self.assertTrue(self.filter.filter(_record('Box %s gone', 'a')))
+        self.assertTrue(self.filter.filter(_record('Box %s gone', 'b')))
+        self.assertTrue(self.filter.filter(_record('Box %s gone', 'a', level = logging.ERROR)))
+        self.assertTrue(self.filter.filter(_record('Box %s gone', 'a', name = 'other')))
+
+    def test_below_level_never_limited(self):
+
+        for _ in range(3):
+            self.assertTrue(self.filter.filter(_record('State %s', 'active', level = logging.INFO)))
+
+    def test_unhashable_arguments(self):
+
+        self.assertTrue(self.filter.filter(_record('Config %s', ['a'])))
+        self.assertFalse(self.filter.filter(_record('Config %s', ['a'])))
+
+    def test_forgets_old_messages(self):
+
+        self.assertTrue(self.filter.filter(_record('Box gone')))
+        self.now += 120
+        self.assertTrue(self.filter.filter(_record('Something else')))
+        self.assertEqual(len(self.filter._seen), 1)
+
+
+class Queue_Handler_Test(unittest.TestCase):
+
+    def test_mutable_arguments_formatted_when_queued(self):
+
+        handler = pyliteco.log.Queue_Handler(pyliteco.log.queue.Queue())
+        rooms = ['a']
+        handler.handle(_record('Rooms %s in %s', rooms, 'building'))
+        rooms.append('b')
+        handler.handle(_record('Room %s state %d', 'a', 3))
+        first, second = handler.queue.get_nowait(), handler.queue.get_nowait()
+        self.assertEqual(first.getMessage(), "Rooms ['a'] in building")
+        # Simple arguments are left for the listener
+        self.assertEqual(second.args, ('a', 3))
+
+    def test_traceback_turned_into_text(self):
+
+        handler = pyliteco.log.Queue_Handler(pyliteco.log.queue.Queue())
+        try:
+            raise ValueError('bad box')
+        except ValueError:
+            record = logging.LogRecord('test', logging.ERROR, __file__, 1, 'Failed', None, sys.exc_info())
+        handler.handle(record)
+        queued = handler.queue.get_nowait()
+        self.assertIsNone(queued.exc_info)
+        self.assertIn('ValueError: bad box', queued.exc_text)
+        self.assertIn('ValueError: bad box', pyliteco.log.Formatter('%(message)s').format(queued))
+
+    def test_drops_when_full(self):
+
+        handler = pyliteco.log.Queue_Handler(pyliteco.log.queue.Queue(1))
+        handler.handle(_record('one'))
+        handler.handle(_record('two'))
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), 'one')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Tests for pyliteco.metrics.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import unittest
+import urllib.error
+import urllib.request
+
+import pyliteco.metrics
+
+
+class Metric_Test(unittest.TestCase):
+
+    def test_counter(self):
+
+        counter = pyliteco.metrics.Counter('test_polls_total', 'Polls.', ('room',))
+        counter.inc('a')
+        counter.inc('a', amount = 2)
+        counter.inc('b')
+        self.assertEqual(counter.value('a'), 3)
+        self.assertEqual(counter.value('missing'), 0)
+        lines = counter.render()
+        self.assertIn('# TYPE test_polls_total counter', lines)
+        self.assertIn('test_polls_total{room="a"} 3', lines)
+
+    def test_histogram(self):
+
+        histogram = pyliteco.metrics.Histogram('test_seconds', 'Time taken.', (0.1, 1))
+        for seconds in (0.05, 0.5, 3):
+            histogram.observe(seconds)
+        lines = histogram.render()
+        # Buckets are cumulative
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count 3', lines)
+
+
+class Serve_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.addCleanup(pyliteco.metrics.serve, None)
+
+    def _port(self):
+
+        return pyliteco.metrics._server.server_address[1]
+
+    def test_metrics_page(self):
+
+        pyliteco.metrics.serve(0)
+        pyliteco.metrics.RECONNECTS.inc('test_room', 'ok')
+        response = urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(self._port()), timeout = 5)
+        self.assertEqual(response.headers['Content-Type'], pyliteco.metrics.CONTENT_TYPE)
+        body = response.read().decode('utf-8')
+        self.assertIn('# TYPE pyliteco_capture_status_seconds histogram', body)
+        self.assertIn('pyliteco_reconnects_total{room="test_room",result="ok"}', body)
+
+    def test_other_pages(self):
+
+        pyliteco.metrics.serve(0)
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen('http://127.0.0.1:{}/other'.format(self._port()), timeout = 5)
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_bad_port_leaves_metrics_off(self):
+
+        for port in ('metrics', [9100], 70000):
+            with self.assertLogs('pyliteco.metrics', 'ERROR'):
+                pyliteco.metrics.serve(port)
+            self.assertIsNone(pyliteco.metrics._server)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Tests for pyliteco.recorder.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import gzip
+import os
+import tempfile
+import unittest
+
+import pyliteco.recorder
+
+
+class Recorder_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _round_trip(self, name):
+
+        path = os.path.join(self.directory, name)
+        recorder = pyliteco.recorder.Recorder(path)
+        recorder.config({'user': 'secret', 'pass': 'secret', 'ip': 'http://box'})
+        recorder.status('a', 'State=active')
+        recorder.status('a', 'State=active')
+        recorder.status('b', 'State=waiting', 'active')
+        recorder.button('a', True)
+        recorder.button('a', False)
+        recorder.close()
+        return list(pyliteco.recorder.read_trace(path))
+
+    def test_round_trip(self):
+
+        events = self._round_trip('trace.jsonl')
+        self.assertEqual([(event.kind, event.room, event.data) for event in events],
+                         [('c', None, {'ip': 'http://box'}),
+                          ('s', 'a', ('State=active', None)),
+                          ('s', 'a', ('State=active', None)),
+                          ('s', 'b', ('State=waiting', 'active')),
+                          ('b', 'a', True),
+                          ('b', 'a', False)])
+        times = [event.time for event in events]
+        self.assertEqual(times, sorted(times))
+
+    def test_gzip(self):
+
+        self.assertEqual(len(self._round_trip('trace.jsonl.gz')), 6)
+
+    def test_repeats_not_written_in_full(self):
+
+        path = os.path.join(self.directory, 'trace.jsonl')
+        recorder = pyliteco.recorder.Recorder(path)
+        for _ in range(3):
+            recorder.status('a', 'State=active')
+        recorder.close()
+        with open(path) as file_:
+            self.assertEqual(sum('State=active' in line for line in file_), 1)
+
+    def test_unfinished_gzip_moved_aside(self):
+
+        path = os.path.join(self.directory, 'trace.jsonl.gz')
+        self._round_trip('trace.jsonl.gz')
+        # Cut off the end, as a crash would
+        with open(path, 'rb') as file_:
+            cut = file_.read()[:-8]
+        with open(path, 'wb') as file_:
+            file_.write(cut)
+        with self.assertLogs('pyliteco.recorder', 'WARNING'):
+            recorder = pyliteco.recorder.Recorder(path)
+        recorder.status('a', 'State=paused')
+        recorder.close()
+        self.assertEqual([event.data for event in pyliteco.recorder.read_trace(path)], [('State=paused', None)])
+        moved, = [name for name in os.listdir(self.directory) if name != 'trace.jsonl.gz']
+        self.assertTrue(moved.startswith('trace.jsonl.') and moved.endswith('.gz'))
+        # What was written before the crash can still be got at
+        with gzip.open(os.path.join(self.directory, moved), 'rt') as file_:
+            self.assertIn('"ip":"http://box"', file_.readline() + file_.readline())
+
+    def test_finished_gzip_appended_to(self):
+
+        self._round_trip('trace.jsonl.gz')
+        self.assertEqual(len(self._round_trip('trace.jsonl.gz')), 12)
+        self.assertEqual(os.listdir(self.directory), ['trace.jsonl.gz'])
+
+    def test_not_a_trace(self):
+
+        path = os.path.join(self.directory, 'other.jsonl')
+        with open(path, 'w') as file_:
+            file_.write('[1, "s", "a"]\n')
+        with self.assertRaises(pyliteco.recorder.TraceFormatError):
+            list(pyliteco.recorder.read_trace(path))
+
+    def test_bad_event_skipped(self):
+
+        path = os.path.join(self.directory, 'trace.jsonl')
+        recorder = pyliteco.recorder.Recorder(path)
+        recorder.status('a', 'State=active')
+        recorder.close()
+        with open(path, 'a') as file_:
+            file_.write('[1.0, "s"\n')
+        with self.assertLogs('pyliteco.recorder', 'WARNING'):
+            self.assertEqual(len(list(pyliteco.recorder.read_trace(path))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests for pyliteco.replay.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import unittest
+
+import pyliteco.test_support
+pyliteco.test_support.stub_echo360()
+
+import pyliteco.config
+import pyliteco.recorder
+import pyliteco.replay
+
+
+class Replay_Test(unittest.TestCase):
+
+    def _replay(self, events):
+
+        replay = pyliteco.replay.Replay()
+        replay.run(pyliteco.recorder.Trace_Event(*event) for event in events)
+        return replay
+
+    def test_changes(self):
+
+        replay = self._replay([(1, 'c', None, dict(pyliteco.config.DEFAULT_CONFIG_JSON)),
+                               (2, 's', 'default', ('State=inactive', None)),
+                               (3, 's', 'default', ('State=active', None)),
+                               (4, 'b', 'default', True),
+                               (5, 's', 'default', ('State=paused', None)),
+                               (6, 'b', 'default', True),
+                               (7, 's', 'default', ('State=', None))])
+        self.assertEqual([(change.time, change.kind) for change in replay.changes if change.kind != 'light'],
+                         [(2, 'state'), (3, 'state'), (4, 'pause'), (5, 'state'), (6, 'record'),
+                          (7, 'bad_status')])
+        self.assertEqual([change.value for change in replay.changes if change.kind == 'state'],
+                         ['inactive', 'active', 'paused'])
+        self.assertEqual((replay.first, replay.last), (1, 7))
+        self.assertEqual(replay.counts, {'c': 1, 's': 4, 'b': 2})
+
+    def test_light_follows_state(self):
+
+        replay = self._replay([(1, 's', 'default', ('State=active', None))])
+        light, = [change for change in replay.changes if change.kind == 'light']
+        self.assertEqual(light.value.colours,
+                         pyliteco.config.DEFAULT_CONFIG_JSON['active']['colour'])
+
+    def test_held_state_shown(self):
+
+        replay = self._replay([(1, 's', 'default', ('State=waiting', 'active'))])
+        self.assertEqual(replay.rooms['default'].state, 'active')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+"""Tests for running many rooms from one thread.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import socket
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.request
+
+import pyliteco.test_support
+pyliteco.test_support.stub_echo360()
+
+import pyliteco.clock
+import pyliteco.config
+import pyliteco.rooms
+import pyliteco.session
+
+
+def room_config(**overrides):
+
+    config = dict(pyliteco.config.DEFAULT_CONFIG_JSON)
+    config.update({'indicator': 'dummy', 'user': 'user', 'pass': 'pass', 'ip': 'http://127.0.0.1:1'})
+    config.update(overrides)
+    return config
+
+
+class Make_Room_Configs_Test(unittest.TestCase):
+
+    def test_rooms_override_shared(self):
+
+        configs = pyliteco.rooms.make_room_configs({'user': 'shared', 'ip': 'x',
+                                                    'rooms': [{'name': 'a', 'ip': 'a'}, {'ip': 'b'}]})
+        self.assertEqual(configs['a'], {'user': 'shared', 'ip': 'a', 'name': 'a'})
+        self.assertEqual(configs['room1'], {'user': 'shared', 'ip': 'b', 'name': 'room1'})
+
+    def test_no_rooms(self):
+
+        self.assertEqual(list(pyliteco.rooms.make_room_configs({'ip': 'x'})), ['default'])
+
+    def test_same_name_twice(self):
+
+        with self.assertLogs('pyliteco.rooms', 'WARNING'):
+            configs = pyliteco.rooms.make_room_configs({'rooms': [{'name': 'a', 'ip': '1'},
+                                                                  {'name': 'a', 'ip': '2'}]})
+        self.assertEqual(configs['a']['ip'], '2')
+
+
+class Room_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock(start = 100)
+        self.addCleanup(pyliteco.clock.use, pyliteco.clock.use(self.clock))
+        self.room = pyliteco.rooms.Room('a', room_config())
+
+    def test_connect_and_poll(self):
+
+        with self.assertLogs('pyliteco.rooms', 'INFO'):
+            self.room.step()
+        self.assertIsNotNone(self.room.indi_device)
+        self.assertIsNotNone(self.room.echo_device)
+        self.room.echo_device.status = 'Time=0;State=active'
+        self.room.step()
+        self.assertEqual(self.room.state, 'active')
+        self.assertGreater(self.room.retry_at, 100)
+        self.assertEqual(self.room.heartbeat.deadline, float('inf'))
+
+    def test_error_polling(self):
+
+        with self.assertLogs('pyliteco.rooms', 'INFO'):
+            self.room.step()
+        with unittest.mock.patch('pyliteco.pyliteco.check_status', side_effect = OSError('gone')), \
+                self.assertLogs('pyliteco.rooms', 'ERROR'):
+            self.room.step()
+        self.assertIsNone(self.room.echo_device)
+        self.assertEqual(self.room.retry_at, 160)
+        self.assertEqual(self.room.heartbeat.deadline, float('inf'))
+
+    def test_not_due(self):
+
+        self.room.retry_at = 101
+        self.room.step()
+        self.assertIsNone(self.room.indi_device)
+
+    def test_heartbeat_while_stepping(self):
+
+        deadlines = []
+        with unittest.mock.patch.object(self.room, 'open_indicator',
+                                        side_effect = lambda: deadlines.append(self.room.heartbeat.deadline)), \
+                self.assertLogs('pyliteco.rooms', 'INFO'):
+            self.room.step()
+        self.assertEqual(deadlines, [100 + pyliteco.rooms.STEP_TIMEOUT])
+
+
+class Stuck_Room_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock(start = 100)
+        self.addCleanup(pyliteco.clock.use, pyliteco.clock.use(self.clock))
+        self.abort = unittest.mock.Mock(return_value = 1)
+        patcher = unittest.mock.patch('pyliteco.session.abort', self.abort)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.supervisor = pyliteco.rooms.Supervisor_Thread()
+        self.supervisor.running = True
+        self.room = pyliteco.rooms.Room('a', room_config())
+        self.room.indi_device = unittest.mock.Mock()
+        self.supervisor.rooms['a'] = self.room
+        # As though its step hung on a worker thread
+        self.supervisor._busy[self.room] = [100, 0, []]
+        self.room.heartbeat.beat()
+        self.supervisor._pool = unittest.mock.Mock()
+
+    def test_tiers(self):
+
+        pool = self.supervisor._pool
+        self.assertEqual(self.supervisor.check_stuck(100), 100 + pyliteco.rooms.STEP_TIMEOUT)
+        self.clock.advance(pyliteco.rooms.STEP_TIMEOUT + 1)
+        with self.assertLogs('pyliteco.rooms', 'ERROR') as logs:
+            check_at = self.supervisor.check_stuck(self.clock.monotonic())
+        self.assertIn('dropped 1 HTTP connections', logs.output[0])
+        self.abort.assert_called_once_with('http://127.0.0.1:1')
+        self.assertEqual(check_at, self.clock.monotonic() + pyliteco.rooms.STEP_TIMEOUT)
+        self.assertIs(self.supervisor.rooms['a'], self.room)
+
+        self.clock.advance(pyliteco.rooms.STEP_TIMEOUT + 1)
+        with self.assertLogs('pyliteco.rooms', 'ERROR') as logs:
+            self.assertIsNone(self.supervisor.check_stuck(self.clock.monotonic()))
+        self.assertIn('starting the room again', logs.output[0])
+        new_room = self.supervisor.rooms['a']
+        self.assertIsNot(new_room, self.room)
+        # Same light, and the stuck step doesn't hold up the others
+        self.assertIs(new_room.indi_device, self.room.indi_device)
+        pool.shutdown.assert_called_once_with(wait = False)
+        self.assertIsNone(self.supervisor._pool)
+        self.assertEqual(self.supervisor.timers.pop_due(), [new_room])
+        # Given up on, so left alone from now on
+        self.clock.advance(1000)
+        self.assertIsNone(self.supervisor.check_stuck(self.clock.monotonic()))
+        self.assertEqual(self.abort.call_count, 1)
+
+    def test_stuck_step_finishing(self):
+
+        with self.assertLogs('pyliteco.rooms', 'ERROR'):
+            for tier in (1, 2):
+                self.clock.advance(pyliteco.rooms.STEP_TIMEOUT + 1)
+                self.supervisor.check_stuck(self.clock.monotonic())
+        new_room = self.supervisor.rooms['a']
+        indicator = self.room.indi_device
+        # Finishing lets go of the indicator, but the new room still has it
+        self.room.step = lambda: None
+        with self.assertLogs('pyliteco.rooms', 'WARNING'):
+            self.supervisor._run_step(self.room)
+        self.assertIsNone(self.room.indi_device)
+        self.assertIs(new_room.indi_device, indicator)
+        self.assertIs(self.supervisor.rooms['a'], new_room)
+        self.assertEqual(self.supervisor.timers.pop_due(), [new_room])
+
+
+class Hung_Request_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        # Accepts connections, never answers
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.addCleanup(self.listener.close)
+        self.url = 'http://127.0.0.1:{}/'.format(self.listener.getsockname()[1])
+        self.handler = pyliteco.session.Keep_Alive_Handler()
+        patcher = unittest.mock.patch.object(pyliteco.session, '_handler', self.handler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.opener = urllib.request.build_opener(self.handler)
+
+    def test_request_timeout(self):
+
+        self.handler.timeout = 0.1
+        with self.assertRaises(urllib.error.URLError):
+            self.opener.open(self.url)
+
+    def test_abort_frees_worker(self):
+
+        supervisor = pyliteco.rooms.Supervisor_Thread()
+        supervisor.running = True
+        self.addCleanup(supervisor.quit)
+        room = pyliteco.rooms.Room('a', room_config(ip = self.url))
+        room.indi_device = unittest.mock.Mock()
+        room.echo_device = unittest.mock.Mock()
+        supervisor.rooms['a'] = room
+        failed = threading.Event()
+
+        def poll():
+            try:
+                self.opener.open(self.url)
+            except urllib.error.URLError:
+                failed.set()
+                raise
+
+        with unittest.mock.patch.object(room, 'poll', poll), \
+                self.assertLogs('pyliteco.rooms', 'INFO') as logs:
+            supervisor.start_step(room)
+            # Wait for the request to be sent
+            give_up = time.monotonic() + 5
+            while not self.handler._busy and time.monotonic() < give_up:
+                time.sleep(0.01)
+            room.heartbeat.deadline = 0
+            supervisor.check_stuck(pyliteco.clock.monotonic())
+            self.assertTrue(failed.wait(5))
+            give_up = time.monotonic() + 5
+            while room in supervisor._busy and time.monotonic() < give_up:
+                time.sleep(0.01)
+        self.assertNotIn(room, supervisor._busy)
+        self.assertIn('dropped 1 HTTP connections', logs.output[0])
+        self.assertIs(supervisor.rooms['a'], room)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""Tests for pyliteco.schedule.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import threading
+import unittest
+import unittest.mock
+
+import pyliteco.clock
+import pyliteco.schedule
+
+
+SCHEDULE = '''<schedules>
+  <schedule><start-time>2015-07-09T10:00:00.000Z</start-time><duration>3000</duration></schedule>
+  <schedule><start-time>2015-07-09T09:00:00.000Z</start-time><duration>1800</duration></schedule>
+  <schedule><title>Nothing scheduled</title></schedule>
+</schedules>'''
+"""Schedule page with two captures, out of order."""
+NINE = 1436432400.0
+"""2015-07-09T09:00:00Z in seconds since the epoch."""
+
+
+class Parse_Schedule_Test(unittest.TestCase):
+
+    def test_captures(self):
+
+        self.assertEqual(sorted(pyliteco.schedule.parse_schedule(SCHEDULE)),
+                         [(NINE, NINE + 1800), (NINE + 3600, NINE + 6600)])
+
+    def test_not_xml(self):
+
+        with self.assertRaises(ValueError):
+            pyliteco.schedule.parse_schedule('<schedules>')
+
+    def test_bad_time(self):
+
+        with self.assertRaises(ValueError):
+            pyliteco.schedule.parse_schedule('<s><start-time>soon</start-time><duration>1</duration></s>')
+
+
+class Schedule_Index_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.index = pyliteco.schedule.Schedule_Index([(2000, 3000), (1000, 1500)])
+
+    def test_len(self):
+
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(len(pyliteco.schedule.Schedule_Index()), 0)
+
+    def test_capture_starting(self):
+
+        self.assertIsNone(self.index.capture_starting(900))
+        self.assertEqual(self.index.capture_starting(900, lead = 100), 1000)
+        self.assertEqual(self.index.capture_starting(1000 + pyliteco.schedule.GRACE - 1), 1000)
+        self.assertIsNone(self.index.capture_starting(1000 + pyliteco.schedule.GRACE))
+        self.assertEqual(self.index.capture_starting(1990, lead = 10), 2000)
+
+    def test_clamp_interval(self):
+
+        window = pyliteco.schedule.WINDOW
+        # Far from anything, wake up when the window before the start opens
+        self.assertEqual(self.index.clamp_interval(600, 1, 1000 - window - 100), 100)
+        self.assertEqual(self.index.clamp_interval(60, 1, 1000 - window - 100), 60)
+        # Either side of a start or end
+        self.assertEqual(self.index.clamp_interval(60, 1, 1000 - window + 1), 1)
+        self.assertEqual(self.index.clamp_interval(60, 1, 1500 + window - 1), 1)
+        # After the last end
+        self.assertEqual(self.index.clamp_interval(60, 1, 4000), 60)
+
+
+class Schedule_Watcher_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock(epoch = 1000)
+        old = pyliteco.clock.use(self.clock)
+        self.addCleanup(pyliteco.clock.use, old)
+
+    def test_held_state(self):
+
+        watcher = pyliteco.schedule.Schedule_Watcher({'ip': 'http://box', 'schedule_prelight': 60})
+        watcher.index = pyliteco.schedule.Schedule_Index([(1030, 2000)])
+        self.assertEqual(watcher.held_state(), 'active')
+        self.assertIsNone(watcher.held_state(900))
+        watcher.set_config({'ip': 'http://box', 'schedule_prelight': 0})
+        self.assertIsNone(watcher.held_state())
+
+    def test_refresh_in_background(self):
+
+        fetched = threading.Event()
+        release = threading.Event()
+        index = pyliteco.schedule.Schedule_Index([(1030, 2000)])
+
+        def fetch(url):
+            fetched.set()
+            release.wait(5)
+            return index
+
+        watcher = pyliteco.schedule.Schedule_Watcher({'ip': 'http://box', 'schedule_refresh': 600})
+        with unittest.mock.patch.object(pyliteco.schedule, 'fetch_schedule', side_effect = fetch) as mock_fetch:
+            watcher.refresh()
+            self.assertTrue(fetched.wait(5))
+            # Doesn't wait for the fetch, or start another while it runs
+            self.assertEqual(len(watcher.index), 0)
+            self.clock.advance(600)
+            watcher.refresh()
+            release.set()
+            watcher._fetching.result(5)
+            self.assertIs(watcher.index, index)
+            self.assertEqual(mock_fetch.call_args_list, [unittest.mock.call('http://box')])
+
+    def test_failed_refresh_keeps_schedule(self):
+
+        watcher = pyliteco.schedule.Schedule_Watcher({'ip': 'http://box'})
+        index = watcher.index = pyliteco.schedule.Schedule_Index([(1030, 2000)])
+        with unittest.mock.patch.object(pyliteco.schedule, 'fetch_schedule', side_effect = ValueError('bad')):
+            watcher.refresh()
+            watcher._fetching.result(5)
+        self.assertIs(watcher.index, index)
+
+    def test_refresh_turned_off(self):
+
+        watcher = pyliteco.schedule.Schedule_Watcher({'ip': 'http://box', 'schedule_refresh': 0})
+        with unittest.mock.patch.object(pyliteco.schedule, 'fetch_schedule') as mock_fetch:
+            watcher.refresh()
+        self.assertIsNone(watcher._fetching)
+        self.assertFalse(mock_fetch.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""Tests for the keep-alive HTTP session.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import http.server
+import socket
+import struct
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.request
+
+import pyliteco.session
+
+
+class Keep_Alive_Server_Handler(http.server.BaseHTTPRequestHandler):
+
+    """Answers every request with 'ok' down a keep-alive connection, noting
+    the connection and headers of each. /hang waits until the test is done,
+    /reset answers then resets the connection."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        self._answer()
+
+    def do_POST(self):
+
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._answer()
+
+    def _answer(self):
+
+        self.server.requests.append((self.command, self.path, self.connection.getpeername(), self.headers))
+        if self.path == '/hang':
+            self.server.release.wait(10)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+        if self.path == '/reset':
+            # Close with a reset rather than a FIN, once the answer has gone
+            self.wfile.flush()
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+
+        pass
+
+
+class Keep_Alive_Handler_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Keep_Alive_Server_Handler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.release = threading.Event()
+        threading.Thread(target = self.server.serve_forever, args = (0.01,), daemon = True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.server.release.set)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.handler = pyliteco.session.Keep_Alive_Handler()
+        self.addCleanup(self.handler.close_all)
+        self.opener = urllib.request.build_opener(self.handler)
+
+    def _get(self, path = '/', **kwargs):
+
+        return self.opener.open(urllib.request.Request(self.url + path, **kwargs), timeout = 5).read()
+
+    def test_reuses_connection(self):
+
+        for _ in range(3):
+            self.assertEqual(self._get(), b'ok')
+        self.assertEqual(self.handler.stats(), {'opened': 1, 'reused': 2})
+        self.assertEqual(len(set(peer for _, _, peer, _ in self.server.requests)), 1)
+
+    def test_credentials_sent_up_front(self):
+
+        self.handler.add_credentials(self.url, 'user', 'pass')
+        self._get()
+        self.assertEqual(self.server.requests[0][3]['Authorization'], 'Basic dXNlcjpwYXNz')
+
+    def test_idle_connection_closed_by_server(self):
+
+        self._get('/reset')
+        # Let the reset arrive
+        time.sleep(0.1)
+        self.assertEqual(self._get(), b'ok')
+        self.assertEqual(self.handler.stats(), {'opened': 2, 'reused': 0})
+
+    def _closed_unnoticed(self):
+
+        # As though the server closed it just after it was checked
+        self._get('/reset')
+        time.sleep(0.1)
+        patcher = unittest.mock.patch('select.select', return_value = ([], [], []))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_sent_again(self):
+
+        self._closed_unnoticed()
+        with self.assertLogs('pyliteco.session', 'DEBUG'):
+            self.assertEqual(self._get(), b'ok')
+        self.assertEqual(self.handler.stats(), {'opened': 2, 'reused': 0})
+        self.assertEqual([method for method, _, _, _ in self.server.requests], ['GET', 'GET'])
+
+    def test_post_not_sent_again(self):
+
+        self._closed_unnoticed()
+        with self.assertRaises(urllib.error.URLError):
+            self._get(data = b'pause', method = 'POST')
+        self.assertEqual([method for method, _, _, _ in self.server.requests], ['GET'])
+
+    def test_abort_all_ends_hung_request(self):
+
+        errors = []
+
+        def hang():
+            try:
+                self._get('/hang')
+            except urllib.error.URLError as err:
+                errors.append(err)
+
+        thread = threading.Thread(target = hang, daemon = True)
+        start = time.monotonic()
+        thread.start()
+        while not self.server.requests and time.monotonic() - start < 5:
+            time.sleep(0.01)
+        self.assertEqual(self.handler.abort_all(), 1)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        # Well before the request would have timed out
+        self.assertLess(time.monotonic() - start, 4)
+
+    def test_abort_leaves_other_hosts(self):
+
+        self._get()
+        self.handler._give(('other', 'example.com'), unittest.mock.Mock())
+        self.handler.abort('http://example.com')
+        self.assertNotIn(('other', 'example.com'), self.handler._idle)
+        self.assertEqual(self._get(), b'ok')
+        self.assertEqual(self.handler.stats()['reused'], 1)
+
+    def test_default_timeout(self):
+
+        self.handler.timeout = 0.1
+        start = time.monotonic()
+        with self.assertRaises(urllib.error.URLError):
+            self.opener.open(self.url + '/hang')
+        self.assertLess(time.monotonic() - start, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
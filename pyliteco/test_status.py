@@ -0,0 +1,81 @@
+"""Tests for pyliteco.status.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import unittest
+
+import pyliteco.status
+
+
+class Parse_Status_Test(unittest.TestCase):
+
+    def test_fields_and_state(self):
+
+        status = pyliteco.status.parse_status('Time=10;State=active;Duration= 60 ')
+        self.assertEqual(status.state, 'active')
+        self.assertEqual(status.get('Duration'), '60')
+        self.assertEqual(status.get('Missing', 'default'), 'default')
+        self.assertEqual(status.raw, 'Time=10;State=active;Duration= 60 ')
+
+    def test_state_from_field_named_like_state(self):
+
+        status = pyliteco.status.parse_status('Time=10;CaptureState=paused')
+        self.assertEqual(status.state, 'paused')
+
+    def test_state_field_preferred(self):
+
+        status = pyliteco.status.parse_status('OtherState=waiting;State=active')
+        self.assertEqual(status.state, 'active')
+
+    def test_malformed_fields_skipped(self):
+
+        with self.assertLogs('pyliteco.status', 'WARNING') as logs:
+            status = pyliteco.status.parse_status('junk;State=active;=nokey;;')
+        self.assertEqual(status.state, 'active')
+        self.assertEqual(dict(status.fields), {'State': 'active'})
+        self.assertEqual(len(logs.output), 2)
+
+    def test_no_state(self):
+
+        with self.assertRaises(pyliteco.status.StatusParseError):
+            pyliteco.status.parse_status('Time=10;Duration=60')
+        with self.assertRaises(pyliteco.status.StatusParseError):
+            pyliteco.status.parse_status('Time=10;State=')
+
+    def test_not_a_string(self):
+
+        with self.assertRaises(pyliteco.status.StatusParseError):
+            pyliteco.status.parse_status(None)
+        with self.assertRaises(pyliteco.status.StatusParseError):
+            pyliteco.status.parse_status(['State=active'])
+
+    def test_repeated_status_cached(self):
+
+        first = pyliteco.status.parse_status('Time=11;State=inactive')
+        self.assertIs(pyliteco.status.parse_status('Time=11;State=inactive'), first)
+
+    def test_fields_read_only(self):
+
+        status = pyliteco.status.parse_status('Time=12;State=active')
+        with self.assertRaises(TypeError):
+            status.fields['State'] = 'paused'
+
+
+if __name__ == '__main__':
+    unittest.main()
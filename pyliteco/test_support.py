@@ -0,0 +1,93 @@
+"""Helpers shared by the tests.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import importlib.util
+import sys
+import types
+
+
+class Stub_Connection_Test(object):
+
+    """Result of a stub echo box's connection test."""
+
+    def __init__(self, ok = True):
+
+        self.ok = ok
+
+    def success(self):
+
+        return self.ok
+
+
+class Stub_Echo_Device(object):
+
+    """Stands in for echo360.capture_device.Echo360CaptureDevice where the
+    echo360 library isn't installed. Gives whatever status it is set to and
+    counts the pauses and records asked for.
+
+    Instance attributes:
+        connection_test (Stub_Connection_Test): Whether it connected.
+        pauses (int): capture_pause calls.
+        records (int): capture_record calls.
+        status (string): Status string capture_status_str gives.
+    """
+
+    def __init__(self, server, username, password):
+
+        self.server = server
+        self.connection_test = Stub_Connection_Test()
+        self.status = 'Time=0;State=inactive'
+        self.pauses = 0
+        self.records = 0
+
+    def capture_status_str(self):
+
+        return self.status
+
+    def capture_pause(self):
+
+        self.pauses += 1
+
+    def capture_record(self):
+
+        self.records += 1
+
+
+def stub_echo360():
+
+    """Make echo360.capture_device importable, giving Stub_Echo_Device,
+    if the echo360 library isn't installed. Does nothing if it is.
+
+    Arguments:
+        None.
+
+    Returns:
+        None.
+    """
+
+    if 'echo360' in sys.modules or importlib.util.find_spec('echo360') is not None:
+        return
+    package = types.ModuleType('echo360')
+    package.__path__ = []
+    module = types.ModuleType('echo360.capture_device')
+    module.Echo360CaptureDevice = Stub_Echo_Device
+    package.capture_device = module
+    sys.modules['echo360'] = package
+    sys.modules['echo360.capture_device'] = module
@@ -0,0 +1,128 @@
+"""Tests for pyliteco.timer.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import threading
+import unittest
+
+import pyliteco.clock
+import pyliteco.timer
+
+
+class Timer_Heap_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock()
+        old = pyliteco.clock.use(self.clock)
+        self.addCleanup(pyliteco.clock.use, old)
+        self.timers = pyliteco.timer.Timer_Heap()
+
+    def test_pop_due_in_order(self):
+
+        self.timers.schedule(5, 'b')
+        self.timers.schedule(3, 'a')
+        self.timers.schedule(9, 'c')
+        self.assertEqual(len(self.timers), 3)
+        self.assertEqual(self.timers.next_due(), 3)
+        self.assertEqual(self.timers.pop_due(6), ['a', 'b'])
+        self.assertEqual(self.timers.pop_due(6), [])
+        self.assertEqual(len(self.timers), 1)
+
+    def test_schedule_replaces(self):
+
+        self.timers.schedule(3, 'a')
+        self.timers.schedule(8, 'a')
+        self.assertEqual(len(self.timers), 1)
+        self.assertEqual(self.timers.next_due(), 8)
+        self.assertEqual(self.timers.pop_due(5), [])
+        self.assertEqual(self.timers.pop_due(8), ['a'])
+
+    def test_cancel(self):
+
+        self.timers.schedule(3, 'a')
+        self.timers.schedule(4, 'b')
+        self.timers.cancel('a')
+        self.timers.cancel('missing')
+        self.assertEqual(self.timers.next_due(), 4)
+        self.assertEqual(self.timers.pop_due(10), ['b'])
+        self.assertIsNone(self.timers.next_due())
+
+    def test_same_time_in_order_scheduled(self):
+
+        for item in ('x', 'y', 'z'):
+            self.timers.schedule(1, item)
+        self.assertEqual(self.timers.pop_due(1), ['x', 'y', 'z'])
+
+    def test_wait_until_due(self):
+
+        self.timers.schedule(10, 'a')
+
+        def advance():
+            self.clock.settle(1)
+            self.clock.advance(9)
+            self.clock.settle(1)
+            self.clock.advance(1)
+
+        self.assertFalse(self._wait(advance))
+
+    def test_wait_cut_short_by_earlier_item(self):
+
+        self.timers.schedule(10, 'a')
+
+        def schedule_earlier():
+            self.clock.settle(1)
+            self.timers.schedule(2, 'b')
+            # Still waiting for 'a' unless the wait noticed 'b'
+            self.clock.settle(1)
+            self.clock.advance(2)
+
+        self.assertFalse(self._wait(schedule_earlier))
+
+    def test_wake(self):
+
+        self.timers.schedule(10, 'a')
+
+        def wake():
+            self.clock.settle(1)
+            self.timers.wake()
+
+        self.assertTrue(self._wait(wake))
+        self.assertEqual(self.clock.monotonic(), 0)
+
+    def test_wake_before_wait(self):
+
+        self.timers.wake()
+        self.assertTrue(self.timers.wait(5))
+
+    def _wait(self, drive):
+
+        # Wait on another thread while drive moves the clock
+        results = []
+        thread = threading.Thread(target = lambda: results.append(self.timers.wait()))
+        thread.daemon = True
+        thread.start()
+        drive()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        return results[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
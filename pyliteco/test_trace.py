@@ -0,0 +1,128 @@
+"""Tests for pyliteco.trace.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import pyliteco.trace
+
+
+class Trace_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sink = pyliteco.trace.add_sink(pyliteco.trace.Ring_Buffer_Sink(3))
+        self.addCleanup(pyliteco.trace.remove_sink, self.sink)
+
+    def test_no_sinks(self):
+
+        pyliteco.trace.remove_sink(self.sink)
+        self.assertIs(pyliteco.trace.span('idle'), pyliteco.trace._NULL_SPAN)
+
+    def test_span_recorded(self):
+
+        with pyliteco.trace.span('poll', room = 'a'):
+            pass
+        record, = self.sink.records()
+        self.assertEqual(record.name, 'poll')
+        self.assertEqual(record.attrs, {'room': 'a'})
+        self.assertIsNone(record.error)
+        self.assertGreaterEqual(record.duration, 0)
+
+    def test_error_recorded_and_raised(self):
+
+        with self.assertRaises(KeyError):
+            with pyliteco.trace.span('poll'):
+                raise KeyError('state')
+        self.assertEqual(self.sink.records()[-1].error, 'KeyError')
+
+    def test_traced(self):
+
+        @pyliteco.trace.traced('double')
+        def double(value):
+            return 2 * value
+
+        self.assertEqual(double(4), 8)
+        self.assertEqual([record.name for record in pyliteco.trace.recent()], ['double'])
+
+    def test_ring_buffer_keeps_newest(self):
+
+        for index in range(5):
+            with pyliteco.trace.span('poll', index = index):
+                pass
+        self.assertEqual([record.attrs['index'] for record in self.sink.records()], [2, 3, 4])
+        self.assertEqual(self.sink.records(seconds = -60), [])
+
+    def test_dump(self):
+
+        with pyliteco.trace.span('poll'):
+            pass
+        self.assertEqual(json.loads(pyliteco.trace.dump())['name'], 'poll')
+
+    def test_failing_sink_ignored(self):
+
+        def fail(record):
+            raise ValueError('sink broke')
+
+        failing = pyliteco.trace.add_sink(pyliteco.trace.Callback_Sink(fail))
+        self.addCleanup(pyliteco.trace.remove_sink, failing)
+        with self.assertLogs('pyliteco.trace', 'ERROR'):
+            with pyliteco.trace.span('poll'):
+                pass
+        self.assertEqual(len(self.sink.records()), 1)
+
+
+class JSON_Lines_Sink_Test(unittest.TestCase):
+
+    def test_spans_written_by_close(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'trace.jsonl')
+        sink = pyliteco.trace.add_sink(pyliteco.trace.JSON_Lines_Sink(path))
+        for index in range(100):
+            with pyliteco.trace.span('poll', index = index):
+                pass
+        pyliteco.trace.remove_sink(sink)
+        with open(path) as file_:
+            lines = [json.loads(line) for line in file_]
+        self.assertEqual([line['attrs']['index'] for line in lines], list(range(100)))
+        self.assertEqual(sink.dropped, 0)
+
+    def test_drops_when_full(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sink = pyliteco.trace.JSON_Lines_Sink(os.path.join(directory.name, 'trace.jsonl'), queue_size = 1)
+        # Writer stopped, so the queue fills
+        sink._listener.stop()
+        record = pyliteco.trace.Span_Record('poll', 0, 0, 'main', None, {})
+        sink.emit(record)
+        sink.emit(record)
+        self.assertEqual(sink.dropped, 1)
+        sink._listener.start()
+        with self.assertLogs('pyliteco.trace', 'WARNING'):
+            sink.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
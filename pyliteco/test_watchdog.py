@@ -0,0 +1,205 @@
+"""Tests for the heartbeat watchdog.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import threading
+import unittest
+import unittest.mock
+
+import pyliteco.test_support
+pyliteco.test_support.stub_echo360()
+
+import pyliteco.clock
+import pyliteco.watchdog
+
+
+class Stub_Thread(object):
+
+    """Stands in for the pyliteco thread, noting what the watchdog asks
+    of it."""
+
+    started = []
+
+    def __init__(self, kwargs):
+
+        self.alive = True
+        self.adopted = None
+        self.quit_called = False
+        self.woken = 0
+        Stub_Thread.started.append(self)
+
+    def start(self):
+
+        pass
+
+    def is_alive(self):
+
+        return self.alive
+
+    def wake(self):
+
+        self.woken += 1
+
+    def quit(self):
+
+        self.quit_called = True
+
+    def release_indicators(self):
+
+        return {'room': 'indicator'}
+
+    def adopt_indicators(self, indicators):
+
+        self.adopted = indicators
+
+
+class Heartbeat_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock(start = 100)
+        self.addCleanup(pyliteco.clock.use, pyliteco.clock.use(self.clock))
+        pyliteco.watchdog.reset()
+
+    def test_stalled(self):
+
+        self.assertEqual(pyliteco.watchdog.stalled(), [])
+        pyliteco.watchdog.heartbeat('poll', busy_for = 5)
+        self.clock.advance(5 + pyliteco.watchdog.HEARTBEAT_TIMEOUTS['poll'])
+        self.assertEqual(pyliteco.watchdog.stalled(), [])
+        self.clock.advance(1)
+        self.assertEqual(pyliteco.watchdog.stalled(), ['poll'])
+        pyliteco.watchdog.idle('poll')
+        self.assertEqual(pyliteco.watchdog.stalled(), [])
+
+    def test_superseded_thread_ignored(self):
+
+        def hung():
+            pyliteco.watchdog.supersede(threading.current_thread())
+            pyliteco.watchdog.heartbeat('hid')
+            pyliteco.watchdog.beat_function('hid')()
+
+        thread = threading.Thread(target = hung)
+        thread.start()
+        thread.join(5)
+        self.assertEqual(pyliteco.watchdog.heartbeats['hid'].deadline, float('inf'))
+
+
+class Recover_Test(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = pyliteco.clock.Virtual_Clock(start = 100)
+        self.addCleanup(pyliteco.clock.use, pyliteco.clock.use(self.clock))
+        Stub_Thread.started = []
+        patcher = unittest.mock.patch('pyliteco.pyliteco.Main_Thread', Stub_Thread)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.abort_all = unittest.mock.Mock(return_value = 2)
+        patcher = unittest.mock.patch('pyliteco.session.abort_all', self.abort_all)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watchdog = pyliteco.watchdog.Watchdog_Thread()
+        self.watchdog.pyliteco_thread = Stub_Thread({})
+        pyliteco.watchdog.reset()
+
+    def _recover(self, components = ['poll']):
+
+        with self.assertLogs('pyliteco.watchdog', 'WARNING') as logs:
+            self.watchdog.recover(components)
+        return logs.output[0]
+
+    def test_tiers(self):
+
+        first = self.watchdog.pyliteco_thread
+        # Tier 1, just drop the connections
+        self.assertIn('dropped 2 HTTP connections', self._recover())
+        self.abort_all.assert_called_once_with()
+        self.assertIs(self.watchdog.pyliteco_thread, first)
+        self.assertEqual(first.woken, 1)
+        self.assertEqual(pyliteco.watchdog.stalled(), [])
+        # Tier 2, new thread with the same indicators
+        self.clock.advance(30)
+        self.assertIn('same indicator', self._recover())
+        second = self.watchdog.pyliteco_thread
+        self.assertIsNot(second, first)
+        self.assertTrue(first.quit_called)
+        self.assertEqual(second.adopted, {'room': 'indicator'})
+        # Tier 3, from scratch
+        self.clock.advance(30)
+        self._recover()
+        third = self.watchdog.pyliteco_thread
+        self.assertTrue(second.quit_called)
+        self.assertEqual(third.adopted, {})
+        # Stays at 3 while it keeps hanging
+        self.clock.advance(30)
+        self._recover()
+        self.assertEqual(self.watchdog.pyliteco_thread.adopted, {})
+        self.assertEqual(self.abort_all.call_count, 1)
+
+    def test_back_to_tier_one_after_window(self):
+
+        self._recover()
+        self.clock.advance(pyliteco.watchdog.RECOVERY_WINDOW + 1)
+        self.assertIn('dropped', self._recover())
+        self.assertEqual(self.abort_all.call_count, 2)
+
+    def test_hid_hang_restarts_from_scratch(self):
+
+        first = self.watchdog.pyliteco_thread
+        self._recover(['hid', 'poll'])
+        self.abort_all.assert_not_called()
+        self.assertTrue(first.quit_called)
+        self.assertEqual(self.watchdog.pyliteco_thread.adopted, {})
+
+    def test_dead_thread_restarts_from_scratch(self):
+
+        first = self.watchdog.pyliteco_thread
+        first.alive = False
+        self.assertIn('died', self._recover())
+        self.abort_all.assert_not_called()
+        self.assertEqual(first.woken, 0)
+        self.assertIsNot(self.watchdog.pyliteco_thread, first)
+        self.assertEqual(self.watchdog.pyliteco_thread.adopted, {})
+
+    def test_run_notices_dead_thread(self):
+
+        # Stubs don't stop, they have never really run
+        Stub_Thread.stop = Stub_Thread.join = lambda self: None
+        self.addCleanup(delattr, Stub_Thread, 'stop')
+        self.addCleanup(delattr, Stub_Thread, 'join')
+        Stub_Thread.started = []
+        self.watchdog.running = True
+        thread = threading.Thread(target = self.watchdog.run, daemon = True)
+        thread.start()
+        self.clock.settle(1)
+        # Its poll isn't late yet, but it won't ever be on time again
+        Stub_Thread.started[0].alive = False
+        with self.assertLogs('pyliteco.watchdog', 'WARNING') as logs:
+            self.clock.advance(pyliteco.watchdog.CHECK_INTERVAL)
+            self.clock.settle(1)
+        self.watchdog.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIn('died', logs.output[0])
+        self.assertEqual(len(Stub_Thread.started), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+"""Timer heap for waking things up when they are due, without polling.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+
+import pyliteco.clock
+
+
+logger = logging.getLogger(__name__)
+
+
+class Timer_Heap(object):
+
+    """Items (e.g. rooms) each due at a pyliteco.clock.monotonic() value,
+    kept in a heap so finding the next one is cheap however many there are.
+    Waiting sleeps on the clock until the earliest item is due, so items
+    that aren't due cost nothing, and wake() interrupts the wait straight away.
+
+    Methods:
+        cancel: Forget an item.
+        next_due: Get when the earliest item is due.
+        pop_due: Take every item that is due.
+        schedule: Set when an item is due.
+        wait: Sleep until an item is due or something wakes the heap.
+        wake: Interrupt a wait.
+    """
+
+    def __init__(self):
+
+        """Constructor.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # Set when the earliest item changes or wake() is called
+        self._changed = pyliteco.clock.event()
+        self._woken = False
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._entries)
+
+    def cancel(self, item):
+
+        """Forget an item, if it is in the heap.
+
+        Arguments:
+            item: Item to forget.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            entry = self._entries.pop(item, None)
+            if entry is not None:
+                # Left in the heap, but skipped when it comes up
+                entry[-1] = None
+
+    def next_due(self):
+
+        """Get when the earliest item is due.
+
+        Arguments:
+            None.
+
+        Returns:
+            pyliteco.clock.monotonic() value, or None if there is nothing in the heap.
+        """
+
+        with self._lock:
+            self._drop_cancelled()
+            if self._heap:
+                return self._heap[0][0]
+            return None
+
+    def pop_due(self, now = None):
+
+        """Take every item that is due, earliest first.
+
+        Arguments:
+            now (float): pyliteco.clock.monotonic() value to count as now, None for now.
+
+        Returns:
+            List of items.
+        """
+
+        if now is None:
+            now = pyliteco.clock.monotonic()
+        items = []
+        with self._lock:
+            self._drop_cancelled()
+            while self._heap and self._heap[0][0] <= now:
+                item = heapq.heappop(self._heap)[-1]
+                del self._entries[item]
+                items.append(item)
+                self._drop_cancelled()
+        return items
+
+    def schedule(self, due, item):
+
+        """Set when an item is due, replacing any time already set for it.
+        Wakes a wait if the item is now the earliest.
+
+        Arguments:
+            due (float): pyliteco.clock.monotonic() value the item is due at.
+            item: Item to schedule. Must be hashable.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            old = self._entries.pop(item, None)
+            if old is not None:
+                old[-1] = None
+            entry = [due, next(self._counter), item]
+            self._entries[item] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._changed.set()
+
+    def wait(self, until = None):
+
+        """Sleep until the earliest item is due, the time given, or wake()
+        is called, whichever comes first.
+
+        Arguments:
+            until (float): pyliteco.clock.monotonic() value to wait no longer
+                than, None to wait for an item or wake().
+
+        Returns:
+            True if woken by wake(), else False.
+        """
+
+        while True:
+            # Cleared before looking, so a change from now on ends the wait
+            self._changed.clear()
+            with self._lock:
+                if self._woken:
+                    self._woken = False
+                    return True
+                self._drop_cancelled()
+                due = until
+                if self._heap and (due is None or self._heap[0][0] < due):
+                    due = self._heap[0][0]
+            timeout = None
+            if due is not None:
+                timeout = due - pyliteco.clock.monotonic()
+                if timeout <= 0:
+                    return False
+            pyliteco.clock.wait(self._changed, timeout)
+
+    def wake(self):
+
+        """Interrupt a wait, or the next one if nothing is waiting.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        with self._lock:
+            self._woken = True
+        self._changed.set()
+
+    def _drop_cancelled(self):
+
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
@@ -0,0 +1,418 @@
+"""Named timing spans around the hot paths, sent to pluggable sinks.
+
+With no sink attached, a span is one check of an empty list, so the hooks
+can stay in place all the time. Attach a Ring_Buffer_Sink (e.g. with
+"trace": {"buffer": 20000} in the config) to keep the last few thousand
+timings for looking at after an incident.
+
+Author: Robert Walker <rrah99@gmail.com>
+
+Copyright (C) 2015 Robert Walker
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; version 2.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+import collections
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+Span_Record = collections.namedtuple('Span_Record', ['name', 'start', 'duration', 'thread', 'error', 'attrs'])
+"""Finished span: name, start (seconds since the epoch), duration (seconds),
+thread name, exception class name or None, and dict of extra attributes."""
+
+QUEUE_SIZE = 10000
+"""Spans a JSON_Lines_Sink holds waiting to be written before dropping them."""
+
+_sinks = []
+"""Attached sinks. Replaced rather than changed, so it can be read without a lock."""
+_configured_sinks = []
+"""Sinks attached by configure, as opposed to add_sink."""
+_lock = threading.Lock()
+
+
+def _record_to_dict(record):
+
+    return {'name': record.name, 'start': record.start, 'duration': record.duration,
+            'thread': record.thread, 'error': record.error, 'attrs': record.attrs}
+
+
+class Sink(object):
+
+    """Somewhere finished spans go. Subclass and overload emit.
+
+    Methods:
+        close: Let go of anything the sink holds open.
+        emit: Take a finished span.
+    """
+
+    def emit(self, record):
+
+        """Take a finished span. Called from whichever thread ran the span,
+        so should be quick.
+
+        Arguments:
+            record (Span_Record): The span.
+
+        Returns:
+            None.
+        """
+
+        pass
+
+    def close(self):
+
+        """Let go of anything the sink holds open.
+
+        Arguments:
+            None.
+
+        Returns:
+            None.
+        """
+
+        pass
+
+
+class Ring_Buffer_Sink(Sink):
+
+    """Keeps the most recent spans in memory.
+
+    Instance attributes:
+        size (int): Most spans kept.
+
+    Methods:
+        records: Get the spans kept, optionally only recent ones.
+    """
+
+    def __init__(self, size = 10000):
+
+        """Constructor.
+
+        Arguments:
+            size (int): Most spans to keep.
+
+        Returns:
+            None.
+        """
+
+        self.size = size
+        self._records = collections.deque(maxlen = size)
+
+    def emit(self, record):
+
+        # deque.append is thread safe
+        self._records.append(record)
+
+    def records(self, seconds = None):
+
+        """Get the spans kept, oldest first.
+
+        Arguments:
+            seconds (float): Only give spans started this many seconds ago
+                or later, None for all of them.
+
+        Returns:
+            List of Span_Record.
+        """
+
+        records = list(self._records)
+        if seconds is not None:
+            since = time.time() - seconds
+            records = [record for record in records if record.start >= since]
+        return records
+
+
+class _Line_Writer(object):
+
+    """Writes span records as JSON lines for a QueueListener, flushing
+    once the queue has been emptied rather than after every line."""
+
+    def __init__(self, file_, queue_):
+
+        self._file = file_
+        self._queue = queue_
+
+    def handle(self, record):
+
+        self._file.write(json.dumps(_record_to_dict(record)) + '\n')
+        if self._queue.empty():
+            self._file.flush()
+
+
+class JSON_Lines_Sink(Sink):
+
+    """Appends each span to a file as a line of JSON. Spans are put on a
+    queue and written by a background thread, as pyliteco.log does for log
+    records, so a slow disk never holds up the thread that ran the span.
+
+    Instance attributes:
+        path (string): File written to.
+        dropped (int): Spans dropped because the queue was full.
+    """
+
+    def __init__(self, path, queue_size = QUEUE_SIZE):
+
+        """Constructor.
+
+        Arguments:
+            path (string): File to append to.
+            queue_size (int): Spans to hold waiting to be written.
+
+        Returns:
+            None.
+        """
+
+        self.path = path
+        self.dropped = 0
+        self._file = open(path, 'a')
+        self._queue = queue.Queue(queue_size)
+        self._listener = logging.handlers.QueueListener(self._queue, _Line_Writer(self._file, self._queue))
+        self._listener.start()
+
+    def emit(self, record):
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+
+        """Write out whatever is waiting and close the file."""
+
+        self._listener.stop()
+        self._file.close()
+        if self.dropped:
+            logger.warning('%d trace spans not written to %s as the queue was full.', self.dropped, self.path)
+
+
+class Callback_Sink(Sink):
+
+    """Hands each span to a function."""
+
+    def __init__(self, callback):
+
+        """Constructor.
+
+        Arguments:
+            callback: Function taking a Span_Record.
+
+        Returns:
+            None.
+        """
+
+        self._callback = callback
+
+    def emit(self, record):
+
+        self._callback(record)
+
+
+class Span(object):
+
+    """Times the code in a with block and sends the result to the sinks."""
+
+    __slots__ = ('name', 'attrs', '_start', '_wall')
+
+    def __init__(self, name, attrs):
+
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        duration = time.perf_counter() - self._start
+        record = Span_Record(self.name, self._wall, duration, threading.current_thread().name,
+                             None if exc_type is None else exc_type.__name__, self.attrs)
+        for sink in _sinks:
+            try:
+                sink.emit(record)
+            except Exception:
+                logger.exception('Trace sink failed.')
+        return False
+
+
+class _Null_Span(object):
+
+    """Stands in for Span when there are no sinks."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        return False
+
+
+_NULL_SPAN = _Null_Span()
+
+
+def span(name, **attrs):
+
+    """Time a with block, e.g. with pyliteco.trace.span('check_status'):
+
+    Arguments:
+        name (string): Name of the span.
+        attrs: Anything else to record with the span.
+
+    Returns:
+        Context manager.
+    """
+
+    if not _sinks:
+        return _NULL_SPAN
+    return Span(name, attrs)
+
+
+def traced(name):
+
+    """Decorator timing every call of a function as a span.
+
+    Arguments:
+        name (string): Name of the span.
+
+    Returns:
+        Decorator.
+    """
+
+    def decorate(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return function(*args, **kwargs)
+            with Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_sink(sink):
+
+    """Start sending spans to a sink.
+
+    Arguments:
+        sink (Sink): Sink to add.
+
+    Returns:
+        The sink.
+    """
+
+    global _sinks
+    with _lock:
+        _sinks = _sinks + [sink]
+    return sink
+
+
+def remove_sink(sink):
+
+    """Stop sending spans to a sink, and close it.
+
+    Arguments:
+        sink (Sink): Sink to remove.
+
+    Returns:
+        None.
+    """
+
+    global _sinks
+    with _lock:
+        _sinks = [other for other in _sinks if other is not sink]
+    sink.close()
+
+
+_settings = None
+
+
+def configure(settings):
+
+    """Attach the sinks asked for in the config, replacing those from
+    last time. Safe to call on every config load.
+
+    Arguments:
+        settings (dict): 'buffer' (number of spans to keep in memory)
+            and/or 'file' (JSON lines file to append to), None for no sinks.
+
+    Returns:
+        None.
+    """
+
+    global _settings
+    if settings == _settings:
+        return
+    _settings = settings
+    for sink in list(_configured_sinks):
+        remove_sink(sink)
+    del _configured_sinks[:]
+    if not settings:
+        return
+    if settings.get('buffer'):
+        _configured_sinks.append(add_sink(Ring_Buffer_Sink(int(settings['buffer']))))
+    if settings.get('file'):
+        try:
+            _configured_sinks.append(add_sink(JSON_Lines_Sink(settings['file'])))
+        except OSError as err:
+            logger.error('Can not write trace to %s: %s', settings['file'], err)
+
+
+def recent(seconds = None):
+
+    """Get the spans kept by the ring buffer sinks, oldest first.
+
+    Arguments:
+        seconds (float): Only give spans started this many seconds ago or
+            later, None for all of them.
+
+    Returns:
+        List of Span_Record.
+    """
+
+    records = []
+    for sink in _sinks:
+        if isinstance(sink, Ring_Buffer_Sink):
+            records.extend(sink.records(seconds))
+    return sorted(records, key = lambda record: record.start)
+
+
+def dump(seconds = None):
+
+    """Get the recent spans as JSON lines, for looking at after an incident.
+
+    Arguments:
+        seconds (float): Only give spans started this many seconds ago or
+            later, None for all of them.
+
+    Returns:
+        String with one JSON object per line.
+    """
+
+    return ''.join(json.dumps(_record_to_dict(record)) + '\n' for record in recent(seconds))
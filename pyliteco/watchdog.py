@@ -18,24 +18,215 @@ Copyright (C) 2015 Robert Walker
     51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 """
 import logging
+import pyliteco.clock
+import pyliteco.metrics
 import pyliteco.pyliteco
-import queue
+import pyliteco.session
 import threading
-
-from time import sleep
+import weakref
 
 logger = logging.getLogger(__name__)
 
-watchdog_queue = queue.Queue()
+HEARTBEAT_TIMEOUTS = {'poll': 10, 'hid': 10, 'config': 60}
+"""Seconds past when it said it would check in before each component counts as hung."""
+CHECK_INTERVAL = 1
+"""Seconds between checks of the heartbeats."""
+RECOVERY_WINDOW = 60
+"""Seconds after a recovery in which another hang is dealt with more harshly."""
+
+
+class Heartbeat(object):
+    
+    """Deadline for one component of the pyliteco thread to check in by.
+    Beating just overwrites a pyliteco.clock.monotonic() value, so is cheap enough
+    for every loop.
+    
+    Instance attributes:
+        deadline (float): pyliteco.clock.monotonic() value the component is hung
+            after, infinity while it has nothing to do.
+        name (string): Name of the component, for the logs.
+        timeout (float): Seconds allowed on top of what the component says.
+        
+    Methods:
+        beat: Say the component is alive.
+        idle: Say the component has nothing to do, so can't hang.
+    """
+    
+    __slots__ = ('deadline', 'name', 'timeout')
+    
+    def __init__(self, name, timeout):
+        
+        """Constructor.
+        
+        Arguments:
+            name (string): Name of the component.
+            timeout (float): Seconds allowed between beats.
+            
+        Returns:
+            None.
+        """
+        
+        self.name = name
+        self.timeout = timeout
+        self.deadline = float('inf')
+    
+    def beat(self, busy_for = 0):
+        
+        """Say the component is alive, and how long it will be (e.g.
+        sleeping) before it beats again.
+        
+        Arguments:
+            busy_for (float): Seconds until the next beat.
+            
+        Returns:
+            None.
+        """
+        
+        self.deadline = pyliteco.clock.monotonic() + busy_for + self.timeout
+    
+    def idle(self):
+        
+        """Say the component has nothing to do until it next beats.
+        
+        Arguments:
+            None.
+            
+        Returns:
+            None.
+        """
+        
+        self.deadline = float('inf')
+
+
+def _new_heartbeats():
+    
+    return dict((name, Heartbeat(name, timeout)) for name, timeout in HEARTBEAT_TIMEOUTS.items())
+
+
+heartbeats = _new_heartbeats()
+"""Heartbeat of each component, by name, for the current pyliteco thread."""
+_superseded = weakref.WeakSet()
+"""Threads replaced after hanging, whose heartbeats are ignored."""
+
+
+def heartbeat(component = 'poll', busy_for = 0):
+    
+    """Tell the watchdog a component is alive, and how long it will be
+    (e.g. sleeping) before it checks in again. Ignored from a thread
+    that has been superseded.
+    
+    Arguments:
+        component (string): 'poll', 'hid' or 'config'.
+        busy_for (float): Seconds until the next heartbeat.
+        
+    Returns:
+        None.
+    """
+    
+    if threading.current_thread() not in _superseded:
+        heartbeats[component].beat(busy_for)
+
+
+def idle(component):
+    
+    """Tell the watchdog a component has nothing to do, so isn't expected
+    to check in. Ignored from a thread that has been superseded.
+    
+    Arguments:
+        component (string): 'poll', 'hid' or 'config'.
+        
+    Returns:
+        None.
+    """
+    
+    if threading.current_thread() not in _superseded:
+        heartbeats[component].idle()
+
+
+def beat_function(component):
+    
+    """Get a function beating a component's heartbeat, for background I/O
+    (e.g. an indicator's button reader) to call from its own thread. It
+    beats the heartbeats of the current pyliteco thread, even once they
+    have been replaced by reset.
+    
+    Arguments:
+        component (string): 'poll', 'hid' or 'config'.
+        
+    Returns:
+        Function taking no arguments.
+    """
+    
+    if threading.current_thread() in _superseded:
+        return _ignore
+    return heartbeats[component].beat
+
+
+def _ignore():
+    
+    pass
+
+
+def supersede(thread):
+    
+    """Ignore heartbeats from a hung thread that is being replaced, so
+    when it finally returns it can't beat for, or idle, the new thread.
+    
+    Arguments:
+        thread (threading.Thread): Thread being replaced.
+        
+    Returns:
+        None.
+    """
+    
+    _superseded.add(thread)
+
+
+def reset():
+    
+    """Start new heartbeats for a new thread, which has the usual time to
+    make its first poll beat. Anything still holding a beat method of the
+    old ones (e.g. the button reader of an indicator not handed over)
+    beats on those, which nothing watches.
+    
+    Arguments:
+        None.
+        
+    Returns:
+        None.
+    """
+    
+    global heartbeats
+    heartbeats = _new_heartbeats()
+    heartbeats['poll'].beat()
+
+
+def stalled(now = None):
+    
+    """Find the components that are past their deadline.
+    
+    Arguments:
+        now (float): pyliteco.clock.monotonic() value to check against, None for now.
+        
+    Returns:
+        List of component names, empty if all is well.
+    """
+    
+    if now is None:
+        now = pyliteco.clock.monotonic()
+    return sorted(beat.name for beat in heartbeats.values() if now > beat.deadline)
+
 
 class Watchdog_Thread(object):
     
     
-    def __init__(self, **args):
+    def __init__(self, multi_room = False, async_mode = False, **args):
         
         """Construct the thread with required arguements.
         
         Arguments:
+            multi_room (bool): Run every room in the config from one thread.
+            async_mode (bool): Poll the rooms from an asyncio event loop.
             config_file (string): Location of the local config file.
             
         Returns:
@@ -43,6 +234,20 @@ class Watchdog_Thread(object):
         """
         
         self._args = args
+        self._recovered_at = None
+        self._tier = 0
+        if async_mode:
+            import pyliteco.aio
+            self._thread_class = pyliteco.aio.Async_Supervisor_Thread
+        elif multi_room:
+            import pyliteco.rooms
+            self._thread_class = pyliteco.rooms.Supervisor_Thread
+        else:
+            # Imported here too, as the imports above make the name local
+            import pyliteco.pyliteco
+            self._thread_class = pyliteco.pyliteco.Main_Thread
+        # After the imports above, which make the name local
+        self._wakeup = pyliteco.clock.event()
     
     def is_running(self):
         
@@ -57,22 +262,76 @@ class Watchdog_Thread(object):
         
         return self.running
     
+    def recover(self, components):
+        
+        """Get the pyliteco thread going again, doing as little as will work:
+            1. Drop every HTTP connection, so a request hung on the echo
+               box or config server fails and the thread carries on.
+            2. Start a new thread, handing over the open indicators so the
+               light doesn't change.
+            3. Start a new thread from scratch.
+        Each hang within RECOVERY_WINDOW of the last goes a tier further.
+        A hang in the indicator itself, or a thread that has died, goes
+        straight to 3.
+        
+        Arguments:
+            components (list): Names of the components that have stalled.
+            
+        Returns:
+            None.
+        """
+        
+        now = pyliteco.clock.monotonic()
+        if self._recovered_at is None or now - self._recovered_at > RECOVERY_WINDOW:
+            self._tier = 0
+        self._recovered_at = now
+        alive = self.pyliteco_thread.is_alive()
+        if 'hid' in components or not alive:
+            self._tier = 3
+        else:
+            self._tier = min(self._tier + 1, 3)
+        names = ', '.join(components)
+        pyliteco.metrics.WATCHDOG_RECOVERIES.inc(str(self._tier))
+        
+        if self._tier == 1:
+            aborted = pyliteco.session.abort_all()
+            logger.warning('pyliteco thread hung in %s, dropped %d HTTP connections.', names, aborted)
+            for component in components:
+                # Give it time to notice
+                heartbeat(component)
+            self.pyliteco_thread.wake()
+            return
+        
+        indicators = {}
+        supersede(self.pyliteco_thread)
+        if not alive:
+            logger.warning('pyliteco thread died, restarting.')
+        elif self._tier == 2:
+            logger.warning('pyliteco thread hung in %s, restarting with the same indicator.', names)
+            indicators = self.pyliteco_thread.release_indicators()
+        else:
+            logger.warning('pyliteco thread hung in %s, restarting.', names)
+        self.pyliteco_thread.quit()
+        reset()
+        self.pyliteco_thread = self._thread_class(kwargs = self._args)
+        self.pyliteco_thread.adopt_indicators(indicators)
+        self.pyliteco_thread.start()
+    
     def run(self):
         
         logger.info('Starting watchdog thread')
-        self.pyliteco_thread = pyliteco.pyliteco.Main_Thread(kwargs = self._args)
+        reset()
+        self.pyliteco_thread = self._thread_class(kwargs = self._args)
         self.pyliteco_thread.start()
         while self.is_running():
-            try:
-                watchdog_queue.get(True, 10)
-                logger.debug('Got message from pyliteco thread.')
-            except queue.Empty:
-                # Nothing's been added to the queue in 10 seconds, thread has hung
-                logger.warning('pyliteco thread hung, restarting.')
-                self.pyliteco_thread.quit()
-                self.pyliteco_thread = pyliteco.pyliteco.Main_Thread(kwargs = self._args)
-                self.pyliteco_thread.start()
-        self.pyliteco_thread.running = False
+            pyliteco.clock.wait(self._wakeup, CHECK_INTERVAL)
+            if not self.is_running():
+                break
+            components = stalled()
+            if components or not self.pyliteco_thread.is_alive():
+                # Something has missed its deadline, thread has hung (or died)
+                self.recover(components)
+        self.pyliteco_thread.stop()
         self.pyliteco_thread.join()
         logger.info('Closing watchdog thread')
         
@@ -88,6 +347,7 @@ class Watchdog_Thread(object):
         """
         
         self.running = True
+        self._wakeup.clear()
         self.run()
         
     def stop(self):
@@ -101,4 +361,5 @@ class Watchdog_Thread(object):
             None.
         """
         
-        self.running = False
\ No newline at end of file
+        self.running = False
+        self._wakeup.set()
\ No newline at end of file
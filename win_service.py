@@ -26,6 +26,7 @@ import win32service
 import win32event
 import win32timezone
 
+import pyliteco.log
 import pyliteco.pyliteco
 import pyliteco.version
 
@@ -81,14 +82,8 @@ class pyliteco_svc (win32serviceutil.ServiceFramework):
             None
         """
         
-        formatter_string = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        formatter = logging.Formatter(formatter_string)
-        logging.basicConfig(filename = '{}\pyliteco\pyliteco.log'.format(os.environ['PROGRAMFILES']), format = formatter_string)
-        root = logging.getLogger()
-        nthandler = logging.handlers.NTEventLogHandler('PyLiteCo')
-        root.addHandler(nthandler)
-        
-        root.setLevel(logging.INFO)
+        pyliteco.log.start(filename = '{}\pyliteco\pyliteco.log'.format(os.environ['PROGRAMFILES']),
+                           event_log = 'PyLiteCo', level = logging.INFO)
         
         logger = logging.getLogger(__name__)
         
@@ -98,6 +93,7 @@ class pyliteco_svc (win32serviceutil.ServiceFramework):
                     config_file_entered = '{}\pyliteco\pyliteco.json'.format(
                                                     os.environ['PROGRAMFILES']))
         self.thread.start()
+        pyliteco.log.stop()
 
 if __name__ == '__main__':
     if len(sys.argv) == 1: